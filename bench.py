@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark replay offline untuk seluruh pipeline update bot.
+
+Korpus update (sintetis atau rekaman) diputar ke handler hasil build_app()
+dengan stub Bot API lokal, jadi tidak butuh jaringan maupun token asli.
+Laporan: throughput, latensi p50/p95/p99 per update, dan alokasi per update.
+
+Contoh:
+    python bench.py                          # 20.000 update sintetis
+    python bench.py -n 5000 --api-latency 80 # simulasi RTT Telegram 80 ms
+    UPDATE_CONCURRENCY=32 python bench.py --api-latency 80
+    python bench.py --corpus rekaman.jsonl   # satu JSON update per baris
+    python bench.py --alloc --json hasil.json
+    python bench.py --broadcast 50000 --blocked 0.05  # pengumuman ke 50.000 chat
+    python bench.py --taps 6 --real-limits   # 1 chat menekan 6 tombol, chat lain tertahan?
+
+Batas rate limiter dinaikkan secara default agar yang diukur adalah bot,
+bukan jeda flood control; set RATE_* sendiri atau --real-limits (batas asli
+main.py) untuk mengukur limiter.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# harus sebelum import main: konfigurasi dibaca saat import
+REAL_LIMITS = "--real-limits" in sys.argv[1:]
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+if not REAL_LIMITS:
+    os.environ.setdefault("RATE_GLOBAL_PER_SEC", "1e9")
+    os.environ.setdefault("RATE_CHAT_PER_SEC", "1e9")
+    os.environ.setdefault("RATE_CHAT_BURST", "1e9")
+    os.environ.setdefault("RATE_GROUP_PER_MIN", "1e9")
+os.environ.setdefault("CONTENT_POLL_SEC", "0")
+os.environ.setdefault("STATE_DB", "")  # state hanya di memori
+os.environ.setdefault("BOOKING_DB", "")  # antrean loket hanya di memori
+os.environ.setdefault("BROADCAST_RATE", "1e9")
+os.environ.setdefault("GUARD_LIMIT", "0")  # korpus sintetis mengirim puluhan pesan per chat
+os.environ.setdefault("GUARD_TAP_LIMIT", "0")
+os.environ.setdefault("BACKLOG_RATE", "1e9")  # korpus rekaman bertanggal lama, jangan dianggap antrean
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+import main
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Dukcapil", "username": "dukcapil_bench_bot"}
+
+
+# =========================================================
+# STUB BOT API (TANPA JARINGAN)
+# =========================================================
+class StubBotAPI(BaseRequest):
+    """Lapisan request PTB yang menjawab sendiri seperti Bot API.
+
+    `latency` (detik) mensimulasikan RTT ke Telegram; `calls` menghitung
+    panggilan per endpoint; `sent` menyimpan (chat_id, text) terakhir bila
+    `record=True`; chat di `blocked` dijawab 403 seperti bot yang diblokir.
+    """
+
+    def __init__(self, latency: float = 0.0, record: bool = False, blocked: frozenset = frozenset()) -> None:
+        self.latency = latency
+        self.record = record
+        self.blocked = blocked
+        self.calls: Counter = Counter()
+        self.sent: List[Tuple[object, str]] = []
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, params: Dict[str, object]) -> Dict[str, object]:
+        self._message_id += 1
+        return {
+            "message_id": params.get("message_id") or self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id", 0), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def result_for(self, endpoint: str, params: Dict[str, object]) -> object:
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "editMessageText"):
+            return self._message(params)
+        if endpoint == "getUpdates":
+            return []
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.record and "text" in params:
+            self.sent.append((params.get("chat_id"), params["text"]))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if params.get("chat_id") in self.blocked:
+            body = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            return 403, json.dumps(body).encode()
+        body = {"ok": True, "result": self.result_for(endpoint, params)}
+        return 200, json.dumps(body).encode()
+
+
+# =========================================================
+# KORPUS SINTETIS
+# =========================================================
+FILLERS_BEFORE = ["", "", "mau tanya", "min", "kak", "permisi", "gimana cara", "syarat", "tolong info"]
+FILLERS_AFTER = ["", "", "?", "dong", "apa aja", "gimana ya", "kak", "min", "bisa online?"]
+NOISE = ["halo", "selamat pagi", "terima kasih", "ok", "p", "assalamualaikum", "bot ya?", "test"]
+COMMANDS = ["/start", "/menu", "/help", "/info", "/sidnok", "/about"]
+
+
+def typo(word: str, rnd: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rnd.randrange(1, len(word) - 1)
+    op = rnd.randrange(4)
+    if op == 0:  # huruf hilang
+        return word[:i] + word[i + 1:]
+    if op == 1:  # tertukar
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    if op == 2:  # dobel
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + rnd.choice("aiueo") + word[i + 1:]  # vokal salah
+
+
+def free_text(rnd: random.Random, phrases: List[str]) -> str:
+    if rnd.random() < 0.1:
+        return rnd.choice(NOISE)
+    words = rnd.choice(phrases).split()
+    if rnd.random() < 0.3:
+        words = [typo(w, rnd) if rnd.random() < 0.5 else w for w in words]
+    text = " ".join(w for w in (rnd.choice(FILLERS_BEFORE), *words, rnd.choice(FILLERS_AFTER)) if w)
+    return text.capitalize() if rnd.random() < 0.3 else text
+
+
+def synthetic_corpus(n: int, chats: int, mix: Tuple[float, float, float], seed: int) -> List[dict]:
+    """Update campuran: teks bebas (dengan salah ketik), tekan tombol, dan perintah."""
+    rnd = random.Random(seed)
+    snap = main.CONTENT
+    phrases = [p for kws in snap.keywords.values() for p in kws]
+    callbacks = sorted(snap.callback_keys)
+    p_text, p_cb, _ = mix
+    out = []
+    for i in range(1, n + 1):
+        chat = {"id": 10_000 + rnd.randrange(chats), "type": "private"}
+        user = {"id": chat["id"], "is_bot": False, "first_name": "Warga"}
+        msg = {"message_id": i, "date": int(time.time()), "chat": chat, "from": user}
+        r = rnd.random()
+        if r < p_text:
+            out.append({"update_id": i, "message": {**msg, "text": free_text(rnd, phrases)}})
+        elif r < p_text + p_cb:
+            out.append({
+                "update_id": i,
+                "callback_query": {
+                    "id": str(i),
+                    "from": user,
+                    "chat_instance": str(chat["id"]),
+                    "data": rnd.choice(callbacks),
+                    "message": {**msg, "from": BOT_USER, "text": "menu"},
+                },
+            })
+        else:
+            cmd = rnd.choice(COMMANDS)
+            entity = {"type": "bot_command", "offset": 0, "length": len(cmd)}
+            out.append({"update_id": i, "message": {**msg, "text": cmd, "entities": [entity]}})
+    return out
+
+
+def load_corpus(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# =========================================================
+# REPLAY & LAPORAN
+# =========================================================
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def replay(app, updates: List[Update], alloc: bool) -> Tuple[float, List[float], List[int]]:
+    """Putar update seperti Application: berurutan, atau paralel dibatasi
+    concurrent_updates (dispatch ChatOrderedApplication ikut teruji)."""
+    latencies: List[float] = []
+    peaks: List[int] = []
+
+    async def one(update: Update) -> None:
+        if alloc:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        await app.process_update(update)
+        latencies.append(time.perf_counter() - t0)
+        if alloc:
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+
+    start = time.perf_counter()
+    if app.concurrent_updates:
+        sem = asyncio.BoundedSemaphore(app.concurrent_updates)
+
+        async def bounded(update: Update) -> None:
+            async with sem:
+                await one(update)
+
+        await asyncio.gather(*(bounded(u) for u in updates))
+    else:
+        for u in updates:
+            await one(u)
+    return time.perf_counter() - start, latencies, peaks
+
+
+async def run(args: argparse.Namespace) -> Dict[str, object]:
+    stub = StubBotAPI(latency=args.api_latency / 1000)
+    app = main.build_app(request=stub)
+    raw = load_corpus(args.corpus) if args.corpus else synthetic_corpus(
+        args.n, args.chats, tuple(args.mix), args.seed
+    )
+    async with app:
+        updates = [Update.de_json(u, app.bot) for u in raw]
+        # pemanasan singkat agar inisialisasi awal tidak ikut terukur
+        await replay(app, updates[: min(200, len(updates))], alloc=False)
+        stub.calls.clear()
+        main.METRICS.reset()
+        main.STATE.forget_updates()  # update pemanasan diputar lagi, jangan dianggap duplikat
+        if args.alloc:
+            tracemalloc.start()
+        elapsed, lat, peaks = await replay(app, updates, args.alloc)
+        if args.alloc:
+            tracemalloc.stop()
+
+    lat.sort()
+    intents = {
+        dict(k).get("intent", "?"): int(v)
+        for k, v in main.METRICS.values("dukcapil_intents_total").items()
+    }
+    texts = sum(intents.values()) or 1
+    results = {dict(k)["result"]: int(v) for k, v in main.METRICS.values("dukcapil_updates_total").items()}
+    unique = len({u.update_id for u in updates})
+    handled = main.METRICS.count("dukcapil_handler_seconds")  # tiap update sintetis punya tepat satu handler
+    report: Dict[str, object] = {
+        "updates": len(updates),
+        "concurrency": main.UPDATE_CONCURRENCY or 1,
+        "api_latency_ms": args.api_latency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(updates) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(lat, 50) * 1000, 3),
+            "p95": round(percentile(lat, 95) * 1000, 3),
+            "p99": round(percentile(lat, 99) * 1000, 3),
+            "max": round(lat[-1] * 1000, 3) if lat else 0.0,
+        },
+        "api_calls": dict(stub.calls),
+        "fallback_rate": round(intents.get("fallback", 0) / texts, 4),
+        "handled": handled,
+        "queue_full": results.get("antrean_penuh", 0),
+        # update unik yang tidak sampai ke handler mana pun tanpa alasan tercatat
+        "lost": unique - handled - results.get("antrean_penuh", 0),
+    }
+    if peaks:
+        report["alloc_peak_bytes_per_update"] = {
+            "mean": round(sum(peaks) / len(peaks)),
+            "p95": percentile(sorted(peaks), 95),
+        }
+    return report
+
+
+async def run_broadcast(args: argparse.Namespace) -> Dict[str, object]:
+    """Pengumuman ke `args.broadcast` pelanggan sintetis lewat Broadcaster asli."""
+    rnd = random.Random(args.seed)
+    chats = list(range(10_000, 10_000 + args.broadcast))
+    blocked = frozenset(c for c in chats if rnd.random() < args.blocked)
+    stub = StubBotAPI(latency=args.api_latency / 1000, blocked=blocked)
+    app = main.build_app(request=stub)
+    async with app:
+        for cid in chats:
+            main.STATE.set(cid, subscribed=1)
+        caster = main.Broadcaster(main.STATE, main.BROADCAST_RATE, main.BROADCAST_BATCH)
+        start = time.perf_counter()
+        await caster.start(app.bot, "📢 *Pengumuman*: jam layanan berubah selama libur nasional.", admin=1)
+        await caster._task
+        elapsed = time.perf_counter() - start
+    job = caster.job
+    return {
+        "subscribers": args.broadcast,
+        "api_latency_ms": args.api_latency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(args.broadcast / elapsed, 1),
+        "sent": job.sent,
+        "blocked": job.blocked,
+        "failed": job.failed,
+        "still_subscribed": len(main.STATE.subscribers()),
+        "api_calls": dict(stub.calls),
+    }
+
+
+def _text_update(update_id: int, chat_id: int, text: str) -> dict:
+    chat = {"id": chat_id, "type": "private"}
+    user = {"id": chat_id, "is_bot": False, "first_name": "Warga"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": chat, "from": user, "text": text,
+    }}
+
+
+def _tap_update(update_id: int, chat_id: int, data: str) -> dict:
+    chat = {"id": chat_id, "type": "private"}
+    user = {"id": chat_id, "is_bot": False, "first_name": "Warga"}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id),
+        "from": user,
+        "chat_instance": str(chat_id),
+        "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "menu"},
+    }}
+
+
+async def run_taps(args: argparse.Namespace) -> Dict[str, object]:
+    """Satu chat menekan `args.taps` tombol (lalu mengetik `args.taps` pesan)
+    sekaligus; chat lain bertanya tepat sesudahnya. Diukur: kapan jawaban
+    chat lain selesai, dihitung dari update pertama."""
+    stub = StubBotAPI(latency=args.api_latency / 1000)
+    app = main.build_app(request=stub)
+    callbacks = sorted(main.CONTENT.callback_keys)
+    report: Dict[str, object] = {
+        "taps": args.taps,
+        "concurrency": main.UPDATE_CONCURRENCY or 1,
+        "real_limits": REAL_LIMITS,
+        "api_latency_ms": args.api_latency,
+    }
+    async with app:
+        uid = 0
+        for kind in ("tombol", "teks"):
+            raw = []
+            for i in range(args.taps):
+                uid += 1
+                if kind == "tombol":
+                    raw.append(_tap_update(uid, 1, callbacks[i % len(callbacks)]))
+                else:
+                    raw.append(_text_update(uid, 1, "ktp hilang"))
+            uid += 1
+            raw.append(_text_update(uid, 2, "ktp hilang"))
+            updates = [Update.de_json(u, app.bot) for u in raw]
+            start = time.perf_counter()
+
+            async def timed(update: Update) -> float:
+                await app.process_update(update)
+                return time.perf_counter() - start
+
+            if app.concurrent_updates:
+                done = await asyncio.gather(*(timed(u) for u in updates))
+            else:
+                done = [await timed(u) for u in updates]
+            report[f"busy_chat_done_ms_{kind}"] = round(max(done[:-1]) * 1000, 1)
+            report[f"other_chat_reply_ms_{kind}"] = round(done[-1] * 1000, 1)
+    report["api_calls"] = dict(stub.calls)
+    return report
+
+
+def main_cli(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=20_000, help="jumlah update sintetis")
+    ap.add_argument("--chats", type=int, default=500, help="jumlah chat berbeda")
+    ap.add_argument("--mix", type=float, nargs=3, default=(0.6, 0.3, 0.1), metavar=("TEKS", "TOMBOL", "PERINTAH"))
+    ap.add_argument("--api-latency", type=float, default=0.0, help="simulasi RTT Bot API (ms)")
+    ap.add_argument("--corpus", help="berkas .jsonl berisi update rekaman")
+    ap.add_argument("--alloc", action="store_true", help="ukur alokasi per update (lebih lambat)")
+    ap.add_argument("--json", help="simpan laporan ke berkas JSON")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--broadcast", type=int, metavar="N", help="ukur pengumuman ke N pelanggan sintetis")
+    ap.add_argument("--blocked", type=float, default=0.05, help="porsi pelanggan yang memblokir bot")
+    ap.add_argument("--taps", type=int, metavar="N", help="ukur jeda chat lain saat 1 chat menekan N tombol")
+    ap.add_argument("--real-limits", action="store_true", help="pakai batas kirim asli (RATE_* main.py)")
+    args = ap.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.broadcast:
+        report = asyncio.run(run_broadcast(args))
+    elif args.taps:
+        report = asyncio.run(run_taps(args))
+    else:
+        report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if report.get("lost"):
+        sys.exit(f"GAGAL: {report['lost']} update hilang tanpa diproses")
+
+
+if __name__ == "__main__":
+    main_cli(sys.argv[1:])
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Konfigurasi pytest: env aman diset sebelum main di-import oleh tes."""
+
+import os
+
+# konfigurasi dibaca saat import main
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("CONTENT_POLL_SEC", "0")
+os.environ.setdefault("STATE_DB", "")
+os.environ.setdefault("BOOKING_DB", "")
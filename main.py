@@ -5,73 +5,359 @@ Fitur:
 - Menu utama + submenu (InlineKeyboard)
 - Deteksi teks bebas (keyword + sinonim)
 - Jawaban rapi (Markdown) + emoji
-- Stabil di Railway (error handler, limit panjang pesan, drop_pending_updates)
+- Stabil di Railway (error handler, limit panjang pesan, resume antrean setelah restart)
 
 Jika di-host di Railway:
 - Tambah Variable: BOT_TOKEN = <token bot>
 - Procfile: worker: python main.py
+- Konten (teks, keyword, tombol) ada di konten.json; ubah berkasnya atau kirim
+  SIGHUP, bot memuat ulang tanpa restart (CONTENT_PATH, CONTENT_POLL_SEC)
+- (Opsional) UPDATE_CONCURRENCY = jumlah update paralel lintas chat,
+  CHAT_QUEUE_DEPTH = antrean maksimal per chat
+
+Pengumuman: warga otomatis berlangganan saat /start (/berhenti, /langganan).
+Admin (ADMIN_IDS) mengirim `/broadcast <teks>`; progres disimpan di STATE_DB
+sehingga pengiriman yang terputus dilanjutkan setelah restart.
+
+Cek berkas (/berkas atau tombol di menu utama): warga memilih beberapa keperluan
+sekaligus, menjawab pertanyaan singkat, lalu mendapat satu daftar berkas gabungan
+(tanpa duplikat) yang bisa dicentang. Data persyaratan di bagian "checklist" konten.
+
+Bahasa: Indonesia (dasar), Jawa & Inggris di bagian "languages" konten. Bahasa
+chat ditebak dari pesan pertama (atau bahasa aplikasi Telegram) lalu disimpan;
+warga bisa menggantinya lewat /bahasa.
+
+Inline mode (`@namabot ktp` di chat mana pun): aktifkan /setinline di BotFather.
+
+Antrean loket: tombol "Ambil Antrean Loket" -> layanan -> tanggal -> jam, lalu
+warga mendapat kode konfirmasi (/antrean untuk melihat/membatalkan). Jam buka,
+kapasitas slot & layanan diatur di bagian "booking" konten; data di BOOKING_DB.
+
+Analitik: pesan yang tidak dikenali dihitung (top-K, memori tetap) tanpa
+menyimpan pesan mentah; admin melihatnya lewat `/terlewat [n]`, atau
+`python main.py --missed-report [n]` (gabungan semua worker dari STATE_DB).
+
+Cold start (scale-to-zero): rincian waktu start sampai balasan pertama:
+`python main.py --startup-report` (atau STARTUP_REPORT=1).
+
+Log ditulis thread terpisah; LOG_FORMAT=json = satu objek JSON per baris. Tiap
+update menjadi satu event (hash chat, intent/tombol, ms, hasil); error & update
+lambat selalu dicatat, yang sukses diambil sampel LOG_SAMPLE.
+
+Multi-proses (WORKERS = N > 1): proses utama hanya menerima update (polling
+atau webhook) lalu membaginya ke N worker berdasarkan chat id; worker yang
+mati/macet dijalankan ulang otomatis. /healthz melaporkan status worker,
+/metrics milik supervisor; /metrics worker ke-i di METRICS_PORT + 1 + i.
+
+Mode webhook (pengganti polling):
+- Variable: BOT_MODE = webhook, WEBHOOK_URL = <url publik>, WEBHOOK_SECRET = <acak>
+- Procfile: web: python main.py  (PORT diisi otomatis oleh platform)
+- Endpoint: POST WEBHOOK_PATH (default /telegram), GET /healthz, GET /metrics
+- Uji lokal tanpa WEBHOOK_URL: curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: <secret>"
+  --data @update.json http://localhost:8080/telegram
 """
 
+import time
+
+_BOOT = time.perf_counter()  # titik nol laporan waktu start (sebelum import berat)
+
 import os
+import re
+import sys
+import hmac
+import atexit
+import hashlib
+import heapq
+import secrets
+import functools
+from array import array
+import importlib.util
+import math
+import json
+import random
+import signal
+import queue
+import asyncio
 import logging
-from typing import Dict, List, Tuple, Callable
-from dataclasses import dataclass
+import logging.handlers
+import contextvars
+from types import MappingProxyType
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union, Callable
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+
+_STDLIB_READY = time.perf_counter()
 
 from telegram import (
+    Bot,
+    CallbackQuery,
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
     MessageEntity,
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     ApplicationBuilder,
+    ApplicationHandlerStop,
+    BaseRateLimiter,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
+from telegram.request import BaseRequest, HTTPXRequest
+import httpx  # sudah dibawa python-telegram-bot
+
+# hanya dibutuhkan mode tertentu (state SQLite / multi-proses): diimpor saat dipakai
+if TYPE_CHECKING:
+    import sqlite3
+    import multiprocessing as mp
+
+_TELEGRAM_READY = time.perf_counter()
 
 # =========================================================
 # KONFIGURASI DASAR
 # =========================================================
 TOKEN = os.environ.get("BOT_TOKEN", "ISI_TOKEN_BOT_SAAT_TEST_LOKAL")
 
-SIDNOK_URL = "https://sidnok.semarangkota.go.id/"
-JAM_BUKA = (
-    "🕒 *Jam Operasional Dispendukcapil Pusat*\n"
-    "• Senin–Kamis: 08.15–15.00 WIB\n"
-    "• Jumat: 08.00–13.00 WIB\n"
-    "• Sabtu & Minggu: Libur"
+# Konten (teks, keyword, menu) ada di berkas JSON terpisah; bisa di-reload tanpa restart
+CONTENT_PATH = os.environ.get(
+    "CONTENT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "konten.json")
 )
-ALAMAT = (
-    "📍 *Alamat Kantor Pusat*\n"
-    "Jl. Kanguru Raya No.3, Gayamsari, Kec. Gayamsari,\n"
-    "Kota Semarang, Jawa Tengah 50248"
+CONTENT_POLL_SEC = float(os.environ.get("CONTENT_POLL_SEC", "5"))  # cek perubahan berkas (0 = hanya SIGHUP)
+REPLY_CACHE_SIZE = int(os.environ.get("REPLY_CACHE_SIZE", "4096"))  # LRU jawaban teks bebas (0 = mati)
+FUZZY_THRESHOLD = float(os.environ.get("FUZZY_THRESHOLD", "0.65"))  # kemiripan trigram minimal (0 = mati)
+BASE_LANG = "id"  # bahasa isi utama konten; bahasa lain di bagian "languages"
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "2.5"))  # skor BM25 minimal (0 = mati)
+INLINE_CACHE_SEC = int(os.environ.get("INLINE_CACHE_SEC", "300"))  # cache_time jawaban inline di server Telegram
+INLINE_MAX_RESULTS = 10
+STARTUP_REPORT = os.environ.get("STARTUP_REPORT", "") not in ("", "0")  # rincian waktu start di log
+
+MAX_TG = 4096  # batas karakter pesan Telegram
+
+# Konkurensi update: 0 = satu per satu (perilaku lama). >0 = jumlah update
+# yang boleh diproses bersamaan lintas chat; di dalam satu chat tetap urut.
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "0"))
+CHAT_QUEUE_DEPTH = int(os.environ.get("CHAT_QUEUE_DEPTH", "8"))  # antrean maks per chat
+
+# State per chat + offset update_id di SQLite. Kosongkan STATE_DB untuk perilaku
+# lama (update yang masuk saat bot mati dibuang ketika start).
+STATE_DB = os.environ.get(
+    "STATE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state.db")
 )
-CATATAN = (
-    "ℹ️ *Catatan*: Informasi ini bersifat umum. "
-    "Untuk verifikasi berkas/keputusan akhir, silakan menuju loket Dispendukcapil."
+STATE_FLUSH_SEC = float(os.environ.get("STATE_FLUSH_SEC", "1"))  # interval tulis batch
+DEDUP_WINDOW = int(os.environ.get("DEDUP_WINDOW", "10000"))  # update_id terakhir yang diingat persis
+BACKLOG_RATE = float(os.environ.get("BACKLOG_RATE", "20"))  # update/detik saat mengejar antrean lama
+
+# Antrean loket (bagian "booking" di konten). Satu berkas dipakai bersama semua
+# WORKERS; kosongkan untuk menyimpan di memori saja (hilang saat restart).
+BOOKING_DB = os.environ.get(
+    "BOOKING_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "booking.db")
 )
+WIB = timezone(timedelta(hours=7), "WIB")  # jam operasional kantor
 
-MAX_TG = 4096  # batas karakter pesan Telegram
+# Anti-spam masuk: maksimal GUARD_LIMIT pesan per user per GUARD_WINDOW_SEC
+# (jendela geser); lewat dari itu user dibisukan GUARD_MUTE_SEC. Admin bebas.
+# Tekan tombol & inline query (satu query per ketikan) punya anggaran sendiri
+# GUARD_TAP_LIMIT: kelebihannya hanya dibuang, user tidak dibisukan.
+GUARD_LIMIT = int(os.environ.get("GUARD_LIMIT", "20"))  # 0 = mati
+GUARD_TAP_LIMIT = int(os.environ.get("GUARD_TAP_LIMIT", "120"))  # 0 = mati
+GUARD_WINDOW_SEC = float(os.environ.get("GUARD_WINDOW_SEC", "60"))
+GUARD_MUTE_SEC = float(os.environ.get("GUARD_MUTE_SEC", "120"))
+GUARD_SLOTS = int(os.environ.get("GUARD_SLOTS", "65536"))  # memori tetap ~30 byte/slot
+
+# Batas kirim ke Telegram (~30 pesan/detik global, ~1/detik per chat, 20/menit per grup).
+# Batas per chat hanya dipakai bila UPDATE_CONCURRENCY > 0 (lihat OutboundLimiter).
+RATE_GLOBAL_PER_SEC = float(os.environ.get("RATE_GLOBAL_PER_SEC", "30"))
+RATE_CHAT_PER_SEC = float(os.environ.get("RATE_CHAT_PER_SEC", "1"))
+RATE_CHAT_BURST = float(os.environ.get("RATE_CHAT_BURST", "3"))  # jawaban multi-bagian
+RATE_GROUP_PER_MIN = float(os.environ.get("RATE_GROUP_PER_MIN", "20"))
+RATE_MAX_RETRIES = int(os.environ.get("RATE_MAX_RETRIES", "3"))  # ulang saat 429 RetryAfter
+
+# Pengumuman (/broadcast): hanya user id di ADMIN_IDS (dipisah koma). Laju di
+# bawah RATE_GLOBAL_PER_SEC agar balasan biasa tetap mendapat jatah kirim.
+ADMIN_IDS = frozenset(int(x) for x in os.environ.get("ADMIN_IDS", "").replace(",", " ").split())
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "20"))  # pesan/detik
+BROADCAST_BATCH = int(os.environ.get("BROADCAST_BATCH", "50"))  # kiriman per checkpoint
+
+# Analitik pertanyaan yang tidak dikenali: top-K frasa dengan memori tetap,
+# disimpan ke STATE_DB berkala. Laporan: /terlewat (admin) atau --missed-report.
+MISSED_TOP_K = int(os.environ.get("MISSED_TOP_K", "1000"))  # jumlah frasa yang dihitung (0 = mati)
+MISSED_FLUSH_SEC = float(os.environ.get("MISSED_FLUSH_SEC", "60"))
+
+# Wizard cek berkas: sesi per chat di memori, dibuang setelah idle
+WIZARD_IDLE_SEC = float(os.environ.get("WIZARD_IDLE_SEC", "1800"))
+WIZARD_MAX_SESSIONS = int(os.environ.get("WIZARD_MAX_SESSIONS", "50000"))  # lewat = sesi terlama dibuang
+
+# Multi-proses: WORKERS > 1 = satu supervisor (penerima update) + N worker,
+# update dibagi per chat (hash chat id) sehingga urutan per chat tetap terjaga
+WORKERS = int(os.environ.get("WORKERS", "1"))
+WORKER_QUEUE_MAX = int(os.environ.get("WORKER_QUEUE_MAX", "10000"))  # antrean per worker
+WORKER_HEARTBEAT_TIMEOUT = float(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", "30"))  # detik tanpa denyut = macet
+
+# Mode webhook (BOT_MODE=webhook) sebagai alternatif run_polling
+WEBHOOK_MODE = os.environ.get("BOT_MODE", "polling").lower() == "webhook"
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # URL publik, mis. https://xxx.up.railway.app
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.environ.get("PORT", "8080"))
+# /metrics saat polling (0 = mati); dengan WORKERS > 1 worker ke-i di METRICS_PORT + 1 + i
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Klien HTTP ke Bot API: pool kirim & pool getUpdates terpisah
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "0"))  # 0 = max(UPDATE_CONCURRENCY, 8)
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "3"))  # detik menunggu slot pool
+HTTP_KEEPALIVE_SEC = float(os.environ.get("HTTP_KEEPALIVE_SEC", "60"))  # koneksi idle dipertahankan
+HTTP2 = os.environ.get("HTTP2", "auto").lower()  # auto = pakai HTTP/2 bila paket h2 terpasang
+HTTP_PROXY_URL = os.environ.get("HTTP_PROXY_URL", "")  # proxy ke Bot API (http://, socks5://); kosong = langsung
+
+# Log ditulis thread terpisah (event loop hanya memasukkan ke antrean).
+# Tiap update menghasilkan satu event terstruktur; yang sukses dan cepat diambil sampel.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()  # text | json (satu objek per baris)
+LOG_SAMPLE = float(os.environ.get("LOG_SAMPLE", "0.01"))  # porsi update sukses yang dicatat (1 = semua)
+LOG_SLOW_MS = float(os.environ.get("LOG_SLOW_MS", "500"))  # update selambat ini selalu dicatat
+LOG_QUEUE_MAX = int(os.environ.get("LOG_QUEUE_MAX", "10000"))  # antrean penuh = record dibuang (dihitung)
 
 
 # =========================================================
 # LOGGING & ERROR HANDLER
 # =========================================================
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    level=logging.INFO,
-)
+class StructuredFormatter(logging.Formatter):
+    """Format lama (teks) atau JSON satu baris; field event (record.fields) ikut ditulis."""
+
+    def __init__(self, as_json: bool) -> None:
+        super().__init__("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None)
+        if not self.as_json:
+            line = super().format(record)
+            if not fields:
+                return line
+            first, nl, rest = line.partition("\n")  # field sebelum traceback
+            return first + " " + " ".join(f"{k}={v}" for k, v in fields.items() if v is not None) + nl + rest
+        obj = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if fields:
+            obj.update(fields)
+        if record.exc_info:
+            obj["exc"] = self.formatException(record.exc_info)
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hanya gabungkan pesan lalu masuk antrean; traceback diformat listener."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()  # argumen bisa berubah sebelum listener menulis
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:  # badai log: buang, jangan menahan event loop
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Logging tanpa I/O di event loop: handler root memasukkan record ke
+    antrean, satu thread QueueListener memformat & menulis ke stderr."""
+
+    def __init__(self, as_json: bool, maxsize: int, level: str) -> None:
+        self.maxsize = maxsize
+        self.level = level
+        self.handler = _QueueHandler(queue.Queue(maxsize))
+        self.output = logging.StreamHandler(sys.stderr)
+        self.output.setFormatter(StructuredFormatter(as_json))
+        self.listener: Optional[logging.handlers.QueueListener] = None
+
+    def start(self) -> None:
+        root = logging.getLogger()
+        root.handlers[:] = [self.handler]
+        root.setLevel(self.level)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self.output)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Tulis sisa antrean lalu hentikan thread (dipanggil saat keluar)."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def after_fork(self) -> None:
+        # thread listener tidak ikut fork, dan kunci antrean lama bisa sedang dipegang
+        self.handler.queue = queue.Queue(self.maxsize)
+        self.start()
+
+
+LOG_PIPE = LogPipeline(LOG_FORMAT == "json", LOG_QUEUE_MAX, LOG_LEVEL)
+LOG_PIPE.start()
+atexit.register(LOG_PIPE.stop)
 log = logging.getLogger("dukcapil-bot")
+events = logging.getLogger("dukcapil-bot.update")
+
+# field event update yang sedang diproses (per task, aman untuk update paralel)
+_TRACE: "contextvars.ContextVar[Optional[Dict[str, Any]]]" = contextvars.ContextVar("trace", default=None)
+_CHAT_KEY = hashlib.sha256(b"log|" + TOKEN.encode()).digest()[:16]  # hash chat id tidak bisa ditebak balik
+
+
+def trace(**fields: Any) -> None:
+    """Tambahkan field ke event log update yang sedang berjalan (mis. intent)."""
+    current = _TRACE.get()
+    if current is not None:
+        current.update(fields)
+
+
+def chat_hash(chat_id: int) -> str:
+    return hashlib.blake2b(str(chat_id).encode(), digest_size=6, key=_CHAT_KEY).hexdigest()
+
+
+def log_update(update: object, handler: str, fields: Dict[str, Any], seconds: float, outcome: str) -> None:
+    """Satu event per update. Error & update lambat selalu dicatat; sisanya
+    diambil sampel LOG_SAMPLE (field `sample` untuk pembobotan ulang)."""
+    slow = seconds * 1000 >= LOG_SLOW_MS
+    if outcome == "ok" and not slow and random.random() >= LOG_SAMPLE:
+        return
+    chat = update.effective_chat if isinstance(update, Update) else None
+    event = {
+        "update": getattr(update, "update_id", None),
+        "handler": handler,
+        "chat": chat_hash(chat.id) if chat else None,
+        "ms": round(seconds * 1000, 2),
+        "outcome": outcome,
+        **fields,
+    }
+    if outcome == "ok" and not slow:
+        event["sample"] = LOG_SAMPLE
+    events.log(logging.INFO if outcome == "ok" else logging.WARNING, "update", extra={"fields": event})
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Tangani error tanpa crash."""
     log.exception("Exception in handler:", exc_info=context.error)
+    METRICS.inc("dukcapil_errors_total", error=type(context.error).__name__)
+    if isinstance(context.error, RetryAfter):
+        return  # kena flood control: jangan tambah pesan lagi
     try:
         if isinstance(update, Update):
             target = update.effective_message
@@ -84,546 +370,3777 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         pass
 
 
+# =========================================================
+# METRIK (FORMAT TEKS PROMETHEUS)
+# =========================================================
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Registry metrik in-memory: counter, histogram, dan gauge berbasis callback.
+
+    Semua operasi cukup satu lookup dict; render() dipanggil hanya saat scrape.
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self) -> None:
+        self._meta: Dict[str, Tuple[str, str]] = {}  # nama -> (tipe, help)
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._hists: Dict[str, Dict[LabelKey, List[float]]] = {}  # bucket..., sum, count
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def reset(self) -> None:
+        """Kosongkan nilai (deskripsi & gauge tetap); dipakai benchmark."""
+        self._counters.clear()
+        self._hists.clear()
+
+    def values(self, name: str) -> Dict[LabelKey, float]:
+        return dict(self._counters.get(name, {}))
+
+    def count(self, name: str) -> int:
+        """Jumlah observasi histogram `name` di semua label."""
+        return int(sum(row[-1] for row in self._hists.get(name, {}).values()))
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self._hists.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        row = series.get(key)
+        if row is None:
+            row = series[key] = [0.0] * (len(self.BUCKETS) + 2)
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] += 1
+
+    def gauge(self, name: str, fn: Callable[[], float], help_text: str, kind: str = "gauge") -> None:
+        self._gauges[name] = fn
+        self.describe(name, kind, help_text)
+
+    @staticmethod
+    def _labels(key: LabelKey, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in key]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        out: List[str] = []
+
+        def head(name: str, default_kind: str) -> None:
+            kind, help_text = self._meta.get(name, (default_kind, name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        for name, series in self._counters.items():
+            head(name, "counter")
+            for key, value in series.items():
+                out.append(f"{name}{self._labels(key)} {value:g}")
+        for name, series in self._hists.items():
+            head(name, "histogram")
+            for key, row in series.items():
+                acc = 0.0
+                for bound, n in zip(self.BUCKETS, row):
+                    acc += n
+                    le = 'le="%g"' % bound
+                    out.append(f"{name}_bucket{self._labels(key, le)} {acc:g}")
+                inf = self._labels(key, 'le="+Inf"')
+                out.append(f"{name}_bucket{inf} {row[-1]:g}")
+                out.append(f"{name}_sum{self._labels(key)} {row[-2]:.6f}")
+                out.append(f"{name}_count{self._labels(key)} {row[-1]:g}")
+        for name, fn in self._gauges.items():
+            head(name, "gauge")
+            try:
+                out.append(f"{name} {fn():g}")
+            except Exception:
+                log.exception("Gauge %s gagal", name)
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+METRICS.describe("dukcapil_commands_total", "counter", "Perintah /command yang diterima")
+METRICS.describe("dukcapil_callbacks_total", "counter", "Tombol inline per callback key")
+METRICS.describe("dukcapil_callback_edits_total", "counter", "Hasil edit menu (skipped = sudah tampil)")
+METRICS.describe("dukcapil_intents_total", "counter", "Intent ketik bebas (fallback = belum mengenali)")
+METRICS.describe("dukcapil_fuzzy_hits_total", "counter", "Intent yang ditemukan lewat pencocokan salah ketik")
+METRICS.describe("dukcapil_errors_total", "counter", "Exception yang sampai ke error_handler")
+METRICS.describe("dukcapil_updates_total", "counter", "Update masuk per hasil (diterima / duplikat / antrean_penuh)")
+METRICS.describe("dukcapil_handler_seconds", "histogram", "Durasi total handler")
+METRICS.describe("dukcapil_match_seconds", "histogram", "Durasi pencocokan intent")
+METRICS.describe("dukcapil_telegram_api_seconds", "histogram", "Durasi panggilan Bot API (di kabel)")
+METRICS.describe("dukcapil_outbound_wait_seconds", "histogram", "Lama antre di rate limiter")
+METRICS.describe("dukcapil_http_pool_wait_seconds", "histogram", "Antre slot koneksi pool HTTP")
+METRICS.describe("dukcapil_http_wire_seconds", "histogram", "Dari memegang koneksi sampai header respons")
+METRICS.describe("dukcapil_http_connections_total", "counter", "Koneksi TCP baru ke Bot API (handshake)")
+METRICS.describe("dukcapil_http_pool_timeouts_total", "counter", "PoolTimeout: slot pool tidak didapat")
+METRICS.describe("dukcapil_guard_dropped_total", "counter", "Update dibuang anti-spam (kind=pesan|tap, first=1: peringatan)")
+METRICS.describe("dukcapil_retrieval_total", "counter", "Pencarian BM25 saat tidak ada keyword cocok")
+METRICS.describe("dukcapil_inline_total", "counter", "Inline query (hit = ada hasil)")
+METRICS.describe("dukcapil_broadcast_total", "counter", "Hasil kirim pengumuman per chat")
+METRICS.describe("dukcapil_lang_total", "counter", "Bahasa chat ditetapkan (deteksi otomatis / dipilih)")
+METRICS.describe("dukcapil_wizard_total", "counter", "Wizard cek berkas: mulai / sampai daftar / kedaluwarsa")
+METRICS.gauge("dukcapil_log_dropped_total", lambda: LOG_PIPE.handler.dropped, "Record log dibuang (antrean penuh)", "counter")
+METRICS.describe("dukcapil_booking_total", "counter", "Pesan/batal antrean loket per hasil")
+METRICS.describe("dukcapil_booking_seconds", "histogram", "Durasi reservasi antrean (indeks + tulis DB)")
+
+
+# =========================================================
+# WAKTU START (COLD START)
+# =========================================================
+def _process_age() -> Optional[float]:
+    """Detik sejak proses dibuat (Linux /proc), termasuk start interpreter."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupClock:
+    """Rincian waktu start per fase, sampai balasan pertama selesai.
+
+    Seperti `python -X importtime`, tapi per fase bot: import, konten,
+    build_app, initialize (getMe), siap menerima update, balasan pertama.
+    """
+
+    def __init__(self) -> None:
+        age = _process_age()
+        self.exec_before = age - (time.perf_counter() - _BOOT) if age is not None else None
+        self.phases: List[Tuple[str, float]] = [
+            ("import stdlib", _STDLIB_READY),
+            ("import telegram", _TELEGRAM_READY),
+        ]
+        self.done = False
+
+    def mark(self, phase: str) -> None:
+        if not self.done and all(name != phase for name, _ in self.phases):
+            self.phases.append((phase, time.perf_counter()))
+
+    def elapsed(self, phase: str) -> float:
+        """Detik sejak import main sampai fase itu (0 bila belum terjadi)."""
+        return next((t - _BOOT for name, t in self.phases if name == phase), 0.0)
+
+    def first_reply(self) -> None:
+        if self.done:
+            return
+        self.mark("balasan pertama")
+        self.done = True
+        if STARTUP_REPORT:
+            log.info("Rincian waktu start:\n%s", self.report())
+
+    def report(self) -> str:
+        lines = []
+        offset = self.exec_before or 0.0
+        if self.exec_before is not None:
+            lines.append(f"{'start interpreter':<24}{self.exec_before * 1000:>9.1f} ms{offset * 1000:>10.1f} ms")
+        prev = _BOOT
+        for name, t in self.phases:
+            lines.append(f"{name:<24}{(t - prev) * 1000:>9.1f} ms{(t - _BOOT + offset) * 1000:>10.1f} ms")
+            prev = t
+        return "\n".join(lines)
+
+
+STARTUP = StartupClock()
+METRICS.gauge("dukcapil_startup_seconds", lambda: STARTUP.elapsed("siap"), "Import main sampai siap menerima update")
+
+
+def timed(handler: str, fn: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+    """Bungkus handler: durasi ke histogram dukcapil_handler_seconds + event log update."""
+
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        t0 = time.perf_counter()
+        fields: Dict[str, Any] = {}
+        token = _TRACE.set(fields)
+        outcome = "error"
+        try:
+            result = await fn(update, context)
+            outcome = fields.pop("outcome", "ok")  # handler yang menelan error menandainya sendiri
+            return result
+        finally:
+            elapsed = time.perf_counter() - t0
+            _TRACE.reset(token)
+            METRICS.observe("dukcapil_handler_seconds", elapsed, handler=handler)
+            log_update(update, handler, fields, elapsed, outcome)
+            if not STARTUP.done:
+                STARTUP.first_reply()
+
+    return wrapper
+
+
+def command_handler(name: str, fn: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]) -> CommandHandler:
+    async def counted(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        METRICS.inc("dukcapil_commands_total", command=name)
+        return await fn(update, context)
+
+    return CommandHandler(name, timed(f"cmd_{name}", counted))
+
+
 # =========================================================
 # UTIL
 # =========================================================
+_MD_CLOSE = {"*": "*", "_": "_", "`": "`", "```": "```", "[": ""}  # "" = link, tak bisa ditutup paksa
+
+
+def utf16_len(text: str) -> int:
+    """Panjang dalam unit UTF-16, cara Telegram menghitung (emoji = 2)."""
+    return len(text) + sum(1 for ch in text if ord(ch) > 0xFFFF)
+
+
+def iter_chunks(text: str, limit: int = MAX_TG) -> Iterator[str]:
+    """Potong teks Markdown jadi bagian <= limit unit UTF-16, dalam satu lintasan.
+
+    Titik potong dipilih di luar entitas (*tebal*, _miring_, `kode`,
+    ```pre```, [tautan](url)) dengan urutan: paragraf, baris, spasi. Bila
+    tidak ada, potong sebelum entitas yang sedang terbuka; entitas yang lebih
+    panjang dari limit ditutup di akhir bagian dan dibuka lagi di bagian
+    berikutnya, jadi setiap bagian tetap sah untuk ParseMode.MARKDOWN.
+    """
+    n = len(text)
+    start = 0  # awal bagian berjalan
+    units = 0  # unit UTF-16 dari start sampai i
+    reopen = ""  # penanda entitas yang dibuka ulang di awal bagian
+    best = [-1, -1, -1]  # kandidat potong terakhir: paragraf, baris, spasi
+    entity: Optional[str] = None
+    entity_at = 0
+    link_stage = 0  # 0 = teks [..], 1 = sesudah "](", menunggu ")"
+    i = 0
+    while i < n:
+        ch = text[i]
+        # lebar token: "```" dan escape "\x" tidak boleh terbelah
+        if entity is None and ch == "\\" and i + 1 < n:
+            step = 2
+        elif ch == "`" and text.startswith("```", i) and entity in (None, "```"):
+            step = 3
+        else:
+            step = 1
+        width = step + (ord(ch) > 0xFFFF) if step == 1 else step + (ord(text[i + 1]) > 0xFFFF)
+        reserve = len(_MD_CLOSE[entity]) if entity else 0
+
+        if len(reopen) + units + width + reserve > limit and i > start:
+            cut = next((c for c in best if c > start), -1)
+            if cut == -1 and entity is not None and entity_at > start:
+                cut = entity_at  # sisakan entitas utuh untuk bagian berikutnya
+            if cut == -1:
+                # entitas lebih panjang dari limit (atau tanpa spasi): potong paksa
+                close = _MD_CLOSE[entity] if entity else ""
+                yield reopen + text[start:i] + close
+                reopen, start = close, i
+            else:
+                piece = text[start:cut].rstrip()
+                if piece:  # hanya spasi sebelum entitas: jangan kirim bagian kosong
+                    yield reopen + piece
+                reopen, start = "", cut
+                while start < i and text[start].isspace():
+                    start += 1
+            units = sum(2 if ord(text[k]) > 0xFFFF else 1 for k in range(start, i))
+            best = [c if c > start else -1 for c in best]
+            continue  # token di i dihitung ulang terhadap bagian baru
+
+        if entity is None:
+            if step == 3:
+                entity, entity_at = "```", i
+            elif ch in "*_`[":
+                entity, entity_at, link_stage = ch, i, 0
+            elif ch == "\n":
+                best[1] = i
+                if i + 1 < n and text[i + 1] == "\n":
+                    best[0] = i
+            elif ch == " ":
+                best[2] = i
+        elif entity == "[":
+            if link_stage == 0 and ch == "]":
+                if text.startswith("](", i):
+                    link_stage = 1
+                else:
+                    entity = None
+            elif link_stage == 1 and ch == ")":
+                entity = None
+        elif (step == 3) if entity == "```" else ch == entity:
+            entity = None
+        units += width
+        i += step
+
+    tail = text[start:]
+    if tail.strip() or reopen:
+        yield reopen + tail
+
+
 def chunk_message(text: str, limit: int = MAX_TG) -> List[str]:
-    """Bagi pesan panjang jadi beberapa bagian <= 4096 char."""
-    if len(text) <= limit:
+    """Bagi pesan panjang jadi beberapa bagian <= 4096 unit UTF-16."""
+    if len(text) <= limit // 2 or utf16_len(text) <= limit:
         return [text]
-    chunks = []
-    while text:
-        cut = text.rfind("\n\n", 0, limit)
-        if cut == -1:
-            cut = text.rfind("\n", 0, limit)
-        if cut == -1:
-            cut = limit
-        chunks.append(text[:cut])
-        text = text[cut:].lstrip()
-    return chunks
+    return list(iter_chunks(text, limit))
 
 
 def normalize(s: str) -> str:
     return (s or "").lower().strip()
 
 
-def any_in(text: str, keywords: List[str]) -> bool:
-    t = normalize(text)
-    return any(k in t for k in keywords)
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def canonical(s: str) -> str:
+    """Bentuk kanonik untuk pencocokan & cache: casefold, tanpa tanda baca,
+    spasi dirapatkan. "KTP hilang??" dan "ktp   hilang" jadi sama."""
+    return _NON_WORD.sub(" ", (s or "").casefold()).strip()
 
 
 # =========================================================
-# KONTEN: TEKS STANDAR & TEMPLATE
+# MODE KETIK BEBAS (NLP SEDERHANA)
 # =========================================================
-HOME_TEXT = (
-    "👋 *Selamat datang di Asisten Layanan Dispendukcapil Kota Semarang!*\n\n"
-    "Saya siap bantu info layanan berikut:\n"
-    "• KTP (baru, hilang, ubah data, masa berlaku)\n"
-    "• KK (ubah alamat/pekerjaan/status/golongan darah, gabung/pisah, hilang)\n"
-    "• Akta Kelahiran & Akta Kematian\n"
-    "• KIA Anak\n"
-    "• Pindah/Kedatangan Domisili\n"
-    "• Jam & Alamat Kantor\n"
-    "• Layanan Online via *Sidnok*\n\n"
-    "Pilih menu di bawah atau *ketik bebas* pertanyaanmu."
-)
+# Aturan intent berasal dari konten: urut dari yang spesifik ke umum
+# (prioritas = urutan list). Tiap alternatif = tuple frasa yang *semuanya*
+# harus muncul di teks.
+IntentRules = List[Tuple[str, List[Tuple[str, ...]]]]
 
-ABOUT_TEXT = (
-    "ℹ️ *Tentang Bot*\n"
-    "Asisten informasi layanan Dispendukcapil Kota Semarang.\n"
-    "Gunakan menu tombol atau ketik bebas pertanyaan Anda.\n\n"
-    f"{CATATAN}"
-)
 
-FAQ_TEXT = (
-    "🧭 *Menu Bantuan / FAQ*\n"
-    "Contoh yang bisa diketik:\n"
-    "• `ktp hilang`, `ktp baru`, `ubah data ktp`, `masa berlaku ktp`\n"
-    "• `kk hilang`, `kk ubah alamat`, `kk ubah pekerjaan`, `kk status`, `kk golongan darah`, `gabung kk`, `pisah kk`\n"
-    "• `akta kelahiran`, `akta kelahiran hilang`\n"
-    "• `akta kematian`, `akta kematian hilang`\n"
-    "• `kia`, `pindah domisili`, `pendatang masuk`\n"
-    "• `jam`, `alamat`, `sidnok`"
-)
+@dataclass(frozen=True)
+class IntentMatcher:
+    """Automaton Aho-Corasick (DFA penuh) atas semua frasa aturan intent.
+
+    Teks cukup di-scan sekali; hasilnya bitmask frasa yang muncul, lalu
+    aturan dicek berurutan dengan operasi bit saja.
+    """
+    delta: Tuple[Dict[str, int], ...]
+    out: Tuple[int, ...]
+    rules: Tuple[Tuple[str, Tuple[int, ...]], ...]
+
+    @classmethod
+    def compile(cls, rules: IntentRules) -> "IntentMatcher":
+        bits: Dict[str, int] = {}
+        for _, alts in rules:
+            for alt in alts:
+                for phrase in alt:
+                    bits.setdefault(phrase, 1 << len(bits))
+
+        # trie
+        goto: List[Dict[str, int]] = [{}]
+        out: List[int] = [0]
+        for phrase, bit in bits.items():
+            node = 0
+            for ch in phrase:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append(0)
+                node = nxt
+            out[node] |= bit
+
+        # failure link -> transisi DFA penuh (BFS; anak root gagal ke root)
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [{} for _ in goto[1:]]
+        queue = list(goto[0].values())
+        for node in queue:
+            delta[node] = {**delta[fail[node]], **goto[node]}
+            out[node] |= out[fail[node]]
+            for ch, child in goto[node].items():
+                fail[child] = delta[fail[node]].get(ch, 0)
+                queue.append(child)
+        return cls(
+            delta=tuple(delta),
+            out=tuple(out),
+            rules=tuple(
+                (intent, tuple(sum(bits[p] for p in set(alt)) for alt in alts))
+                for intent, alts in rules
+            ),
+        )
+
+    def scan(self, text: str) -> int:
+        delta, out = self.delta, self.out
+        state = mask = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            mask |= out[state]
+        return mask
+
+    def match(self, text: str) -> Optional[str]:
+        """Intent dengan prioritas tertinggi, atau None bila tidak ada."""
+        mask = self.scan(normalize(text))
+        if not mask:
+            return None
+        for intent, alts in self.rules:
+            for need in alts:
+                if mask & need == need:
+                    return intent
+        return None
+
+
+class FuzzyIndex:
+    """Indeks trigram karakter atas frasa keyword, untuk pesan yang salah ketik.
+
+    Dibangun sekali per snapshot. Saat mencocokkan, tiap jendela kata di pesan
+    (sepanjang frasa) diubah jadi himpunan trigram; posting list indeks
+    menghitung trigram yang sama, lalu skor Dice = 2|A∩B| / (|A|+|B|).
+
+    Skor Dice dihitung atas seluruh jendela, jadi satu kata yang sama panjang
+    bisa menutupi kata lain yang sama sekali beda ("perpanjang sim" mirip
+    "perpanjang ktp"). Karena itu `match` juga mensyaratkan tiap kata jendela
+    berpasangan dengan satu kata frasa (urutan bebas) dalam batas salah ketik
+    per kata: kata <= 3 huruf harus persis, 4-7 huruf boleh 1 edit, lebih
+    panjang boleh 2.
+    """
+
+    MIN_LEN = 4  # frasa sangat pendek ("kk", "kia") terlalu rawan salah tebak
+    MAX_WORDS = 12  # pesan panjang dipotong agar biaya tetap kecil
+    _WORD = re.compile(r"\w+")
+
+    def __init__(self, keywords: Mapping[str, Tuple[str, ...]], threshold: float) -> None:
+        self.threshold = threshold
+        self._intent: List[str] = []
+        self._rank: List[int] = []  # prioritas intent (urutan aturan)
+        self._size: List[int] = []
+        self._words: List[Tuple[str, ...]] = []
+        # jumlah kata frasa -> trigram -> id frasa
+        self._index: Dict[int, Dict[str, List[int]]] = {}
+        for rank, (intent, phrases) in enumerate(keywords.items()):
+            for phrase in phrases:
+                words = self._WORD.findall(phrase)
+                if len(phrase) < self.MIN_LEN or not words:
+                    continue
+                grams = self.trigrams(" ".join(words))
+                pid = len(self._intent)
+                self._intent.append(intent)
+                self._rank.append(rank)
+                self._size.append(len(grams))
+                self._words.append(tuple(words))
+                postings = self._index.setdefault(len(words), {})
+                for g in grams:
+                    postings.setdefault(g, []).append(pid)
 
-# --- Detail jawaban per sub-layanan ---
-DETAILS: Dict[str, str] = {
-    # KTP
-    "ktp_baru": (
-        "📄 *KTP Baru*\n"
-        "• Fotokopi KK & Akta Kelahiran\n"
-        "• Usia minimal 17 tahun\n"
-        f"• Proses di kantor Dispendukcapil atau via *Sidnok* ({SIDNOK_URL})\n\n"
-        f"{CATATAN}"
-    ),
-    "ktp_hilang": (
-        "🧾 *KTP Hilang*\n"
-        "1️⃣ Lapor kehilangan di kepolisian\n"
-        "2️⃣ Bawa laporan ke Dispendukcapil untuk cetak ulang\n"
-        "3️⃣ Siapkan KK & data diri\n\n"
-        f"{CATATAN}"
-    ),
-    "ktp_ubah": (
-        "✏️ *Ubah Data KTP*\n"
-        "• Siapkan dokumen pendukung sesuai perubahan (Akta/KK/Buku Nikah, dsb.)\n"
-        "• Bawa KTP & KK asli\n\n"
-        f"{CATATAN}"
-    ),
-    "ktp_perpanjang": (
-        "🔄 *Masa Berlaku KTP*\n"
-        "• e-KTP berlaku *seumur hidup*\n"
-        "• Update diperlukan hanya jika ada *perubahan data*\n\n"
-        f"{CATATAN}"
-    ),
-
-    # KK
-    "kk_hilang": (
-        "🧾 *KK Hilang*\n"
-        "• Lapor kehilangan ke kepolisian\n"
-        "• Bawa laporan ke Dispendukcapil untuk cetak ulang\n\n"
-        f"{CATATAN}"
-    ),
-    "kk_alamat": (
-        "🏠 *Ubah Alamat di KK*\n"
-        "• KK & KTP asli\n"
-        "• Surat pindah\n"
-        "• (Jika diminta) bukti kepemilikan/kontrak rumah\n\n"
-        f"{CATATAN}"
-    ),
-    "kk_pekerjaan": (
-        "💼 *Ubah Pekerjaan di KK*\n"
-        "• SK/Surat keterangan dari instansi (jika PNS/Guru/dll)\n"
-        "• KTP & KK asli\n\n"
-        f"{CATATAN}"
-    ),
-    "kk_status": (
-        "💍 *Ubah Status Perkawinan*\n"
-        "• Buku nikah / akta cerai\n"
-        "• KK & KTP kedua pihak\n\n"
-        f"{CATATAN}"
-    ),
-    "kk_goldar": (
-        "🅾️ *Ubah Golongan Darah di KK*\n"
-        "• Surat keterangan golongan darah (PMI/RS/lab)\n"
-        "• KK & KTP asli\n\n"
-        f"{CATATAN}"
-    ),
-    "kk_gabung": (
-        "👨‍👩‍👧 *Gabung KK*\n"
-        "• KK asli & pengantar RT/RW\n"
-        "• Proses verifikasi di kantor\n\n"
-        f"{CATATAN}"
-    ),
-    "kk_pisah": (
-        "🧍 *Pisah KK*\n"
-        "• KK asli & pengantar RT/RW\n"
-        "• Formulir pemisahan akan dibantu di loket\n\n"
-        f"{CATATAN}"
-    ),
-
-    # Akta
-    "akta_lahir_umum": (
-        "📜 *Akta Kelahiran*\n"
-        "• Surat keterangan lahir (RS/Bidan)\n"
-        "• KK & KTP orang tua\n"
-        "• Buku nikah (jika ada)\n"
-        f"• Bisa melalui kantor Dispendukcapil atau *Sidnok* ({SIDNOK_URL})"
-    ),
-    "akta_lahir_hilang": (
-        "🧾 *Akta Kelahiran Hilang*\n"
-        "• Lapor kehilangan ke kepolisian\n"
-        "• Bawa laporan & dokumen ke Dispendukcapil untuk penerbitan ulang\n\n"
-        f"{CATATAN}"
-    ),
-    "akta_mati_umum": (
-        "⚰️ *Akta Kematian*\n"
-        "• Surat keterangan kematian (RS/bidan/kelurahan)\n"
-        "• KK & KTP almarhum\n"
-        "• KTP pelapor\n"
-        "• Ajukan di kantor Dispendukcapil atau kanal resmi yang tersedia"
-    ),
-    "akta_mati_hilang": (
-        "🧾 *Akta Kematian Hilang*\n"
-        "• Lapor kehilangan ke kepolisian\n"
-        "• Ajukan ulang di Dispendukcapil\n\n"
-        f"{CATATAN}"
-    ),
-
-    # Pindah / Datang
-    "pindah_keluar": (
-        "🚚 *Perpindahan Keluar*\n"
-        "• KK & KTP\n"
-        "• Surat pengantar RT/RW ➜ terbit *surat pindah*\n\n"
-        f"{CATATAN}"
-    ),
-    "pendatang_masuk": (
-        "📦 *Pendatang Masuk (Perpindahan Masuk)*\n"
-        "• Surat pindah dari kota asal\n"
-        "• KK & KTP untuk pembuatan domisili baru\n\n"
-        f"{CATATAN}"
-    ),
-
-    # Info & Online
-    "jam": JAM_BUKA,
-    "alamat": ALAMAT,
-    "sidnok": f"🌐 *Sidnok Online*\nPengajuan KTP/KK/Akta via: {SIDNOK_URL}",
+    @staticmethod
+    def trigrams(text: str) -> frozenset:
+        padded = f" {text} "
+        return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def match(self, text: str) -> Optional[str]:
+        """Intent dengan skor tertinggi >= threshold (seri: prioritas aturan)."""
+        if self.threshold <= 0:
+            return None
+        best = self.closest(text, self.threshold, per_word=True)
+        return best[0] if best else None
+
+    @staticmethod
+    def typo_limit(word: str) -> int:
+        """Jumlah edit yang masih dianggap salah ketik untuk kata frasa ini."""
+        return 0 if len(word) <= 3 else 1 if len(word) <= 7 else 2
+
+    @staticmethod
+    def within(a: str, b: str, limit: int) -> bool:
+        """Jarak edit (sisip/hapus/ganti/tukar dua huruf bersebelahan) <= limit."""
+        if abs(len(a) - len(b)) > limit:
+            return False
+        if limit == 0:
+            return a == b
+        prev2: List[int] = []
+        prev = list(range(len(b) + 1))
+        for i in range(1, len(a) + 1):
+            row = [i] + [0] * len(b)
+            for j in range(1, len(b) + 1):
+                cost = a[i - 1] != b[j - 1]
+                row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+                if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                    row[j] = min(row[j], prev2[j - 2] + 1)
+            if min(row) > limit:
+                return False
+            prev2, prev = prev, row
+        return prev[-1] <= limit
+
+    def words_match(self, window: List[str], pid: int) -> bool:
+        """Tiap kata jendela punya pasangan kata frasa sendiri dalam batas typo."""
+        free = list(self._words[pid])
+        for word in window:
+            for k, target in enumerate(free):
+                if self.within(word, target, self.typo_limit(target)):
+                    del free[k]
+                    break
+            else:
+                return False
+        return True
+
+    def closest(
+        self, text: str, threshold: float = 0.0, per_word: bool = False
+    ) -> Optional[Tuple[str, float]]:
+        """(intent, skor) terdekat walau di bawah ambang; untuk laporan analitik.
+
+        per_word=True menolak kandidat yang ada katanya di luar batas typo
+        (dipakai `match`); laporan analitik tetap mencari yang terdekat saja.
+        """
+        words = self._WORD.findall(normalize(text))[: self.MAX_WORDS]
+        best: Optional[Tuple[float, int, str]] = None
+        for n, postings in self._index.items():
+            for start in range(len(words) - n + 1):
+                window = words[start:start + n]
+                grams = self.trigrams(" ".join(window))
+                shared: Dict[int, int] = {}
+                for g in grams:
+                    for pid in postings.get(g, ()):
+                        shared[pid] = shared.get(pid, 0) + 1
+                for pid, common in shared.items():
+                    score = 2 * common / (len(grams) + self._size[pid])
+                    if (
+                        score >= threshold
+                        and (best is None or (score, -self._rank[pid]) > (best[0], -best[1]))
+                        and (not per_word or self.words_match(window, pid))
+                    ):
+                        best = (score, self._rank[pid], self._intent[pid])
+        return (best[2], best[0]) if best else None
+
+
+class LanguageDetector:
+    """Tebak bahasa pesan dari kata khas tiap bahasa.
+
+    Kosakata dibangun sekali per snapshot: kata petunjuk + kata keyword yang
+    hanya dimiliki satu bahasa (kata bersama seperti "ktp" dibuang). Deteksi
+    cukup satu lookup dict per kata; suara terbanyak menang, seri = None.
+    """
+
+    def __init__(self, vocab: Mapping[str, Iterable[str]]) -> None:
+        owners: Dict[str, set] = {}
+        for lang, words in vocab.items():
+            for word in words:
+                owners.setdefault(word, set()).add(lang)
+        self.vocab: Dict[str, str] = {w: langs.pop() for w, langs in owners.items() if len(langs) == 1}
+
+    def detect(self, text: str) -> Optional[str]:
+        votes: Dict[str, int] = {}
+        for word in text.split():
+            lang = self.vocab.get(word)
+            if lang is not None:
+                votes[lang] = votes.get(lang, 0) + 1
+        if not votes:
+            return None
+        ranked = sorted(votes.values(), reverse=True)
+        if len(ranked) > 1 and ranked[0] == ranked[1]:
+            return None
+        return max(votes, key=votes.__getitem__)
+
+
+class PrefixIndex:
+    """Indeks prefiks kata -> topik, untuk inline query (`@bot ktp hil`).
+
+    Setiap kata judul & frasa keyword didaftarkan di semua prefiksnya, jadi
+    pencarian cukup satu lookup dict per kata query. Topik harus cocok
+    dengan *semua* kata; peringkat = jumlah bobot (judul > keyword, kata
+    utuh > prefiks), seri diurutkan menurut urutan konten.
+    """
+
+    TITLE_WEIGHT = 3
+    KEYWORD_WEIGHT = 1
+    MAX_PREFIX = 20
+    MAX_WORDS = 6
+
+    def __init__(self, entries: List[Tuple[str, str, int]]) -> None:
+        self._rank: Dict[str, int] = {}
+        self._prefix: Dict[str, Dict[str, int]] = {}
+        for topic, text, weight in entries:
+            self._rank.setdefault(topic, len(self._rank))
+            for word in canonical(text).split():
+                for n in range(1, min(len(word), self.MAX_PREFIX) + 1):
+                    hits = self._prefix.setdefault(word[:n], {})
+                    score = weight + (n == len(word))
+                    if hits.get(topic, 0) < score:
+                        hits[topic] = score
+        self.topics: Tuple[str, ...] = tuple(self._rank)
+
+    def search(self, query: str, limit: int) -> List[str]:
+        words = canonical(query).split()[: self.MAX_WORDS]
+        if not words:
+            return list(self.topics[:limit])
+        scores: Optional[Dict[str, int]] = None
+        for word in words:
+            hits = self._prefix.get(word[: self.MAX_PREFIX])
+            if not hits:
+                return []
+            if scores is None:
+                scores = dict(hits)
+            else:
+                scores = {t: s + hits[t] for t, s in scores.items() if t in hits}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda t: (-scores[t], self._rank[t]))[:limit]
+
+
+# Stemmer ringan bahasa Indonesia (gaya Nazief-Adriani yang dipangkas):
+# partikel -> kepunyaan -> akhiran -> awalan, dengan sisa kata minimal 3 huruf.
+_PARTICLES = ("lah", "kah", "tah", "pun")
+_POSSESSIVES = ("nya", "ku", "mu")
+_SUFFIXES = ("kan", "an", "i")
+_PREFIXES = (
+    ("meng", ""), ("meny", "s"), ("mem", "p"), ("men", "t"), ("me", ""),
+    ("peng", ""), ("peny", "s"), ("pem", "p"), ("pen", "t"), ("per", ""), ("pe", ""),
+    ("ber", ""), ("be", ""), ("ter", ""), ("di", ""), ("ke", ""), ("se", ""),
+)
+# bahasa sehari-hari -> bentuk baku yang dipakai konten
+_SLANG = {
+    "bikin": "buat", "bkin": "buat", "gmn": "bagaimana", "gimana": "bagaimana", "gak": "tidak",
+    "ga": "tidak", "nggak": "tidak", "udah": "sudah", "sdh": "sudah", "tdk": "tidak", "dgn": "dengan",
+    "lahiran": "lahir", "meninggal": "mati", "wafat": "mati", "ilang": "hilang", "kehilangan": "hilang",
+    "nikah": "kawin", "menikah": "kawin", "pernikahan": "kawin",
 }
+_STOPWORDS = frozenset(
+    "apa aja saja yang dan atau di ke dari untuk dengan ini itu ya kak min dong nih sih "
+    "mau ingin tanya mohon tolong info bagaimana cara gimana bisa tidak sudah ada saya aku".split()
+)
+
+
+@functools.lru_cache(maxsize=8192)
+def stem_id(word: str) -> str:
+    """Akar kata kasar, cukup untuk mencocokkan "pembuatan" ~ "buat"."""
+    word = _SLANG.get(word, word)
+    if len(word) <= 4:
+        return word
+    for group in (_PARTICLES, _POSSESSIVES):
+        for end in group:
+            if word.endswith(end) and len(word) - len(end) >= 4:
+                word = word[: -len(end)]
+                break
+    for end in _SUFFIXES:
+        if word.endswith(end) and len(word) - len(end) >= 4:
+            word = word[: -len(end)]
+            break
+    for _ in range(2):  # awalan bisa bertumpuk: "diper-", "memper-"
+        for pre, repl in _PREFIXES:
+            if word.startswith(pre) and len(word) - len(pre) + len(repl) >= 4:
+                word = repl + word[len(pre):]
+                break
+        else:
+            break
+    return _SLANG.get(word, word)
+
+
+def terms(text: str) -> List[str]:
+    """Token untuk retrieval: kanonik, tanpa stopword, di-stem."""
+    return [stem_id(w) for w in canonical(text).split() if w not in _STOPWORDS and not w.isdigit()]
+
+
+class BM25Index:
+    """Indeks BM25 atas isi DETAILS (+ keyword) untuk pertanyaan tanpa keyword cocok.
+
+    Bobot BM25 setiap (term, dokumen) dihitung sekali saat kompilasi dan
+    disimpan sebagai posting list; skor query = jumlah bobot term-nya,
+    tanpa menghitung ulang idf atau panjang dokumen.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, docs: List[Tuple[str, List[str]]]) -> None:
+        self.topics = tuple(topic for topic, _ in docs)
+        avgdl = sum(len(toks) for _, toks in docs) / max(len(docs), 1)
+        df: Dict[str, int] = {}
+        for _, toks in docs:
+            for t in set(toks):
+                df[t] = df.get(t, 0) + 1
+        n = len(docs)
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for doc, (_, toks) in enumerate(docs):
+            tf: Dict[str, int] = {}
+            for t in toks:
+                tf[t] = tf.get(t, 0) + 1
+            norm = self.K1 * (1 - self.B + self.B * len(toks) / avgdl)
+            for t, f in tf.items():
+                idf = math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5))
+                postings.setdefault(t, []).append((doc, idf * f * (self.K1 + 1) / (f + norm)))
+        self.postings: Dict[str, Tuple[Tuple[int, float], ...]] = {t: tuple(p) for t, p in postings.items()}
+
+    def search(self, text: str, k: int = 3) -> List[Tuple[str, float]]:
+        scores: Dict[int, float] = {}
+        for t in set(terms(text)):
+            for doc, w in self.postings.get(t, ()):
+                scores[doc] = scores.get(doc, 0.0) + w
+        best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.topics[doc], score) for doc, score in best]
+
 
 # =========================================================
-# KEYWORD & SINONIM UNTUK MODE KETIK BEBAS
-# =========================================================
-KW = {
-    "ktp_hilang": ["ktp hilang", "kehilangan ktp", "ktp ilang"],
-    "ktp_baru": ["ktp baru", "buat ktp", "daftar ktp", "pembuatan ktp"],
-    "ktp_ubah": ["ubah ktp", "koreksi ktp", "ganti data ktp", "perubahan ktp"],
-    "ktp_perpanjang": ["perpanjang ktp", "masa berlaku ktp", "ktp expired", "ktp mati"],
-    "kk_hilang": ["kk hilang", "kehilangan kk", "kk ilang"],
-    "kk_alamat": ["ubah alamat kk", "pindah alamat kk", "alamat kk"],
-    "kk_pekerjaan": ["pekerjaan kk", "ubah pekerjaan kk", "ganti pekerjaan kk"],
-    "kk_status": ["status kk", "ubah status kk", "nikah kk", "cerai kk"],
-    "kk_goldar": ["golongan darah kk", "goldar kk", "gologan darah kk", "g.darah kk"],
-    "kk_gabung": ["gabung kk", "penggabungan kk", "join kk"],
-    "kk_pisah": ["pisah kk", "pemisahan kk"],
-    "akta_lahir_umum": ["akta kelahiran", "buat akta lahir"],
-    "akta_lahir_hilang": ["akta kelahiran hilang", "kehilangan akta kelahiran"],
-    "akta_mati_umum": ["akta kematian", "buat akta kematian"],
-    "akta_mati_hilang": ["akta kematian hilang", "kehilangan akta kematian"],
-    "kia": ["kia", "kartu identitas anak"],
-    "pindah_keluar": ["pindah domisili", "surat pindah", "pindah keluar"],
-    "pendatang_masuk": ["pendatang", "kedatangan", "masuk domisili", "datang"],
-    "jam": ["jam", "buka", "operasional"],
-    "alamat": ["alamat", "lokasi", "kantor dimana", "dimana"],
-    "sidnok": ["sidnok", "online dukcapil", "layanan online", "online ktp", "online kk", "online akta"],
-    "faq": ["menu", "faq", "help", "bantuan", "panduan"],
-}
+# KATALOG RESPON
+# =========================================================
+@dataclass(frozen=True)
+class Reply:
+    """Payload siap kirim: teks sudah dipotong <= MAX_TG + keyboard bersama."""
+    parts: Tuple[str, ...]
+    markup: Optional[InlineKeyboardMarkup] = None
+
+
+def make_reply(text: str, markup: Optional[InlineKeyboardMarkup] = None) -> Reply:
+    return Reply(tuple(chunk_message(text)), markup)
+
 
 # =========================================================
-# MENU & SUBMENU (INLINE KEYBOARD)
+# KONTEN: BERKAS EKSTERNAL -> SNAPSHOT IMMUTABLE
 # =========================================================
-def kb_home() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("📄 KTP", callback_data="menu_ktp"),
-            InlineKeyboardButton("🏠 KK", callback_data="menu_kk"),
-        ],
-        [
-            InlineKeyboardButton("📜 Akta Kelahiran", callback_data="menu_akta_lahir"),
-            InlineKeyboardButton("⚰️ Akta Kematian", callback_data="menu_akta_mati"),
-        ],
-        [
-            InlineKeyboardButton("🧒 KIA Anak", callback_data="menu_kia"),
-            InlineKeyboardButton("🚚 Pindah / Datang", callback_data="menu_pindah"),
-        ],
-        [
-            InlineKeyboardButton("🕒 Jam & Alamat", callback_data="menu_info"),
-            InlineKeyboardButton("🌐 Sidnok Online", url=SIDNOK_URL),
-        ],
-        [
-            InlineKeyboardButton("📚 FAQ/Menu Bantuan", callback_data="menu_faq"),
-        ],
-    ])
+class ContentError(ValueError):
+    """Berkas konten tidak valid."""
 
 
-def kb_ktp() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🆕 KTP Baru", callback_data="ktp_baru")],
-        [InlineKeyboardButton("🧾 KTP Hilang", callback_data="ktp_hilang")],
-        [InlineKeyboardButton("✏️ Ubah Data KTP", callback_data="ktp_ubah")],
-        [InlineKeyboardButton("🔄 Masa Berlaku KTP", callback_data="ktp_perpanjang")],
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+@dataclass(frozen=True)
+class BookingConfig:
+    """Aturan antrean loket dari bagian "booking" konten (opsional)."""
+    slot_minutes: int
+    capacity: int  # warga per slot
+    service_daily_cap: int  # maks antrean per layanan per hari (0 = bebas)
+    days_ahead: int  # hari ke depan yang bisa dipesan (0 = hari ini saja)
+    lead_minutes: int  # slot hari ini minimal sekian menit dari sekarang
+    slots: Tuple[Tuple[int, ...], ...]  # per hari (0 = Senin): menit mulai tiap slot
+    closed: frozenset  # tanggal libur "YYYYMMDD"
+    services: Tuple[str, ...]  # key DETAILS
+    menu: Reply  # daftar layanan
 
 
-def kb_kk() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🏠 Ubah Alamat KK", callback_data="kk_alamat")],
-        [InlineKeyboardButton("💼 Ubah Pekerjaan KK", callback_data="kk_pekerjaan")],
-        [InlineKeyboardButton("💍 Ubah Status KK", callback_data="kk_status")],
-        [InlineKeyboardButton("🅾️ Ubah Golongan Darah", callback_data="kk_goldar")],
-        [InlineKeyboardButton("👨‍👩‍👧 Gabung KK", callback_data="kk_gabung")],
-        [InlineKeyboardButton("🧍 Pisah KK", callback_data="kk_pisah")],
-        [InlineKeyboardButton("🧾 KK Hilang", callback_data="kk_hilang")],
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+_WEEKDAYS = ("senin", "selasa", "rabu", "kamis", "jumat", "sabtu", "minggu")
 
 
-def kb_akta_lahir() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🧾 Akta Lahir Hilang", callback_data="akta_lahir_hilang")],
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+def _hhmm(value: object, where: str) -> int:
+    m = re.fullmatch(r"([01]\d|2[0-3]):([0-5]\d)", value) if isinstance(value, str) else None
+    if m is None:
+        raise ContentError(f"{where}: jam harus format HH:MM")
+    return int(m.group(1)) * 60 + int(m.group(2))
 
 
-def kb_akta_mati() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🧾 Akta Kematian Hilang", callback_data="akta_mati_hilang")],
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+def _booking(raw: Mapping[str, object], titles: Mapping[str, str]) -> Optional[BookingConfig]:
+    section = raw.get("booking")
+    if section is None:
+        return None
+    if not isinstance(section, dict):
+        raise ContentError("bagian 'booking' harus object")
 
+    def number(name: str, default: int, minimum: int) -> int:
+        value = section.get(name, default)
+        if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+            raise ContentError(f"booking.{name}: harus bilangan bulat >= {minimum}")
+        return value
 
-def kb_kia() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+    step = number("slot_minutes", 30, 5)
+    hours = section.get("hours")
+    if not isinstance(hours, dict) or not hours.keys() <= set(_WEEKDAYS):
+        raise ContentError(f"booking.hours: object dengan key {', '.join(_WEEKDAYS)}")
+    slots = []
+    for day in _WEEKDAYS:
+        span = hours.get(day)
+        if span is None:
+            slots.append(())
+            continue
+        if not isinstance(span, list) or len(span) != 2:
+            raise ContentError(f"booking.hours.{day}: harus [buka, tutup]")
+        start, end = (_hhmm(v, f"booking.hours.{day}") for v in span)
+        if end - start < step:
+            raise ContentError(f"booking.hours.{day}: lebih pendek dari satu slot")
+        slots.append(tuple(range(start, end - step + 1, step)))
+    closed = set()
+    for value in section.get("closed", []):
+        try:
+            closed.add(date.fromisoformat(value).strftime("%Y%m%d"))
+        except (TypeError, ValueError):
+            raise ContentError(f"booking.closed: tanggal '{value}' harus YYYY-MM-DD") from None
+    services = section.get("services")
+    if not isinstance(services, list) or not services:
+        raise ContentError("booking.services: list key details wajib diisi")
+    for svc in services:
+        if svc not in titles:
+            raise ContentError(f"booking.services: '{svc}' tidak ada di details")
+        if len(f"bk:t:{svc}:YYYYMMDD:HHMM".encode()) > 64:  # batas callback_data Telegram
+            raise ContentError(f"booking.services: key '{svc}' terlalu panjang")
+    rows = [[InlineKeyboardButton(titles[svc], callback_data=f"bk:s:{svc}")] for svc in services]
+    rows.append([InlineKeyboardButton("🏠 Menu Utama", callback_data="home")])
+    return BookingConfig(
+        slot_minutes=step,
+        capacity=number("capacity", 10, 1),
+        service_daily_cap=number("service_daily_cap", 0, 0),
+        days_ahead=number("days_ahead", 6, 0),
+        lead_minutes=number("lead_minutes", 30, 0),
+        slots=tuple(slots),
+        closed=frozenset(closed),
+        services=tuple(services),
+        menu=make_reply("📅 *Ambil Antrean Loket*\n\nPilih layanan yang akan diurus:", InlineKeyboardMarkup(rows)),
+    )
 
 
-def kb_pindah() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🚚 Perpindahan Keluar", callback_data="pindah_keluar")],
-        [InlineKeyboardButton("📦 Pendatang Masuk", callback_data="pendatang_masuk")],
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+@dataclass(frozen=True)
+class ChecklistConfig:
+    """Data persyaratan untuk wizard cek berkas; himpunan berkas = bitmask indeks docs."""
+    docs: Tuple[str, ...]  # label berkas, urut tampil
+    cases: Tuple[Tuple[str, int], ...]  # (label keperluan, mask berkas)
+    questions: Tuple[Tuple[str, Tuple[Tuple[str, int], ...]], ...]  # (pertanyaan, ((opsi, mask), ...))
 
 
-def kb_info() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🌐 Sidnok", url=SIDNOK_URL)],
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+def _checklist(raw: Mapping[str, object]) -> Optional[ChecklistConfig]:
+    section = raw.get("checklist")
+    if section is None:
+        return None
+    if not isinstance(section, dict) or not isinstance(section.get("docs"), dict) or not section["docs"]:
+        raise ContentError("checklist: butuh object 'docs' (id -> label)")
+    ids = {doc: i for i, doc in enumerate(section["docs"])}
+    if len(ids) > 60:  # satu tombol per berkas; batas keyboard Telegram 100 tombol
+        raise ContentError("checklist.docs: maksimal 60 berkas")
 
+    def options(items: object, where: str) -> Tuple[Tuple[str, int], ...]:
+        if not isinstance(items, list) or not items:
+            raise ContentError(f"{where}: harus list tidak kosong")
+        built = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not isinstance(item.get("label"), str) or not isinstance(item.get("docs"), list):
+                raise ContentError(f"{where}[{i}]: butuh 'label' & 'docs'")
+            unknown = [d for d in item["docs"] if d not in ids]
+            if unknown:
+                raise ContentError(f"{where}[{i}]: berkas tidak dikenal {unknown}")
+            built.append((item["label"], sum(1 << ids[d] for d in set(item["docs"]))))
+        return tuple(built)
 
-def kb_faq() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⬅️ Kembali", callback_data="home")],
-    ])
+    questions = []
+    for i, q in enumerate(section.get("questions", [])):
+        if not isinstance(q, dict) or not isinstance(q.get("text"), str):
+            raise ContentError(f"checklist.questions[{i}]: butuh 'text' & 'options'")
+        questions.append((q["text"], options(q.get("options"), f"checklist.questions[{i}].options")))
+    return ChecklistConfig(
+        docs=tuple(_expand(label, {}, f"checklist.docs.{doc}") for doc, label in section["docs"].items()),
+        cases=options(section.get("cases"), "checklist.cases"),
+        questions=tuple(questions),
+    )
 
 
-# =========================================================
-# RESPON MENU
-# =========================================================
-def ans_home() -> Tuple[str, InlineKeyboardMarkup]:
-    return HOME_TEXT, kb_home()
+@dataclass(frozen=True)
+class ContentSnapshot:
+    """Konten yang sudah divalidasi & dikompilasi; tidak pernah diubah di tempat.
 
+    Handler cukup membaca global CONTENT sekali per update; reload membuat
+    snapshot baru lalu menukar referensinya (atomic di event loop).
+    """
+    version: str
+    texts: Mapping[str, str]
+    details: Mapping[str, str]
+    keywords: Mapping[str, Tuple[str, ...]]  # intent -> frasa (urut prioritas)
+    matcher: IntentMatcher
+    fuzzy: FuzzyIndex
+    catalog: Mapping[str, Reply]  # callback key / intent / teks -> Reply
+    callback_keys: frozenset  # key yang sah dari tombol
+    inline: PrefixIndex  # topik untuk inline query
+    articles: Mapping[str, InlineQueryResultArticle]  # topik -> hasil inline siap kirim
+    retrieval: BM25Index  # cadangan terakhir: isi DETAILS
+    buttons: Mapping[str, InlineKeyboardButton]  # topik detail -> tombol saran
+    booking: Optional[BookingConfig]  # antrean loket; None = fitur mati
+    checklist: Optional[ChecklistConfig]  # wizard cek berkas; None = fitur mati
+    lang: str  # kode bahasa bundle ini
+    languages: Mapping[str, "ContentSnapshot"]  # bundle bahasa lain (hanya di snapshot dasar)
+    detector: Optional[LanguageDetector]  # hanya di snapshot dasar, None = satu bahasa
+    language_menu: Optional[Reply]  # tombol pilih bahasa (/bahasa)
 
-def ans_ktp() -> Tuple[str, InlineKeyboardMarkup]:
-    return "📄 *Layanan KTP* — pilih topik:", kb_ktp()
+    def for_lang(self, lang: Optional[str]) -> "ContentSnapshot":
+        """Bundle bahasa `lang`; kode kosong/tidak dikenal = bahasa dasar."""
+        if not lang or lang == self.lang:
+            return self
+        return self.languages.get(lang, self)
 
+    def resolve(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """(intent, sumber) untuk teks bebas: cocok persis dulu, baru toleran salah ketik."""
+        intent = self.matcher.match(text)
+        if intent is not None:
+            return intent, "persis"
+        intent = self.fuzzy.match(text)
+        return intent, "fuzzy" if intent is not None else None
 
-def ans_kk() -> Tuple[str, InlineKeyboardMarkup]:
-    return "🏠 *Layanan KK* — pilih topik:", kb_kk()
+    def answer(self, text: str) -> Tuple[Optional[str], Reply, Optional[str]]:
+        """(intent, Reply, sumber); tanpa intent, cari di isi DETAILS (BM25).
 
+        Hasil teratas yang jelas unggul langsung dijawab; bila skornya
+        berdekatan, warga diberi maksimal 3 tombol topik untuk dipilih.
+        Sumber ("persis", "fuzzy", "bm25:<hasil>") ikut disimpan di cache
+        supaya metrik tetap tercatat saat jawaban diambil dari cache.
+        """
+        intent, source = self.resolve(text)
+        if intent is not None or RETRIEVAL_MIN_SCORE <= 0:
+            return intent, self.catalog[intent or "fallback"], source
+        hits = [(t, sc) for t, sc in self.retrieval.search(text, 3) if sc >= RETRIEVAL_MIN_SCORE / 2]
+        if not hits:
+            return None, self.catalog["fallback"], "bm25:none"
+        top, score = hits[0]
+        if score >= RETRIEVAL_MIN_SCORE and (len(hits) == 1 or score >= 1.5 * hits[1][1]):
+            return top, self.catalog[top], "bm25:answer"
+        rows = [[self.buttons[t]] for t, _ in hits] + [[self.buttons["home"]]]
+        return None, make_reply(self.texts["suggest"], InlineKeyboardMarkup(rows)), "bm25:suggest"
 
-def ans_akta_lahir() -> Tuple[str, InlineKeyboardMarkup]:
-    return DETAILS["akta_lahir_umum"], kb_akta_lahir()
 
+_MD_STRIP = str.maketrans("", "", "*_`")
+_TEMPLATE_VAR = re.compile(r"\{([a-z0-9_]+)\}")
 
-def ans_akta_mati() -> Tuple[str, InlineKeyboardMarkup]:
-    return DETAILS["akta_mati_umum"], kb_akta_mati()
 
+def _expand(text: object, names: Mapping[str, str], where: str) -> str:
+    """Isi placeholder {nama}; hanya nama yang dikenal, selain itu error."""
+    if not isinstance(text, str) or not text:
+        raise ContentError(f"{where}: harus teks tidak kosong")
 
-def ans_kia() -> Tuple[str, InlineKeyboardMarkup]:
-    return (
-        "🧒 *KIA (Kartu Identitas Anak)*\n"
-        "• Akta Kelahiran\n"
-        "• KK\n"
-        "• KTP orang tua\n"
-        "• Pas foto 3×4 anak",
-        kb_kia()
-    )
+    def sub(m: "re.Match[str]") -> str:
+        if m.group(1) not in names:
+            raise ContentError(f"{where}: placeholder {{{m.group(1)}}} tidak dikenal")
+        return names[m.group(1)]
 
+    return _TEMPLATE_VAR.sub(sub, text)
 
-def ans_pindah() -> Tuple[str, InlineKeyboardMarkup]:
-    return "🚚 *Pindah/Kedatangan Domisili* — pilih:", kb_pindah()
 
+def _str_map(raw: Mapping[str, object], section: str) -> Dict[str, object]:
+    value = raw.get(section)
+    if not isinstance(value, dict):
+        raise ContentError(f"bagian '{section}' wajib berupa object")
+    return value
 
-def ans_info() -> Tuple[str, InlineKeyboardMarkup]:
-    return f"{JAM_BUKA}\n\n{ALAMAT}", kb_info()
 
+def _keyboard(rows: object, names: Mapping[str, str], where: str) -> InlineKeyboardMarkup:
+    if not isinstance(rows, list) or not all(isinstance(r, list) and r for r in rows):
+        raise ContentError(f"{where}: keyboard harus list baris tombol")
+    built = []
+    for row in rows:
+        buttons = []
+        for btn in row:
+            if not isinstance(btn, dict) or "text" not in btn or ("data" in btn) == ("url" in btn):
+                raise ContentError(f"{where}: tombol butuh 'text' dan salah satu 'data'/'url'")
+            if "url" in btn:
+                buttons.append(InlineKeyboardButton(btn["text"], url=_expand(btn["url"], names, where)))
+            else:
+                buttons.append(InlineKeyboardButton(btn["text"], callback_data=btn["data"]))
+        built.append(buttons)
+    return InlineKeyboardMarkup(built)
 
-def ans_faq() -> Tuple[str, InlineKeyboardMarkup]:
-    return FAQ_TEXT, kb_faq()
 
+_OVERLAY_KEYS = frozenset({"name", "hints", "vars", "texts", "details", "intents", "menus", "labels"})
 
-MENUS: Dict[str, Callable[[], Tuple[str, InlineKeyboardMarkup]]] = {
-    "home": ans_home,
-    "menu_ktp": ans_ktp,
-    "menu_kk": ans_kk,
-    "menu_akta_lahir": ans_akta_lahir,
-    "menu_akta_mati": ans_akta_mati,
-    "menu_kia": ans_kia,
-    "menu_pindah": ans_pindah,
-    "menu_info": ans_info,
-    "menu_faq": ans_faq,
-}
 
+def _overlay(raw: Mapping[str, object], lang: Mapping[str, object], where: str) -> Dict[str, object]:
+    """Konten mentah bahasa lain = konten dasar ditimpa terjemahan.
 
-# =========================================================
-# MODE KETIK BEBAS (NLP SEDERHANA)
-# =========================================================
-def answer_free_text(user_text: str) -> str:
-    t = normalize(user_text)
-
-    # urutan cek dari yang spesifik ke umum
-    # KTP
-    if any_in(t, KW["ktp_hilang"]):
-        return DETAILS["ktp_hilang"]
-    if any_in(t, KW["ktp_baru"]) or ("ktp" in t and any_in(t, ["baru", "buat", "daftar", "pembuatan"])):
-        return DETAILS["ktp_baru"]
-    if any_in(t, KW["ktp_perpanjang"]):
-        return DETAILS["ktp_perpanjang"]
-    if "ktp" in t and any_in(t, ["ubah", "koreksi", "ganti", "perubahan"]):
-        return DETAILS["ktp_ubah"]
-
-    # KK
-    if any_in(t, KW["kk_hilang"]):
-        return DETAILS["kk_hilang"]
-    if any_in(t, KW["kk_alamat"]):
-        return DETAILS["kk_alamat"]
-    if any_in(t, KW["kk_pekerjaan"]):
-        return DETAILS["kk_pekerjaan"]
-    if any_in(t, KW["kk_status"]):
-        return DETAILS["kk_status"]
-    if any_in(t, KW["kk_goldar"]):
-        return DETAILS["kk_goldar"]
-    if any_in(t, KW["kk_gabung"]):
-        return DETAILS["kk_gabung"]
-    if any_in(t, KW["kk_pisah"]):
-        return DETAILS["kk_pisah"]
-
-    # Akta
-    if any_in(t, KW["akta_lahir_hilang"]):
-        return DETAILS["akta_lahir_hilang"]
-    if any_in(t, KW["akta_lahir_umum"]):
-        return DETAILS["akta_lahir_umum"]
-    if any_in(t, KW["akta_mati_hilang"]):
-        return DETAILS["akta_mati_hilang"]
-    if any_in(t, KW["akta_mati_umum"]):
-        return DETAILS["akta_mati_umum"]
-
-    # KIA
-    if any_in(t, KW["kia"]):
-        # gunakan teks dari ans_kia
-        return ans_kia()[0]
-
-    # Pindah / Datang
-    if any_in(t, KW["pindah_keluar"]):
-        return DETAILS["pindah_keluar"]
-    if any_in(t, KW["pendatang_masuk"]):
-        return DETAILS["pendatang_masuk"]
-
-    # Sidnok / Info
-    if any_in(t, KW["sidnok"]):
-        return DETAILS["sidnok"]
-    if any_in(t, KW["jam"]):
-        return DETAILS["jam"]
-    if any_in(t, KW["alamat"]):
-        return DETAILS["alamat"]
-
-    # FAQ/Help
-    if any_in(t, KW["faq"]):
-        return FAQ_TEXT
-
-    # Fallback
-    return (
-        "❓ *Maaf, saya belum mengenali pertanyaan itu.*\n"
-        "Coba ketik salah satu contoh: `ktp hilang`, `kk ubah alamat`, `akta kelahiran`, `kia`, `pindah domisili`, `sidnok`.\n"
-        "Atau buka *Menu* lewat perintah /menu."
+    Key yang tidak diterjemahkan memakai teks dasar; keyword terjemahan
+    ditambahkan di depan keyword dasar (warga sering mencampur bahasa);
+    tombol diterjemahkan lewat peta `labels` (teks asli -> terjemahan).
+    """
+    if not lang.keys() <= _OVERLAY_KEYS:
+        raise ContentError(f"{where}: key tidak dikenal {sorted(lang.keys() - _OVERLAY_KEYS)}")
+    merged = {k: v for k, v in raw.items() if k != "languages"}
+    for section in ("vars", "texts", "details", "intents", "menus", "labels"):
+        if not isinstance(lang.get(section, {}), dict):
+            raise ContentError(f"{where}.{section}: harus object")
+    for section in ("vars", "texts", "details"):
+        extra = lang.get(section, {})
+        unknown = extra.keys() - raw[section].keys()
+        if unknown:
+            raise ContentError(f"{where}.{section}: tidak ada di konten dasar: {sorted(unknown)}")
+        merged[section] = {**raw[section], **extra}
+
+    extra_kw = lang.get("intents", {})
+    unknown = extra_kw.keys() - {item["id"] for item in raw["intents"]}
+    if unknown:
+        raise ContentError(f"{where}.intents: intent tidak dikenal {sorted(unknown)}")
+    if not all(isinstance(kws, list) and all(isinstance(k, str) for k in kws) for kws in extra_kw.values()):
+        raise ContentError(f"{where}.intents: nilai harus list keyword")
+    merged["intents"] = [
+        {**item, "keywords": list(extra_kw.get(item["id"], [])) + list(item.get("keywords", []))}
+        for item in raw["intents"]
+    ]
+
+    menu_texts, labels = lang.get("menus", {}), lang.get("labels", {})
+    unknown = menu_texts.keys() - raw["menus"].keys()
+    if unknown:
+        raise ContentError(f"{where}.menus: menu tidak dikenal {sorted(unknown)}")
+    merged["menus"] = {
+        key: {
+            "text": menu_texts.get(key, m["text"]),
+            "keyboard": [[{**b, "text": labels.get(b["text"], b["text"])} for b in row] for row in m["keyboard"]],
+        }
+        for key, m in raw["menus"].items()
+    }
+    merged["labels"] = labels
+    return merged
+
+
+def compile_content(raw: Mapping[str, object], version: str) -> ContentSnapshot:
+    """Snapshot bahasa dasar + satu bundle terkompilasi per bahasa di bagian
+    "languages" (matcher, keyboard & katalog masing-masing), plus detektor bahasa."""
+    base = _compile_bundle(raw, version, BASE_LANG)
+    languages = raw.get("languages", {})
+    if not isinstance(languages, dict):
+        raise ContentError("bagian 'languages' harus object")
+
+    def words(phrases: Iterable[str]) -> List[str]:
+        return [w for p in phrases for w in canonical(p).split()]
+
+    vocab = {BASE_LANG: words(kw for kws in base.keywords.values() for kw in kws)}
+    names: Dict[str, str] = {BASE_LANG: BASE_LANG}
+    bundles: Dict[str, ContentSnapshot] = {}
+    for code, lang in languages.items():
+        where = f"languages.{code}"
+        if not isinstance(lang, dict) or not isinstance(lang.get("name", ""), str):
+            raise ContentError(f"{where}: harus object (name, hints, texts, ...)")
+        if not re.fullmatch(r"[a-z]{2,3}", code):
+            raise ContentError(f"{where}: kode bahasa harus 2-3 huruf kecil")
+        names[code] = lang.get("name") or code
+        hints = words(lang.get("hints", []))
+        if code == BASE_LANG:
+            if lang.keys() - {"name", "hints"}:
+                raise ContentError(f"{where}: bahasa dasar hanya boleh berisi name & hints")
+            vocab[code] += hints
+            continue
+        bundles[code] = _compile_bundle(_overlay(raw, lang, where), version, code)
+        vocab[code] = hints + words(kw for kws in lang.get("intents", {}).values() for kw in kws)
+    if not bundles:
+        return base
+    rows = [[InlineKeyboardButton(names[code], callback_data=f"lang:{code}")] for code in names]
+    return replace(
+        base,
+        languages=MappingProxyType(bundles),
+        detector=LanguageDetector(vocab),
+        language_menu=make_reply("🌐 *Pilih bahasa · Pilih basa · Choose language*", InlineKeyboardMarkup(rows)),
+    )
+
+
+def _compile_bundle(raw: Mapping[str, object], version: str, lang: str) -> ContentSnapshot:
+    """Validasi data konten mentah satu bahasa lalu bangun matcher, keyboard & katalog."""
+    variables = {k: _expand(v, {}, f"vars.{k}") for k, v in _str_map(raw, "vars").items()}
+    texts = {k: _expand(v, variables, f"texts.{k}") for k, v in _str_map(raw, "texts").items()}
+    details = {k: _expand(v, variables, f"details.{k}") for k, v in _str_map(raw, "details").items()}
+    for key in ("home", "about", "faq", "info", "fallback"):
+        if key not in texts:
+            raise ContentError(f"texts.{key} wajib ada")
+    texts.setdefault("suggest", "🤔 Mungkin yang Anda maksud salah satu ini?")
+    texts.setdefault("throttled", "⏳ Pesan Anda terlalu banyak. Mohon tunggu beberapa menit lalu coba lagi.")
+    if texts.keys() & details.keys():
+        raise ContentError(f"key ganda di texts & details: {sorted(texts.keys() & details.keys())}")
+
+    # intent: urutan list = prioritas
+    intents = raw.get("intents")
+    if not isinstance(intents, list) or not intents:
+        raise ContentError("bagian 'intents' wajib berupa list")
+    rules: IntentRules = []
+    keywords: Dict[str, Tuple[str, ...]] = {}
+    for i, item in enumerate(intents):
+        where = f"intents[{i}]"
+        if not isinstance(item, dict) or not isinstance(item.get("id"), str):
+            raise ContentError(f"{where}: butuh 'id'")
+        # keyword dikanonikkan sama seperti pesan warga ("g.darah kk" -> "g darah kk")
+        kws = tuple(canonical(k) for k in item.get("keywords", []))
+        combos = [tuple(canonical(p) for p in c) for c in item.get("combos", [])]
+        if not all(kws) or not all(c and all(c) for c in combos) or not (kws or combos):
+            raise ContentError(f"{where}: keyword/combos kosong")
+        rules.append((item["id"], [(k,) for k in kws] + combos))
+        keywords[item["id"]] = kws
+
+    # menu tombol: teks boleh merujuk vars, texts, atau details
+    names = {**variables, **texts, **details}
+    menus: Dict[str, Reply] = {}
+    for key, m in _str_map(raw, "menus").items():
+        if not isinstance(m, dict):
+            raise ContentError(f"menus.{key}: harus object berisi text & keyboard")
+        where = f"menus.{key}"
+        menus[key] = make_reply(_expand(m.get("text"), names, where), _keyboard(m.get("keyboard"), names, where))
+    if "home" not in menus:
+        raise ContentError("menus.home wajib ada")
+
+    catalog: Dict[str, Reply] = {k: make_reply(v) for k, v in {**texts, **details}.items()}
+    catalog.update(menus)
+    callback_keys = frozenset(menus) | frozenset(details)
+
+    # semua rujukan harus terselesaikan sekarang, bukan saat ada warga yang klik
+    for intent in keywords:
+        if intent not in texts and intent not in details:
+            raise ContentError(f"intent '{intent}' tidak punya jawaban di texts/details")
+    # inline mode: semua topik detail + intent yang jawabannya di texts
+    topics = list(details) + [i for i in keywords if i not in details]
+    entries: List[Tuple[str, str, int]] = []
+    articles: Dict[str, InlineQueryResultArticle] = {}
+    for topic in topics:
+        title, _, rest = catalog[topic].parts[0].partition("\n")
+        title = title.translate(_MD_STRIP).strip()
+        entries.append((topic, title, PrefixIndex.TITLE_WEIGHT))
+        entries.extend((topic, kw, PrefixIndex.KEYWORD_WEIGHT) for kw in keywords.get(topic, ()))
+        articles[topic] = InlineQueryResultArticle(
+            id=topic,
+            title=title,
+            description=" ".join(rest.translate(_MD_STRIP).split())[:120],
+            input_message_content=InputTextMessageContent(
+                catalog[topic].parts[0], parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True
+            ),
+        )
+
+    # retrieval: isi detail + keyword-nya (keyword dihitung dua kali agar lebih berbobot)
+    docs = [(k, terms(v) + 2 * [t for kw in keywords.get(k, ()) for t in terms(kw)]) for k, v in details.items()]
+    buttons = {t: InlineKeyboardButton(articles[t].title, callback_data=t) for t in details}
+    home_label = raw.get("labels", {}).get("🏠 Menu Utama", "🏠 Menu Utama")
+    buttons["home"] = InlineKeyboardButton(home_label, callback_data="home")
+    booking = _booking(raw, {t: articles[t].title for t in details})
+    checklist = _checklist(raw)
+    allowed = callback_keys | ({"bk"} if booking else frozenset()) | ({"ck"} if checklist else frozenset())
+    for key, reply in menus.items():
+        for row in reply.markup.inline_keyboard:
+            for btn in row:
+                if btn.callback_data is not None and btn.callback_data not in allowed:
+                    raise ContentError(f"menus.{key}: tombol ke '{btn.callback_data}' tidak dikenal")
+
+    return ContentSnapshot(
+        version=version,
+        texts=MappingProxyType(texts),
+        details=MappingProxyType(details),
+        keywords=MappingProxyType(keywords),
+        matcher=IntentMatcher.compile(rules),
+        fuzzy=FuzzyIndex(keywords, FUZZY_THRESHOLD),
+        catalog=MappingProxyType(catalog),
+        callback_keys=callback_keys,
+        inline=PrefixIndex(entries),
+        articles=MappingProxyType(articles),
+        retrieval=BM25Index(docs),
+        buttons=MappingProxyType(buttons),
+        booking=booking,
+        checklist=checklist,
+        lang=lang,
+        languages=MappingProxyType({}),
+        detector=None,
+        language_menu=None,
     )
 
 
+def load_content(path: str = CONTENT_PATH) -> ContentSnapshot:
+    with open(path, "rb") as f:
+        data = f.read()
+    return compile_content(json.loads(data), hashlib.sha1(data).hexdigest()[:10])
+
+
+CONTENT = load_content()
+STARTUP.mark("konten")
+
+
+async def reload_content(path: str = CONTENT_PATH) -> bool:
+    """Muat ulang konten; bila gagal, snapshot lama tetap dipakai.
+
+    Baca & kompilasi berjalan di thread executor supaya event loop tetap
+    melayani update. Snapshot diganti dan REPLY_CACHE dikosongkan di loop
+    dalam satu langkah (tanpa await di antaranya), jadi tidak ada lookup yang
+    melihat konten baru bersama jawaban lama.
+    """
+    global CONTENT
+    try:
+        snap = await asyncio.get_running_loop().run_in_executor(None, load_content, path)
+    except (OSError, ValueError) as e:  # ContentError & JSONDecodeError turunan ValueError
+        log.error("Konten gagal dimuat, tetap pakai versi %s: %s", CONTENT.version, e)
+        return False
+    if snap.version != CONTENT.version:
+        CONTENT = snap
+        REPLY_CACHE.clear()  # jawaban lama tidak boleh bocor ke konten baru
+        log.info("Konten versi %s aktif", snap.version)
+    return True
+
+
+async def watch_content(path: str = CONTENT_PATH) -> None:
+    """Cek mtime berkas konten berkala (bukan per request) & reload bila berubah."""
+    last = None
+    while True:
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if last is not None and stamp is not None and stamp != last:
+            await reload_content(path)
+        last = stamp
+        await asyncio.sleep(CONTENT_POLL_SEC)
+
+
+class ReplyCache:
+    """LRU: teks kanonik -> (intent, Reply, sumber). Dikosongkan setiap reload konten."""
+
+    MAX_KEY_LEN = 200  # pesan panjang jarang berulang, tidak perlu di-cache
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._data: "OrderedDict[str, Tuple[Optional[str], Reply, Optional[str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Tuple[Optional[str], Reply, Optional[str]]]:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Tuple[Optional[str], Reply, Optional[str]]) -> None:
+        if self.size <= 0 or len(key) > self.MAX_KEY_LEN:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+REPLY_CACHE = ReplyCache(REPLY_CACHE_SIZE)
+METRICS.gauge("dukcapil_reply_cache_hits_total", lambda: REPLY_CACHE.hits, "Cache jawaban: hit", "counter")
+METRICS.gauge("dukcapil_reply_cache_misses_total", lambda: REPLY_CACHE.misses, "Cache jawaban: miss", "counter")
+METRICS.gauge("dukcapil_reply_cache_size", lambda: len(REPLY_CACHE), "Cache jawaban: jumlah entri")
+
+
+def lookup(user_text: str, lang: Optional[str] = None) -> Tuple[Optional[str], Reply]:
+    """Intent + Reply siap kirim untuk teks bebas (bundle bahasa `lang`), lewat cache LRU."""
+    snap = CONTENT.for_lang(lang)
+    key = canonical(user_text)
+    cache_key = key if snap.lang == BASE_LANG else f"{snap.lang}|{key}"
+    value = REPLY_CACHE.get(cache_key)
+    if value is None:
+        value = snap.answer(key)
+        REPLY_CACHE.put(cache_key, value)
+    intent, reply, source = value
+    # metrik per jalur dicatat di sini, jadi hit cache tetap terhitung
+    if source == "fuzzy":
+        METRICS.inc("dukcapil_fuzzy_hits_total", intent=intent)
+    elif source and source.startswith("bm25:"):
+        METRICS.inc("dukcapil_retrieval_total", result=source[5:])
+    return intent, reply
+
+
+def detect_lang(text: str) -> Optional[str]:
+    """Bahasa dari kata khas di pesan. None = belum bisa ditebak."""
+    snap = CONTENT
+    if snap.detector is None or not text:
+        return None
+    return snap.detector.detect(canonical(text))
+
+
+def app_lang(update: Update) -> Optional[str]:
+    """Bahasa aplikasi Telegram warga bila kontennya tersedia. Hanya cadangan
+    per pesan, tidak pernah disimpan: banyak warga memakai aplikasi berbahasa
+    Inggris tapi tetap bertanya dalam bahasa Indonesia."""
+    user = update.effective_user
+    if user is None or not user.language_code:
+        return None
+    code = user.language_code.split("-")[0].lower()
+    snap = CONTENT
+    return code if code == snap.lang or code in snap.languages else None
+
+
 # =========================================================
 # HANDLERS
 # =========================================================
-async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text, kb = ans_home()
-    for part in chunk_message(text):
-        await update.message.reply_text(
-            part, parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
+class ShownMessages:
+    """LRU (chat_id, message_id) -> Reply yang sedang tampil di pesan bertombol.
+
+    Reply katalog adalah objek immutable bersama, jadi perbandingan `is`
+    cukup untuk tahu bahwa edit tidak akan mengubah apa pun.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._data: "OrderedDict[Tuple[int, int], Reply]" = OrderedDict()
+
+    def get(self, chat_id: int, message_id: int) -> Optional[Reply]:
+        return self._data.get((chat_id, message_id))
+
+    def put(self, chat_id: int, message_id: int, reply: Reply) -> None:
+        key = (chat_id, message_id)
+        self._data[key] = reply
+        self._data.move_to_end(key)
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+
+SHOWN = ShownMessages(10_000)
+
+
+async def send_reply(message: Message, reply: Reply) -> None:
+    """Kirim semua bagian Reply; keyboard ditempel di bagian terakhir."""
+    last = len(reply.parts) - 1
+    for i, part in enumerate(reply.parts):
+        sent = await message.reply_text(
+            part,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply.markup if i == last else None,
+            disable_web_page_preview=True,
         )
+    if reply.markup is not None:
+        SHOWN.put(sent.chat_id, sent.message_id, reply)
+
+
+def chat_content(update: Update) -> ContentSnapshot:
+    """Bundle konten sesuai bahasa chat (tanpa membuat state baru); chat yang
+    belum punya bahasa memakai bahasa aplikasi Telegram warga."""
+    chat = update.effective_chat
+    state = STATE.chats.get(chat.id) if chat else None
+    return CONTENT.for_lang(state.lang if state and state.lang else app_lang(update))
+
+
+async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = STATE.chat(update.effective_chat.id)
+    if state.subscribed is None:  # pengguna baru otomatis menerima pengumuman
+        STATE.set(update.effective_chat.id, subscribed=1)
+    await send_reply(update.message, chat_content(update).catalog["home"])
 
 
 async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text, kb = ans_home()
-    await update.message.reply_text(
-        text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
-    )
+    await send_reply(update.message, chat_content(update).catalog["home"])
 
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text, kb = ans_faq()
-    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    await send_reply(update.message, chat_content(update).catalog["menu_faq"])
 
 
 async def cmd_about(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(ABOUT_TEXT, parse_mode=ParseMode.MARKDOWN)
+    await send_reply(update.message, chat_content(update).catalog["about"])
 
 
 async def cmd_sidnok(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(DETAILS["sidnok"], parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    await send_reply(update.message, chat_content(update).catalog["sidnok"])
 
 
 async def cmd_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(f"{JAM_BUKA}\n\n{ALAMAT}", parse_mode=ParseMode.MARKDOWN)
+    await send_reply(update.message, chat_content(update).catalog["info"])
 
 
-async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    data = q.data
-    try:
-        if data in MENUS:
-            text, kb = MENUS[data]()
-            # edit message bila memungkinkan, kalau gagal kirim baru
-            try:
-                await q.edit_message_text(
-                    text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
-                )
-            except Exception:
-                await q.message.reply_text(
-                    text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb, disable_web_page_preview=True
-                )
-        elif data in DETAILS:
-            txt = DETAILS[data]
-            for part in chunk_message(txt):
-                try:
-                    await q.edit_message_text(part, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-                except Exception:
-                    await q.message.reply_text(part, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-        else:
-            await q.answer("Menu tidak dikenali.", show_alert=False)
-    except Exception as e:
-        log.exception("Callback error: %s", e)
-        await q.answer("Terjadi gangguan. Coba lagi ya.", show_alert=True)
+async def cmd_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    menu = CONTENT.language_menu
+    if menu is None:
+        await update.message.reply_text("Konten hanya tersedia dalam satu bahasa.")
+        return
+    await send_reply(update.message, menu)
 
 
-async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text or ""
-    # catat jika ada link/mention (biar siap kalau nanti dipakai)
-    _ = [e for e in (update.message.entities or []) if e.type in (MessageEntity.URL, MessageEntity.MENTION)]
-    try:
-        ans = answer_free_text(text)
-        for part in chunk_message(ans):
-            await update.message.reply_text(part, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-    except Exception as e:
-        log.exception("Message error: %s", e)
-        await update.message.reply_text(
-            "⚠️ Terjadi gangguan. Silakan coba lagi.", parse_mode=ParseMode.MARKDOWN
-        )
+async def cmd_subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    STATE.set(update.effective_chat.id, subscribed=1)
+    await update.message.reply_text("🔔 Anda akan menerima pengumuman layanan. Ketik /berhenti untuk berhenti.")
+
+
+async def cmd_unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    STATE.set(update.effective_chat.id, subscribed=0)
+    await update.message.reply_text("🔕 Anda tidak akan menerima pengumuman lagi. Ketik /langganan untuk aktif kembali.")
+
+
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast <teks Markdown> = kirim ke semua pelanggan; tanpa teks = status."""
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        await update.message.reply_text("Perintah ini khusus admin.")
+        return
+    caster: Broadcaster = context.bot_data["broadcaster"]
+    parts = (update.message.text or "").split(None, 1)
+    if len(parts) < 2:
+        job = caster.job
+        await update.message.reply_text(job.summary() if job else "Belum ada pengumuman.")
+        return
+    if caster.running:
+        await update.message.reply_text("Masih ada pengumuman berjalan:\n" + caster.job.summary())
+        return
+    job = await caster.start(context.bot, parts[1], update.effective_chat.id)
+    await update.message.reply_text(f"📢 Pengumuman #{job.id} mulai dikirim ke {job.total} chat.")
+
+
+async def on_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline query (`@bot ktp` di chat lain): hasil sudah jadi di snapshot,
+    jadi jawaban hanya lookup indeks; cache_time membuat Telegram menjawab
+    query yang sama tanpa menghubungi bot lagi."""
+    q = update.inline_query
+    snap = CONTENT
+    topics = snap.inline.search(q.query, INLINE_MAX_RESULTS)
+    METRICS.inc("dukcapil_inline_total", result="hit" if topics else "empty")
+    trace(results=len(topics))
+    await q.answer([snap.articles[t] for t in topics], cache_time=INLINE_CACHE_SEC, is_personal=False)
+
+
+async def _ack(q: CallbackQuery, text: Optional[str] = None) -> None:
+    try:
+        await q.answer(text)
+    except TelegramError as e:  # query kedaluwarsa (> ~15 dtk antre): tidak fatal
+        log.debug("answerCallbackQuery gagal: %s", e)
+
+
+async def edit_or_send(q: CallbackQuery, reply: Reply) -> None:
+    """Ganti isi pesan bertombol dengan Reply satu bagian; pesan tidak bisa
+    diedit = kirim baru. Gangguan jaringan tidak dikirim ulang: edit mungkin
+    sudah diterapkan, warga cukup menekan tombolnya lagi."""
+    msg = q.message
+    try:
+        await q.edit_message_text(
+            reply.parts[0], parse_mode=ParseMode.MARKDOWN, reply_markup=reply.markup, disable_web_page_preview=True
+        )
+    except BadRequest as e:
+        # "message to edit not found", "message can't be edited", dst. juga 400
+        if "not modified" not in str(e).lower():
+            log.info("Edit gagal (%s), kirim pesan baru", e)
+            await send_reply(msg, reply)
+            return
+    except NetworkError as e:
+        log.warning("Edit tidak pasti (%s), tidak dikirim ulang", e)
+        return
+    SHOWN.put(msg.chat_id, msg.message_id, reply)
+
+
+async def on_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tombol "lang:<kode>": simpan bahasa chat lalu tampilkan menu utama bahasa itu."""
+    q = update.callback_query
+    code = q.data.split(":", 1)[1]
+    snap = CONTENT
+    known = code == snap.lang or code in snap.languages
+    ack = asyncio.create_task(_ack(q, None if known else "Bahasa tidak dikenal."))
+    try:
+        if known and q.message is not None:
+            STATE.set(q.message.chat_id, lang=code)
+            METRICS.inc("dukcapil_lang_total", lang=code, source="pilih")
+            trace(lang=code)
+            await edit_or_send(q, snap.for_lang(code).catalog["home"])
+    finally:
+        await ack
+
+
+async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    snap = chat_content(update)
+    reply = snap.catalog.get(q.data) if q.data in snap.callback_keys else None
+    METRICS.inc("dukcapil_callbacks_total", key=q.data if reply else "unknown")
+    trace(key=q.data if reply else "unknown")
+    # jawab query segera (spinner di klien berhenti), paralel dengan edit
+    ack = asyncio.create_task(_ack(q, None if reply else "Menu tidak dikenali."))
+    msg = q.message
+    try:
+        if reply is None or msg is None:
+            return
+        if SHOWN.get(msg.chat_id, msg.message_id) is reply:
+            METRICS.inc("dukcapil_callback_edits_total", result="skipped")
+            return
+        # bagian pertama menggantikan pesan bertombol, sisanya dikirim sebagai
+        # pesan baru; keyboard selalu di bagian terakhir
+        first, rest = reply.parts[0], reply.parts[1:]
+        try:
+            await q.edit_message_text(
+                first,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=None if rest else reply.markup,
+                disable_web_page_preview=True,
+            )
+            METRICS.inc("dukcapil_callback_edits_total", result="edited")
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                METRICS.inc("dukcapil_callback_edits_total", result="not_modified")
+            else:
+                # pesan terlalu lama / terhapus / tidak bisa diedit: kirim utuh
+                # sebagai pesan baru
+                log.info("Edit gagal (%s), kirim pesan baru", e)
+                METRICS.inc("dukcapil_callback_edits_total", result="resent")
+                first, rest = None, ()
+                await send_reply(msg, reply)
+        except NetworkError as e:
+            # timeout/putus: edit mungkin sudah diterapkan, jangan kirim ulang
+            log.warning("Edit tidak pasti (%s), tidak dikirim ulang", e)
+            METRICS.inc("dukcapil_callback_edits_total", result="uncertain")
+            return
+        if rest:
+            await send_reply(msg, Reply(rest, reply.markup))
+        elif first is not None:
+            SHOWN.put(msg.chat_id, msg.message_id, reply)
+        if reply.markup is not None and update.effective_chat:
+            STATE.set(update.effective_chat.id, last_menu=q.data)
+    except Exception as e:
+        log.exception("Callback error: %s", e)
+        trace(outcome="error")
+        await msg.reply_text("⚠️ Terjadi gangguan. Coba lagi ya.")
+    finally:
+        await ack
+
+
+async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text or ""
+    # catat jika ada link/mention (biar siap kalau nanti dipakai)
+    _ = [e for e in (update.message.entities or []) if e.type in (MessageEntity.URL, MessageEntity.MENTION)]
+    try:
+        t0 = time.perf_counter()
+        chat = update.effective_chat
+        state = STATE.chats.get(chat.id)
+        lang = state.lang if state else None
+        if lang is None:  # bahasa dari teks disimpan per chat; bahasa aplikasi hanya cadangan
+            lang = detect_lang(text)
+            if lang is not None:
+                STATE.set(chat.id, lang=lang)
+                METRICS.inc("dukcapil_lang_total", lang=lang, source="deteksi")
+            else:
+                lang = app_lang(update)
+        intent, reply = lookup(text, lang)
+        if intent is None:
+            MISSED.record(text, lang)
+        METRICS.observe("dukcapil_match_seconds", time.perf_counter() - t0)
+        METRICS.inc("dukcapil_intents_total", intent=intent or "fallback")
+        trace(intent=intent or "fallback", lang=lang or BASE_LANG)
+        await send_reply(update.message, reply)
+    except Exception as e:
+        log.exception("Message error: %s", e)
+        trace(outcome="error")
+        await update.message.reply_text(
+            "⚠️ Terjadi gangguan. Silakan coba lagi.", parse_mode=ParseMode.MARKDOWN
+        )
+
+
+# =========================================================
+# RATE LIMIT KIRIM (OUTBOUND)
+# =========================================================
+class TokenBucket:
+    """Token bucket model reservasi: token boleh minus (= antrean), sehingga
+    tiap pemanggil langsung tahu berapa lama harus menunggu gilirannya."""
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Ambil satu token; kembalikan jeda (detik) sebelum boleh kirim."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.stamp) * self.rate >= self.capacity
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """Penjadwal semua request ke Bot API yang punya chat_id.
+
+    - batas global lewat TokenBucket untuk semua request ber-chat_id
+    - batas per chat (grup memakai batas per menit) hanya untuk pesan baru,
+      bukan edit, dan hanya bila `per_chat`: jedanya ditunggu di dalam
+      handler, jadi saat update diproses satu per satu jeda satu chat akan
+      menahan balasan ke semua chat lain. Mode berurutan mengandalkan 429.
+    - kiriman ke satu chat berurutan (FIFO), jadi bagian-bagian chunk_message
+      tetap tiba sesuai urutan
+    - saat 429 RetryAfter semua kiriman ditahan selama retry_after lalu diulang
+    - metrik antrean tersedia lewat stats()
+    """
+
+    MAX_BUCKETS = 10_000  # di atas ini bucket chat yang sudah penuh dibuang
+    NOT_NEW_MESSAGE = frozenset({"sendChatAction"})  # awalan "send" tapi bukan pesan
+
+    def __init__(self, per_chat: bool = True) -> None:
+        self.per_chat = per_chat
+        self.global_bucket = TokenBucket(RATE_GLOBAL_PER_SEC, RATE_GLOBAL_PER_SEC)
+        self._buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._locks: Dict[Union[int, str], asyncio.Lock] = {}
+        self._pending: Dict[Union[int, str], int] = {}
+        self._paused_until = 0.0
+        # metrik
+        self.queued = 0
+        self.max_queued = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "chats_waiting": len(self._pending),
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+    def _bucket(self, chat_id: Union[int, str], now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.idle(now)}
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(RATE_GROUP_PER_MIN / 60, RATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(RATE_CHAT_PER_SEC, RATE_CHAT_BURST)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _new_message(self, endpoint: str) -> bool:
+        """Request yang membuat pesan baru di chat (kena batas per chat)."""
+        return (
+            endpoint.startswith("send") or endpoint in ("copyMessage", "forwardMessage")
+        ) and endpoint not in self.NOT_NEW_MESSAGE
+
+    async def _wait_turn(self, chat_id: Union[int, str], endpoint: str) -> None:
+        now = time.monotonic()
+        if self._paused_until > now:
+            await asyncio.sleep(self._paused_until - now)
+            now = time.monotonic()
+        if self.per_chat and self._new_message(endpoint):
+            delay = self._bucket(chat_id, now).reserve(now)
+            if delay:
+                await asyncio.sleep(delay)
+                now = time.monotonic()
+        delay = self.global_bucket.reserve(now)
+        if delay:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _call(callback: Callable[..., Awaitable[Any]], args: Any, kwargs: Dict[str, Any], endpoint: str) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            if endpoint != "getUpdates":  # long-poll, bukan latensi kirim
+                METRICS.observe("dukcapil_telegram_api_seconds", time.perf_counter() - t0, endpoint=endpoint)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Awaitable[Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Any],
+    ) -> Any:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery, dll. tidak perlu ditahan
+            return await self._call(callback, args, kwargs, endpoint)
+
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            async with lock:
+                attempt = 0
+                while True:
+                    t0 = time.perf_counter()
+                    await self._wait_turn(chat_id, endpoint)
+                    METRICS.observe("dukcapil_outbound_wait_seconds", time.perf_counter() - t0)
+                    try:
+                        result = await self._call(callback, args, kwargs, endpoint)
+                    except RetryAfter as exc:
+                        if attempt >= RATE_MAX_RETRIES:
+                            self.failed += 1
+                            raise
+                        attempt += 1
+                        self.retries += 1
+                        delay = float(exc.retry_after)
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                        log.warning("Flood control di %s: tunda %.0f dtk (ulang ke-%d)", endpoint, delay, attempt)
+                        continue
+                    self.sent += 1
+                    return result
+        finally:
+            self.queued -= 1
+            left = self._pending[chat_id] - 1
+            if left:
+                self._pending[chat_id] = left
+            else:
+                del self._pending[chat_id]
+                del self._locks[chat_id]
+
+
+# =========================================================
+# STATE PER CHAT & OFFSET UPDATE (SQLITE WAL)
+# =========================================================
+class ChatState:
+    """State ringkas satu chat (disimpan apa adanya ke tabel chat_state).
+
+    subscribed: None = belum pernah memilih, 1 = menerima pengumuman,
+    0 = berhenti (atau bot diblokir).
+    """
+
+    __slots__ = ("last_menu", "lang", "subscribed")
+    FIELDS = ("last_menu", "lang", "subscribed")
+    COLUMNS = {"last_menu": "TEXT", "lang": "TEXT", "subscribed": "INTEGER"}
+
+    def __init__(
+        self, last_menu: Optional[str] = None, lang: Optional[str] = None, subscribed: Optional[int] = None
+    ) -> None:
+        self.last_menu = last_menu
+        self.lang = lang
+        self.subscribed = subscribed
+
+
+class StateStore:
+    """State per chat + offset update_id, persisten di SQLite mode WAL.
+
+    Semua pembacaan dari memori. Perubahan hanya menandai chat sebagai
+    'kotor'; flush berkala menulisnya dalam satu transaksi di thread lain,
+    jadi I/O disk tidak pernah ada di jalur balasan. Path kosong = memori saja.
+
+    Duplikat dikenali dari update_id persis (DEDUP_WINDOW id terakhir), bukan
+    dari id terbesar: update beberapa chat selesai tidak berurutan, dan webhook
+    bisa mengantar update lebih baru lebih dulu. Offset yang disimpan hanya
+    maju melewati id yang sudah selesai diproses, sehingga setelah restart
+    update yang dikirim ulang Telegram tapi belum sempat diproses tetap jalan.
+
+    Dengan WORKERS > 1 semua worker memakai satu DB yang sama (chat_id kunci
+    utama, tiap chat hanya ditulis worker pemiliknya). Worker `shard` memuat
+    chat miliknya saja (chat_id % shards) dan menyimpan meta (offset,
+    checkpoint broadcast, ringkasan) dengan akhiran ".w<shard>". Satu-satunya
+    tulisan ke chat worker lain: berhenti berlangganan dari pengumuman.
+    """
+
+    _SHARD_KEY = re.compile(r"\.w\d+$")
+
+    def __init__(self, path: str, shard: int = 0, shards: int = 1) -> None:
+        self.path = path
+        self.shard = shard
+        self.shards = max(shards, 1)
+        self._suffix = f".w{shard}" if self.shards > 1 else ""
+        self.chats: Dict[int, ChatState] = {}
+        self.offset = 0  # semua update_id <= offset sudah selesai diproses
+        self.meta: Dict[str, str] = {}  # catatan lain, mis. checkpoint broadcast
+        self._dirty: set = set()
+        self._meta_dirty: set = set()
+        self._unsubscribed: set = set()  # chat worker lain yang memblokir bot (lihat unsubscribe)
+        self._offset_saved = 0
+        self._floor = 0  # update_id <= floor dianggap sudah pernah diterima
+        self._recent: "OrderedDict[int, None]" = OrderedDict()  # id di atas floor yang sudah diterima
+        self._inflight: List[int] = []  # heap id yang sedang/menunggu diproses
+        self._finished: set = set()  # id selesai yang masih tertahan id lebih kecil di heap
+        self._done_max = 0
+        self._db: Optional["sqlite3.Connection"] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    # --- siklus hidup ---
+    def open(self) -> None:
+        if not self.path:
+            return
+        import sqlite3
+
+        db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        if self.shards == 1:  # proses tunggal; mode multi-proses disiapkan supervisor sebelum fork
+            prepare_state(db, self.path)
+        else:
+            _state_schema(db)
+        cols = ", ".join(ChatState.FIELDS)
+        for chat_id, *values in db.execute(f"SELECT chat_id, {cols} FROM chat_state"):
+            if chat_id % self.shards == self.shard:
+                self.chats[chat_id] = ChatState(*values)
+        meta: Dict[str, str] = {}
+        for key, value in db.execute("SELECT key, value FROM meta"):
+            if not self._suffix:
+                if not self._SHARD_KEY.search(key):
+                    meta[key] = value
+            elif key.endswith(self._suffix):
+                meta[key[: -len(self._suffix)]] = value
+        offset = meta.pop("update_offset", None)
+        if offset is None:  # worker baru: mulai dari offset bersama hasil prepare_state
+            row = db.execute("SELECT value FROM meta WHERE key = 'update_offset'").fetchone()
+            offset = row[0] if row else "0"
+            if self._suffix:  # langsung dicatat agar prepare_state berikutnya melihat semua worker
+                with db:
+                    db.execute(
+                        "INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", ("update_offset" + self._suffix, offset)
+                    )
+        self.meta = meta
+        self.offset = self._offset_saved = self._floor = self._done_max = int(offset) if offset else 0
+        self._db = db
+        log.info("State dimuat: %d chat, update_id terakhir %d", len(self.chats), self.offset)
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.open)
+        if self._db is not None and STATE_FLUSH_SEC > 0:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # --- akses ---
+    def chat(self, chat_id: int) -> ChatState:
+        state = self.chats.get(chat_id)
+        if state is None:
+            state = self.chats[chat_id] = ChatState()
+        return state
+
+    def set(self, chat_id: int, **fields: Union[str, int, None]) -> None:
+        state = self.chat(chat_id)
+        changed = False
+        for name, value in fields.items():
+            if getattr(state, name) != value:
+                setattr(state, name, value)
+                changed = True
+        if changed:
+            self._dirty.add(chat_id)
+
+    def set_meta(self, key: str, value: str) -> None:
+        if self.meta.get(key) != value:
+            self.meta[key] = value
+            self._meta_dirty.add(key)
+
+    def subscribers(self, after: Optional[int] = None) -> List[int]:
+        """Chat id pelanggan pengumuman, urut naik, lebih besar dari `after`.
+
+        Grup & supergrup ber-id negatif, jadi None (bukan 0) = dari awal.
+        """
+        return sorted(
+            cid for cid, st in self.chats.items() if st.subscribed and (after is None or cid > after)
+        )
+
+    def _foreign(self, chat_id: int) -> bool:
+        return self.shards > 1 and chat_id % self.shards != self.shard
+
+    async def all_subscribers(self, after: Optional[int] = None) -> List[int]:
+        """subscribers() ditambah pelanggan milik worker lain (dari DB bersama;
+        perubahan yang belum di-flush worker lain belum terlihat)."""
+        if self.shards == 1 or self._db is None:
+            return self.subscribers(after)
+        async with self._flush_lock:  # koneksi yang sama dipakai flush di thread lain
+            rows = await asyncio.to_thread(
+                lambda: self._db.execute("SELECT chat_id FROM chat_state WHERE subscribed = 1").fetchall()
+            )
+        chats = set(self.subscribers(after))
+        chats.update(cid for (cid,) in rows if self._foreign(cid) and (after is None or cid > after))
+        return sorted(chats)
+
+    def is_subscribed(self, chat_id: int) -> bool:
+        """Masih berlangganan? Chat worker lain tidak dimuat: ikut daftar dari DB."""
+        if self._foreign(chat_id):
+            return chat_id not in self._unsubscribed
+        state = self.chats.get(chat_id)
+        return state is not None and bool(state.subscribed)
+
+    def unsubscribe(self, chat_id: int) -> None:
+        if self._foreign(chat_id):
+            # hanya kolom subscribed; baris penuh milik worker pemiliknya
+            self._unsubscribed.add(chat_id)
+        else:
+            self.set(chat_id, subscribed=0)
+
+    def accept(self, update_id: int) -> bool:
+        """False bila update ini sudah pernah diterima (mis. dikirim ulang
+        setelah restart). Update yang diterima wajib ditutup dengan done()."""
+        if update_id <= self._floor or update_id in self._recent:
+            return False
+        self._recent[update_id] = None
+        if len(self._recent) > DEDUP_WINDOW:
+            old, _ = self._recent.popitem(last=False)
+            self._floor = max(self._floor, old)
+        heapq.heappush(self._inflight, update_id)
+        return True
+
+    def done(self, update_id: int) -> None:
+        """Update selesai diproses: majukan offset sejauh semua id di bawahnya selesai."""
+        self._finished.add(update_id)
+        self._done_max = max(self._done_max, update_id)
+        heap = self._inflight
+        while heap and heap[0] in self._finished:
+            self._finished.discard(heapq.heappop(heap))
+        self.offset = max(self.offset, min(heap[0] - 1, self._done_max) if heap else self._done_max)
+
+    def forget_updates(self) -> None:
+        """Lupakan semua update_id yang pernah diterima (benchmark memutar ulang korpus)."""
+        self._recent.clear()
+        self._finished.clear()
+        self._inflight.clear()
+        self.offset = self._floor = self._done_max = 0
+
+    # --- tulis batch ---
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(STATE_FLUSH_SEC)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Gagal menulis state")
+
+    async def flush(self) -> None:
+        if self._db is None or (
+            not self._dirty and not self._meta_dirty and not self._unsubscribed and self.offset == self._offset_saved
+        ):
+            return
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            meta_dirty, self._meta_dirty = self._meta_dirty, set()
+            unsubscribed, self._unsubscribed = self._unsubscribed, set()
+            rows = [(cid, *(getattr(self.chats[cid], f) for f in ChatState.FIELDS)) for cid in dirty]
+            meta = [(key + self._suffix, self.meta[key]) for key in meta_dirty]
+            meta.append(("update_offset" + self._suffix, str(self.offset)))
+            offset = self.offset
+            try:
+                await asyncio.to_thread(self._write, rows, meta, unsubscribed)
+            except Exception:
+                self._dirty |= dirty  # coba lagi di flush berikutnya
+                self._meta_dirty |= meta_dirty
+                self._unsubscribed |= unsubscribed
+                raise
+            self._offset_saved = offset
+
+    _UPSERT = (
+        f"INSERT INTO chat_state (chat_id, {', '.join(ChatState.FIELDS)}) "
+        f"VALUES ({', '.join('?' * (len(ChatState.FIELDS) + 1))}) ON CONFLICT(chat_id) DO UPDATE SET "
+        + ", ".join(f"{f} = excluded.{f}" for f in ChatState.FIELDS)
+    )
+
+    def _write(self, rows: List[tuple], meta: List[Tuple[str, str]], unsubscribed: Iterable[int] = ()) -> None:
+        with self._db:
+            self._db.executemany(self._UPSERT, rows)
+            self._db.executemany("UPDATE chat_state SET subscribed = 0 WHERE chat_id = ?", [(c,) for c in unsubscribed])
+            self._db.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                meta,
+            )
+
+
+def _state_schema(db: "sqlite3.Connection") -> None:
+    db.execute("CREATE TABLE IF NOT EXISTS chat_state (chat_id INTEGER PRIMARY KEY)")
+    have = {row[1] for row in db.execute("PRAGMA table_info(chat_state)")}
+    for name in ChatState.FIELDS:  # kolom baru ditambahkan ke DB lama
+        if name not in have:
+            db.execute(f"ALTER TABLE chat_state ADD COLUMN {name} {ChatState.COLUMNS[name]}")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.commit()
+
+
+def prepare_state(db: "sqlite3.Connection", path: str) -> None:
+    """Sekali sebelum bot/worker memuat state: WAL, skema, shard lama, offset.
+
+    Versi lama memecah state per worker ke "<STATE_DB>.w<i>". Isinya dipindah
+    ke DB bersama (baris shard menang, meta diberi akhiran ".w<i>") lalu
+    berkasnya diganti nama "*.migrated". Offset per worker disatukan ke nilai
+    terkecil: mengubah WORKERS memindah chat ke worker lain, dan update yang
+    belum selesai diproses tidak boleh terlanjur dianggap duplikat. Tiap
+    worker mencatat offset-nya sejak start, jadi tidak ada yang terlewat.
+    """
+    import glob
+
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    _state_schema(db)
+    for shard in sorted(glob.glob(glob.escape(path) + ".w*")):
+        m = re.search(r"\.w(\d+)$", shard)
+        if not m:
+            continue
+        db.execute("ATTACH DATABASE ? AS shard", (shard,))
+        try:
+            have = {row[1] for row in db.execute("PRAGMA shard.table_info(chat_state)")}
+            cols = [f for f in ChatState.FIELDS if f in have]  # shard lama bisa belum punya kolom baru
+            with db:
+                if cols:
+                    names = ", ".join(cols)
+                    db.execute(
+                        f"INSERT INTO chat_state (chat_id, {names}) SELECT chat_id, {names} "
+                        "FROM shard.chat_state WHERE true ON CONFLICT(chat_id) DO UPDATE SET "
+                        + ", ".join(f"{f} = excluded.{f}" for f in cols)
+                    )
+                if db.execute("SELECT 1 FROM shard.sqlite_master WHERE name = 'meta'").fetchone():
+                    db.execute(
+                        "INSERT OR IGNORE INTO meta (key, value) SELECT key || ?, value FROM shard.meta",
+                        (f".w{m.group(1)}",),
+                    )
+        finally:
+            db.execute("DETACH DATABASE shard")
+        for ext in ("", "-wal", "-shm"):
+            if os.path.exists(shard + ext):
+                os.replace(shard + ext, shard + ext + ".migrated")
+        log.info("State shard lama %s digabung ke %s", shard, path)
+    # offset worker selalu >= offset bersama tempat ia mulai, jadi cukup yang terkecil di antara worker
+    rows = db.execute("SELECT value FROM meta WHERE key LIKE 'update_offset.w%'").fetchall()
+    if rows:
+        with db:
+            db.execute("DELETE FROM meta WHERE key LIKE 'update_offset.w%'")
+            db.execute(
+                "INSERT INTO meta (key, value) VALUES ('update_offset', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(min(int(v) for (v,) in rows)),),
+            )
+
+
+def prepare_state_db(path: str) -> None:
+    """prepare_state untuk supervisor: dijalankan sebelum worker mana pun dibuat."""
+    import sqlite3
+
+    db = sqlite3.connect(path, timeout=10)
+    try:
+        prepare_state(db, path)
+    finally:
+        db.close()
+
+
+STATE = StateStore(STATE_DB)
+STARTED_AT = time.time()
+BACKLOG_BUCKET = TokenBucket(BACKLOG_RATE, BACKLOG_RATE)
+
+
+async def state_gate(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Grup paling awal: atur laju antrean lama.
+
+    Tanpa drop_pending_updates, Telegram mengirim ulang update yang masuk saat
+    bot mati (dan batch terakhir yang belum terkonfirmasi). Duplikatnya sudah
+    dibuang DedupApplication sebelum antre di kunci chat; pesan lama diproses
+    maksimal BACKLOG_RATE per detik.
+    """
+    if not isinstance(update, Update):
+        return
+    msg = update.message
+    if msg is not None and msg.date is not None and msg.date.timestamp() < STARTED_AT:
+        delay = BACKLOG_BUCKET.reserve(time.monotonic())
+        if delay:
+            await asyncio.sleep(delay)
+
+
+# =========================================================
+# ANTI-SPAM MASUK (PER USER)
+# =========================================================
+class InboundGuard:
+    """Batas laju update per user dengan memori tetap.
+
+    Tabel slot berukuran tetap (array, bukan dict per user): user id di-hash
+    ke satu slot yang menyimpan hitungan jendela sekarang & sebelumnya.
+    Perkiraan jendela geser = sebelumnya x sisa porsi jendela + sekarang.
+    Bila dua user berbagi slot, pemilik lama tergeser (state-nya mulai dari
+    nol), jadi tidak pernah ada user yang dibisukan karena orang lain.
+    """
+
+    ALLOW, WARN, DROP = 0, 1, 2
+    _MIX = 0x9E3779B97F4A7C15  # hash perkalian (Fibonacci) agar id berurutan tersebar
+
+    def __init__(self, limit: int, window: float, mute: float, slots: int) -> None:
+        self.limit = limit
+        self.window = window
+        self.mute = mute
+        self.slots = slots
+        self._owner = array("q", [0]) * slots
+        self._epoch = array("q", [0]) * slots  # nomor jendela hitungan `_cur`
+        self._cur = array("H", [0]) * slots
+        self._prev = array("H", [0]) * slots
+        self._muted = array("d", [0.0]) * slots  # bisu sampai (monotonic)
+
+    def check(self, user_id: int, now: float) -> int:
+        i = ((user_id * self._MIX) & 0xFFFFFFFFFFFFFFFF) % self.slots
+        epoch = int(now // self.window)
+        if self._owner[i] != user_id:
+            self._owner[i] = user_id
+            self._epoch[i] = epoch
+            self._cur[i] = self._prev[i] = 0
+            self._muted[i] = 0.0
+        elif self._muted[i] > now:
+            return self.DROP
+        if self._epoch[i] != epoch:
+            self._prev[i] = self._cur[i] if self._epoch[i] == epoch - 1 else 0
+            self._cur[i] = 0
+            self._epoch[i] = epoch
+        cur = self._cur[i] = min(self._cur[i] + 1, 0xFFFF)
+        if self._prev[i] * (1 - (now % self.window) / self.window) + cur > self.limit:
+            self._muted[i] = now + self.mute
+            return self.WARN
+        return self.ALLOW
+
+
+GUARD = InboundGuard(GUARD_LIMIT, GUARD_WINDOW_SEC, GUARD_MUTE_SEC, GUARD_SLOTS)
+TAP_GUARD = InboundGuard(GUARD_TAP_LIMIT, GUARD_WINDOW_SEC, 0.0, GUARD_SLOTS)  # tanpa masa bisu
+
+
+async def inbound_guard(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Grup -9 (sesudah state_gate): hentikan update dari user yang spam.
+
+    Saat batas pertama kali terlampaui user mendapat satu peringatan; update
+    berikutnya selama masa bisu dibuang diam-diam. Tekan tombol & inline query
+    dihitung terpisah (TAP_GUARD) dan tidak pernah membisukan pesan teks.
+    """
+    if not isinstance(update, Update):
+        return
+    user = update.effective_user
+    if user is None or user.id in ADMIN_IDS:
+        return
+    if update.callback_query is not None or update.inline_query is not None:
+        if GUARD_TAP_LIMIT <= 0 or TAP_GUARD.check(user.id, time.monotonic()) == InboundGuard.ALLOW:
+            return
+        METRICS.inc("dukcapil_guard_dropped_total", kind="tap", first="0")
+        if update.callback_query is not None:
+            await _ack(update.callback_query)  # hentikan spinner di klien
+        raise ApplicationHandlerStop
+    if GUARD_LIMIT <= 0:
+        return
+    verdict = GUARD.check(user.id, time.monotonic())
+    if verdict == InboundGuard.ALLOW:
+        return
+    METRICS.inc("dukcapil_guard_dropped_total", kind="pesan", first="1" if verdict == InboundGuard.WARN else "0")
+    if verdict == InboundGuard.WARN and update.effective_message is not None:
+        try:
+            await send_reply(update.effective_message, chat_content(update).catalog["throttled"])
+        except TelegramError as e:
+            log.debug("Peringatan spam tidak terkirim: %s", e)
+    raise ApplicationHandlerStop
+
+
+# =========================================================
+# PENGUMUMAN KE SEMUA PELANGGAN (BROADCAST)
+# =========================================================
+@dataclass
+class BroadcastJob:
+    """Satu pengumuman; disimpan sebagai JSON di meta sebagai checkpoint."""
+    id: int
+    text: str
+    admin: int  # chat yang menerima laporan
+    total: int
+    started: float
+    cursor: Optional[int] = None  # chat id terakhir yang sudah diproses (urut naik); None = belum ada
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    skipped: int = 0  # berhenti berlangganan saat pengumuman berjalan
+    done: bool = False
+    finished: float = 0.0
+
+    def summary(self) -> str:
+        state = "selesai" if self.done else "berjalan"
+        minutes = ((self.finished or time.time()) - self.started) / 60
+        return (
+            f"📢 Pengumuman #{self.id} {state}: {self.sent} terkirim, {self.blocked} memblokir bot, "
+            f"{self.failed} gagal, {self.skipped} dilewati (dari {self.total}) dalam {minutes:.1f} menit."
+        )
+
+
+class Broadcaster:
+    """Kirim satu teks ke semua pelanggan, per batch, dengan checkpoint.
+
+    Penerima diproses urut chat id; setelah tiap batch kursor & statistik
+    ditulis ke StateStore, jadi setelah restart pengiriman dilanjutkan dari
+    batch terakhir (batch yang terputus bisa terkirim dua kali). Laju dijaga
+    TokenBucket sendiri di atas OutboundLimiter. Chat yang memblokir bot
+    atau sudah tidak ada otomatis berhenti berlangganan. Dengan WORKERS > 1
+    hanya worker 0 yang menerima /broadcast dan mengirim ke pelanggan semua
+    worker, jadi hanya ada satu job & satu checkpoint.
+    """
+
+    META_KEY = "broadcast"
+
+    def __init__(self, store: StateStore, rate: float, batch: int) -> None:
+        self.store = store
+        self.bucket = TokenBucket(rate, 1)
+        self.batch = max(batch, 1)
+        raw = store.meta.get(self.META_KEY)
+        self.job: Optional[BroadcastJob] = BroadcastJob(**json.loads(raw)) if raw else None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot, text: str, admin: int) -> BroadcastJob:
+        job = BroadcastJob(
+            id=self.job.id + 1 if self.job else 1,
+            text=text,
+            admin=admin,
+            total=len(await self.store.all_subscribers()),
+            started=time.time(),
+        )
+        self.job = job
+        self._checkpoint()
+        self._task = asyncio.create_task(self._run(bot, job))
+        return job
+
+    def resume(self, bot: Bot) -> None:
+        if self.job is not None and not self.job.done and not self.running:
+            log.info("Melanjutkan pengumuman #%d sesudah chat %s", self.job.id, self.job.cursor)
+            self._task = asyncio.create_task(self._run(bot, self.job))
+
+    async def stop(self) -> None:
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _checkpoint(self) -> None:
+        self.store.set_meta(self.META_KEY, json.dumps(self.job.__dict__))
+
+    async def _run(self, bot: Bot, job: BroadcastJob) -> None:
+        parts = chunk_message(job.text)
+        targets = await self.store.all_subscribers(job.cursor)
+        try:
+            for start in range(0, len(targets), self.batch):
+                batch = targets[start:start + self.batch]
+                results = await asyncio.gather(*(self._send_one(bot, cid, parts) for cid in batch))
+                for result in results:
+                    setattr(job, result, getattr(job, result) + 1)
+                    METRICS.inc("dukcapil_broadcast_total", result=result)
+                job.cursor = batch[-1]
+                self._checkpoint()
+                await self.store.flush()
+        except Exception:
+            log.exception("Pengumuman #%d terhenti sesudah chat %s", job.id, job.cursor)
+            return
+        job.done = True
+        job.finished = time.time()
+        self._checkpoint()
+        await self.store.flush()
+        log.info(job.summary())
+        try:
+            await bot.send_message(job.admin, job.summary())
+        except TelegramError as e:
+            log.warning("Laporan pengumuman tidak terkirim: %s", e)
+
+    async def _send_one(self, bot: Bot, chat_id: int, parts: List[str]) -> str:
+        """Kirim ke satu chat; hasil = nama counter di BroadcastJob."""
+        if not self.store.is_subscribed(chat_id):
+            return "skipped"
+        delay = self.bucket.reserve(time.monotonic())
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            for part in parts:
+                await bot.send_message(
+                    chat_id, part, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True
+                )
+        except Forbidden:  # diblokir / akun dihapus / dikeluarkan dari grup
+            self.store.unsubscribe(chat_id)
+            return "blocked"
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                self.store.unsubscribe(chat_id)
+                return "blocked"
+            log.warning("Pengumuman ke %s gagal: %s", chat_id, e)
+            return "failed"
+        except TelegramError as e:
+            log.warning("Pengumuman ke %s gagal: %s", chat_id, e)
+            return "failed"
+        return "sent"
+
+
+# =========================================================
+# ANALITIK: PERTANYAAN YANG TIDAK DIKENALI
+# =========================================================
+class SpaceSaving:
+    """Top-K frasa tersering dengan memori tetap (algoritme Space-Saving).
+
+    Maksimal `capacity` frasa dihitung. Frasa baru saat penuh menggantikan
+    frasa dengan hitungan terkecil dan mewarisi hitungan itu (+1); warisannya
+    dicatat di `error`, jadi hitungan sebenarnya ada di [count - error, count].
+    Frasa yang benar-benar sering pasti bertahan. Hitungan terkecil dicari
+    lewat min-heap dengan entri basi yang dilewati (amortized O(log K)).
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, List[int]] = {}  # frasa -> [count, error]
+        self.total = 0
+        self._heap: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, item: str, n: int = 1) -> None:
+        self.total += n
+        entry = self.counts.get(item)
+        if entry is None:
+            floor = self._evict() if len(self.counts) >= self.capacity else 0
+            entry = self.counts[item] = [floor, floor]
+        entry[0] += n
+        heapq.heappush(self._heap, (entry[0], item))
+        if len(self._heap) > 4 * self.capacity:  # buang entri basi agar heap tetap kecil
+            self._heap = [(e[0], k) for k, e in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self) -> int:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            entry = self.counts.get(item)
+            if entry is not None and entry[0] == count:  # hitungan hanya naik: entri lama pasti lebih kecil
+                del self.counts[item]
+                return count
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        """(frasa, count, error) urut count menurun."""
+        return heapq.nlargest(n, ((k, c, e) for k, (c, e) in self.counts.items()), key=lambda t: t[1])
+
+    def dump(self) -> str:
+        return json.dumps({"total": self.total, "items": [[k, c, e] for k, (c, e) in self.counts.items()]})
+
+    def load(self, raw: str) -> None:
+        data = json.loads(raw)
+        for item, count, error in sorted(data["items"], key=lambda t: -t[1])[: self.capacity]:
+            self.counts[item] = [count, error]
+        self.total = data["total"]
+        self._heap = [(e[0], k) for k, e in self.counts.items()]
+        heapq.heapify(self._heap)
+
+
+class MissedQueries:
+    """Kumpulkan teks bebas yang tidak mengenai intent apa pun (fallback/saran).
+
+    Yang disimpan hanya bentuk kanonik, deretan angka diganti '#' (NIK, nomor
+    HP tidak ikut tersimpan) dan dipotong MAX_LEN karakter. Bahasa selain
+    bahasa dasar diberi awalan "kode|". Ringkasan ditulis ke meta StateStore.
+    """
+
+    META_KEY = "missed"
+    MAX_LEN = 80
+    _DIGITS = re.compile(r"\d+")
+
+    def __init__(self, capacity: int) -> None:
+        self.sketch = SpaceSaving(capacity)
+        self._saved_total = 0
+
+    def record(self, text: str, lang: Optional[str]) -> None:
+        if self.sketch.capacity <= 0:
+            return
+        phrase = self._DIGITS.sub("#", canonical(text))[: self.MAX_LEN].strip()
+        if phrase:
+            self.sketch.add(phrase if not lang or lang == BASE_LANG else f"{lang}|{phrase}")
+
+    def load(self, store: StateStore) -> None:
+        raw = store.meta.get(self.META_KEY)
+        if raw:
+            try:
+                self.sketch.load(raw)
+            except (ValueError, KeyError, TypeError) as e:
+                log.warning("Analitik pertanyaan lama diabaikan: %s", e)
+        self._saved_total = self.sketch.total
+
+    def save(self, store: StateStore) -> None:
+        if self.sketch.total != self._saved_total:
+            store.set_meta(self.META_KEY, self.sketch.dump())  # ikut flush batch StateStore
+            self._saved_total = self.sketch.total
+
+    async def flush_loop(self, store: StateStore) -> None:
+        while True:
+            await asyncio.sleep(MISSED_FLUSH_SEC)
+            self.save(store)
+
+
+MISSED = MissedQueries(MISSED_TOP_K)
+METRICS.gauge("dukcapil_missed_phrases", lambda: len(MISSED.sketch), "Frasa tak dikenali yang sedang dihitung")
+
+
+def closest_topic(snap: ContentSnapshot, phrase: str) -> str:
+    """Intent terdekat untuk frasa laporan: mirip ejaan keyword, kalau tidak ada
+    yang mirip, dokumen BM25 teratas."""
+    lang, _, text = phrase.rpartition("|")
+    bundle = snap.for_lang(lang or None)
+    hit = bundle.fuzzy.closest(text, 0.3)
+    if hit:
+        return f"{hit[0]} (mirip {hit[1]:.2f})"
+    docs = bundle.retrieval.search(text, 1)
+    if docs:
+        return f"{docs[0][0]} (bm25 {docs[0][1]:.1f})"
+    return "-"
+
+
+def missed_report(items: List[Tuple[str, int, int]], total: int, snap: ContentSnapshot) -> str:
+    """Teks laporan (tanpa Markdown): frasa, jumlah, dan intent terdekat."""
+    if not items:
+        return "Belum ada pertanyaan yang tidak dikenali."
+    lines = [f"🔎 Pertanyaan tak dikenali teratas ({total} pesan tercatat)"]
+    for i, (phrase, count, error) in enumerate(items, 1):
+        approx = f" (±{error})" if error else ""
+        lines.append(f"{i}. ×{count}{approx} «{phrase}» → {closest_topic(snap, phrase)}")
+    return "\n".join(lines)
+
+
+async def cmd_missed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/terlewat [n] (admin): frasa teratas yang belum ada keyword-nya."""
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        await update.message.reply_text("Perintah ini khusus admin.")
+        return
+    args = (update.message.text or "").split()
+    n = int(args[1]) if len(args) > 1 and args[1].isdigit() else 20
+    text = missed_report(MISSED.sketch.top(min(n, 100)), MISSED.sketch.total, CONTENT)
+    if WORKERS > 1:
+        text += "\n\n(Hanya worker ini. Gabungan semua worker: python main.py --missed-report)"
+    for part in chunk_message(text):
+        await update.message.reply_text(part, disable_web_page_preview=True)
+
+
+def missed_report_cli(n: int) -> str:
+    """Gabungkan ringkasan semua worker di STATE_DB (hitungan Space-Saving bisa
+    dijumlah), termasuk shard lama "<STATE_DB>.w<i>" yang belum digabung."""
+    import glob
+    import sqlite3
+
+    merged: Dict[str, List[int]] = {}
+    total = 0
+    paths = [STATE_DB] + sorted(p for p in glob.glob(glob.escape(STATE_DB) + ".w*") if re.search(r"\.w\d+$", p))
+    key = MissedQueries.META_KEY
+    rows: List[Tuple[str]] = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows += db.execute("SELECT value FROM meta WHERE key = ? OR key LIKE ?", (key, key + ".w%")).fetchall()
+        except sqlite3.OperationalError:  # DB tanpa tabel meta
+            pass
+        finally:
+            db.close()
+    for (value,) in rows:
+        data = json.loads(value)
+        total += data["total"]
+        for phrase, count, error in data["items"]:
+            entry = merged.setdefault(phrase, [0, 0])
+            entry[0] += count
+            entry[1] += error
+    items = heapq.nlargest(n, ((k, c, e) for k, (c, e) in merged.items()), key=lambda t: t[1])
+    return missed_report(items, total, CONTENT)
+
+
+# =========================================================
+# ANTREAN LOKET (PESAN SLOT KEDATANGAN)
+# =========================================================
+_HARI = ("Sen", "Sel", "Rab", "Kam", "Jum", "Sab", "Min")
+_BULAN = ("Jan", "Feb", "Mar", "Apr", "Mei", "Jun", "Jul", "Agu", "Sep", "Okt", "Nov", "Des")
+
+
+def fmt_day(day: str, year: bool = True) -> str:
+    d = datetime.strptime(day, "%Y%m%d")
+    text = f"{_HARI[d.weekday()]}, {d.day} {_BULAN[d.month - 1]}"
+    return f"{text} {d.year}" if year else text
+
+
+def fmt_time(minutes: int) -> str:
+    return f"{minutes // 60:02d}.{minutes % 60:02d}"
+
+
+@dataclass(frozen=True)
+class Booking:
+    code: str  # kode konfirmasi yang ditunjukkan di loket
+    chat_id: int
+    service: str
+    day: str  # YYYYMMDD
+    slot: int  # menit sejak 00.00 WIB
+
+
+class SlotIndex:
+    """Hitungan antrean aktif per hari: per slot, per layanan, dan per chat.
+
+    Semua operasi berupa lookup dict tanpa await, jadi cek-lalu-tambah di
+    try_reserve atomic terhadap handler lain di event loop tanpa kunci.
+    """
+
+    def __init__(self) -> None:
+        self._slots: Dict[str, Dict[int, int]] = {}  # hari -> slot -> terisi
+        self._services: Dict[str, Dict[str, int]] = {}  # hari -> layanan -> terisi
+        self._chats: Dict[str, Dict[int, str]] = {}  # hari -> chat -> kode
+
+    def taken(self, day: str, slot: int) -> int:
+        return self._slots.get(day, {}).get(slot, 0)
+
+    def service_taken(self, day: str, service: str) -> int:
+        return self._services.get(day, {}).get(service, 0)
+
+    def codes(self, chat_id: int) -> List[str]:
+        return [chats[chat_id] for _, chats in sorted(self._chats.items()) if chat_id in chats]
+
+    def add(self, b: Booking) -> None:
+        slots = self._slots.setdefault(b.day, {})
+        slots[b.slot] = slots.get(b.slot, 0) + 1
+        services = self._services.setdefault(b.day, {})
+        services[b.service] = services.get(b.service, 0) + 1
+        self._chats.setdefault(b.day, {})[b.chat_id] = b.code
+
+    def try_reserve(self, cfg: BookingConfig, b: Booking) -> str:
+        """"" bila berhasil, selain itu alasan: dobel / penuh / kuota."""
+        if b.chat_id in self._chats.get(b.day, ()):
+            return "dobel"
+        if self.taken(b.day, b.slot) >= cfg.capacity:
+            return "penuh"
+        if cfg.service_daily_cap and self.service_taken(b.day, b.service) >= cfg.service_daily_cap:
+            return "kuota"
+        self.add(b)
+        return ""
+
+    def release(self, b: Booking) -> None:
+        self._slots[b.day][b.slot] -= 1
+        self._services[b.day][b.service] -= 1
+        self._chats[b.day].pop(b.chat_id, None)
+
+    def prune(self, today: str) -> None:
+        for table in (self._slots, self._services, self._chats):
+            for day in [d for d in table if d < today]:
+                del table[day]
+
+
+class BookingStore:
+    """Antrean loket: SlotIndex di memori, SQLite sebagai sumber kebenaran.
+
+    Cek & reservasi di memori dulu (mikrodetik, tanpa I/O), lalu satu
+    transaksi BEGIN IMMEDIATE di thread lain mengulang cek yang sama di DB.
+    Dengan WORKERS > 1 indeks tiap proses hanya melihat pesanannya sendiri
+    sejak start, jadi sisa kuota yang ditampilkan bisa sedikit lebih besar,
+    tetapi kuota di DB tidak pernah terlampaui. Kode baru diberikan ke warga
+    setelah tersimpan. Path kosong = memori saja.
+    """
+
+    CODE_CHARS = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # tanpa 0/O & 1/I agar mudah dibaca petugas
+    CODE_LEN = 6
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index = SlotIndex()
+        self.by_code: Dict[str, Booking] = {}
+        self._today = ""
+        self._db: Optional["sqlite3.Connection"] = None
+        self._lock = asyncio.Lock()  # satu koneksi: satu thread penulis pada satu waktu
+
+    # --- siklus hidup ---
+    def open(self) -> None:
+        if not self.path:
+            return
+        import sqlite3
+
+        # isolation_level=None: transaksi diatur sendiri (BEGIN IMMEDIATE)
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS booking (code TEXT PRIMARY KEY, chat_id INTEGER NOT NULL,"
+            " service TEXT NOT NULL, day TEXT NOT NULL, slot INTEGER NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'aktif', created REAL NOT NULL)"
+        )
+        # satu antrean aktif per chat per hari; hitung slot lewat indeks
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS booking_chat ON booking (chat_id, day) WHERE status = 'aktif'")
+        db.execute("CREATE INDEX IF NOT EXISTS booking_slot ON booking (day, slot) WHERE status = 'aktif'")
+        self._today = datetime.now(WIB).strftime("%Y%m%d")
+        rows = db.execute(
+            "SELECT code, chat_id, service, day, slot FROM booking WHERE status = 'aktif' AND day >= ?",
+            (self._today,),
+        )
+        for row in rows:
+            b = Booking(*row)
+            self.by_code[b.code] = b
+            self.index.add(b)
+        self._db = db
+        log.info("Antrean loket dimuat: %d aktif", len(self.by_code))
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.open)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            async with self._lock:
+                self._db.close()
+                self._db = None
+
+    # --- akses ---
+    def prune(self, today: str) -> None:
+        """Buang antrean hari yang sudah lewat dari memori (sekali per hari)."""
+        if today == self._today:
+            return
+        self._today = today
+        self.index.prune(today)
+        self.by_code = {c: b for c, b in self.by_code.items() if b.day >= today}
+
+    def mine(self, chat_id: int) -> List[Booking]:
+        return [self.by_code[c] for c in self.index.codes(chat_id)]
+
+    def _new_code(self) -> str:
+        while True:
+            code = "".join(secrets.choice(self.CODE_CHARS) for _ in range(self.CODE_LEN))
+            if code not in self.by_code:
+                return code
+
+    async def reserve(self, cfg: BookingConfig, chat_id: int, service: str, day: str, slot: int) -> Tuple[Optional[Booking], str]:
+        """(Booking, "") bila tersimpan, (None, alasan) bila ditolak."""
+        b = Booking(self._new_code(), chat_id, service, day, slot)
+        reason = self.index.try_reserve(cfg, b)
+        if reason:
+            return None, reason
+        self.by_code[b.code] = b
+        if self._db is not None:
+            try:
+                async with self._lock:
+                    reason = await asyncio.to_thread(self._insert, b, cfg)
+            except BaseException:
+                self._forget(b)
+                raise
+            if reason:  # diambil proses lain lebih dulu
+                self._forget(b)
+                return None, reason
+        return b, ""
+
+    async def cancel(self, chat_id: int, code: str) -> Optional[Booking]:
+        b = self.by_code.get(code)
+        if b is None or b.chat_id != chat_id:
+            return None
+        self._forget(b)  # langsung dari memori: klik ganda tidak melepas slot dua kali
+        if self._db is not None:
+            try:
+                async with self._lock:
+                    await asyncio.to_thread(self._set_status, code, "batal")
+            except BaseException:
+                self.by_code[code] = b
+                self.index.add(b)
+                raise
+        return b
+
+    def _forget(self, b: Booking) -> None:
+        if self.by_code.pop(b.code, None) is not None:
+            self.index.release(b)
+
+    # --- tulis (di thread) ---
+    def _insert(self, b: Booking, cfg: BookingConfig) -> str:
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")  # kunci tulis dulu: cek & insert tidak diselip proses lain
+        try:
+            count = "SELECT COUNT(*) FROM booking WHERE status = 'aktif' AND day = ? AND "
+            if db.execute(count + "chat_id = ?", (b.day, b.chat_id)).fetchone()[0]:
+                reason = "dobel"
+            elif db.execute(count + "slot = ?", (b.day, b.slot)).fetchone()[0] >= cfg.capacity:
+                reason = "penuh"
+            elif (
+                cfg.service_daily_cap
+                and db.execute(count + "service = ?", (b.day, b.service)).fetchone()[0] >= cfg.service_daily_cap
+            ):
+                reason = "kuota"
+            else:
+                db.execute(
+                    "INSERT INTO booking (code, chat_id, service, day, slot, created) VALUES (?, ?, ?, ?, ?, ?)",
+                    (b.code, b.chat_id, b.service, b.day, b.slot, time.time()),
+                )
+                reason = ""
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return reason
+
+    def _set_status(self, code: str, status: str) -> None:
+        self._db.execute("UPDATE booking SET status = ? WHERE code = ?", (status, code))
+
+
+BOOKINGS = BookingStore(BOOKING_DB)
+METRICS.gauge("dukcapil_bookings_active", lambda: len(BOOKINGS.by_code), "Antrean loket aktif (hari ini & ke depan)")
+
+_BOOKING_REJECT = {
+    "dobel": "Anda sudah punya antrean di tanggal itu. Ketik /antrean untuk melihat atau membatalkannya.",
+    "penuh": "Maaf, jam itu baru saja penuh. Silakan pilih jam lain.",
+    "kuota": "Maaf, kuota layanan ini di tanggal itu sudah habis. Silakan pilih tanggal lain.",
+}
+
+
+def open_slots(cfg: BookingConfig, day: date, now: datetime) -> Tuple[int, ...]:
+    """Menit mulai slot yang masih bisa dipesan pada `day` (belum lewat & bukan libur)."""
+    if day.strftime("%Y%m%d") in cfg.closed:
+        return ()
+    slots = cfg.slots[day.weekday()]
+    if day == now.date():
+        earliest = now.hour * 60 + now.minute + cfg.lead_minutes
+        slots = tuple(s for s in slots if s >= earliest)
+    return slots
+
+
+def free_seats(cfg: BookingConfig, service: str, day: str, slots: Tuple[int, ...]) -> int:
+    free = sum(max(cfg.capacity - BOOKINGS.index.taken(day, s), 0) for s in slots)
+    if cfg.service_daily_cap:
+        free = min(free, max(cfg.service_daily_cap - BOOKINGS.index.service_taken(day, service), 0))
+    return free
+
+
+def _nav(*rows: List[InlineKeyboardButton]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([*rows, [InlineKeyboardButton("🏠 Menu Utama", callback_data="home")]])
+
+
+def booking_lines(snap: ContentSnapshot, b: Booking) -> str:
+    end = b.slot + snap.booking.slot_minutes
+    return (
+        f"Kode: `{b.code}`\nLayanan: {snap.articles[b.service].title}\n"
+        f"Tanggal: {fmt_day(b.day)}\nJam datang: {fmt_time(b.slot)}–{fmt_time(end)} WIB"
+    )
+
+
+async def booking_screen(snap: ContentSnapshot, chat_id: int, parts: List[str]) -> Optional[Reply]:
+    """Reply untuk callback "bk:...": layanan -> tanggal -> jam -> kode; None = data tidak sah."""
+    cfg = snap.booking
+    now = datetime.now(WIB)
+    BOOKINGS.prune(now.strftime("%Y%m%d"))
+    step, args = (parts[1], parts[2:]) if len(parts) > 1 else ("", [])
+    if not step:
+        return cfg.menu
+    if step == "x" and len(args) == 1:
+        b = await BOOKINGS.cancel(chat_id, args[0])
+        METRICS.inc("dukcapil_booking_total", result="batal" if b else "batal_gagal")
+        text = (
+            f"🗑️ Antrean `{b.code}` ({fmt_day(b.day)} {fmt_time(b.slot)}) dibatalkan."
+            if b
+            else "Antrean itu sudah tidak aktif."
+        )
+        return make_reply(text, _nav([InlineKeyboardButton("📅 Ambil Antrean Lagi", callback_data="bk")]))
+    if not args or args[0] not in cfg.services:
+        return None
+    service, title = args[0], snap.articles[args[0]].title
+    days = {}
+    for i in range(cfg.days_ahead + 1):
+        d = now.date() + timedelta(days=i)
+        slots = open_slots(cfg, d, now)
+        if slots:
+            days[d.strftime("%Y%m%d")] = slots
+    back_to_services = [InlineKeyboardButton("⬅️ Pilih Layanan", callback_data="bk")]
+
+    if step == "s" and len(args) == 1:
+        buttons = []
+        for day, slots in days.items():
+            free = free_seats(cfg, service, day, slots)
+            if free:
+                buttons.append(InlineKeyboardButton(f"{fmt_day(day, year=False)} · sisa {free}", callback_data=f"bk:d:{service}:{day}"))
+        if not buttons:
+            return make_reply(f"📅 *{title}*\n\nMaaf, semua jadwal sudah penuh. Coba lagi besok.", _nav(back_to_services))
+        rows = [buttons[i : i + 2] for i in range(0, len(buttons), 2)]
+        return make_reply(f"📅 *{title}*\n\nPilih tanggal datang:", _nav(*rows, back_to_services))
+
+    if len(args) < 2 or args[1] not in days:
+        return make_reply("Tanggal itu sudah tidak bisa dipesan. Silakan pilih lagi.", _nav(back_to_services))
+    day = args[1]
+    back_to_days = [InlineKeyboardButton("⬅️ Pilih Tanggal", callback_data=f"bk:s:{service}")]
+
+    if step == "d" and len(args) == 2:
+        buttons = [
+            InlineKeyboardButton(f"{fmt_time(s)} ({cfg.capacity - n})", callback_data=f"bk:t:{service}:{day}:{s // 60:02d}{s % 60:02d}")
+            for s in days[day]
+            if (n := BOOKINGS.index.taken(day, s)) < cfg.capacity
+        ]
+        if not buttons or not free_seats(cfg, service, day, days[day]):
+            return make_reply(f"📅 *{title}*\n{fmt_day(day)}\n\nMaaf, sudah penuh.", _nav(back_to_days))
+        rows = [buttons[i : i + 3] for i in range(0, len(buttons), 3)]
+        return make_reply(f"📅 *{title}*\n{fmt_day(day)}\n\nPilih jam datang (sisa kursi):", _nav(*rows, back_to_days))
+
+    if step == "t" and len(args) == 3 and re.fullmatch(r"\d{4}", args[2]):
+        slot = int(args[2][:2]) * 60 + int(args[2][2:])
+        if slot not in days[day]:
+            return make_reply("Jam itu sudah tidak tersedia. Silakan pilih jam lain.", _nav(back_to_days))
+        t0 = time.perf_counter()
+        b, reason = await BOOKINGS.reserve(cfg, chat_id, service, day, slot)
+        METRICS.observe("dukcapil_booking_seconds", time.perf_counter() - t0)
+        METRICS.inc("dukcapil_booking_total", result=reason or "ok")
+        if b is None:
+            return make_reply(_BOOKING_REJECT[reason], _nav(back_to_days))
+        return make_reply(
+            f"✅ *Antrean tercatat*\n\n{booking_lines(snap, b)}\n\n"
+            "Tunjukkan kode ini di loket dan bawa berkas persyaratan. Batalkan lewat /antrean bila berhalangan.",
+            _nav(),
+        )
+    return None
+
+
+async def on_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tombol "bk..." (antrean loket); pesan bertombol diedit di tempat."""
+    q = update.callback_query
+    snap = chat_content(update)
+    ack = asyncio.create_task(_ack(q, None if snap.booking else "Antrean loket belum dibuka."))
+    msg = q.message
+    try:
+        if snap.booking is None or msg is None:
+            return
+        parts = q.data.split(":")
+        trace(key=":".join(parts[:2]))
+        reply = await booking_screen(snap, msg.chat_id, parts)
+        await edit_or_send(q, reply or snap.booking.menu)
+    except Exception as e:
+        log.exception("Callback antrean error: %s", e)
+        trace(outcome="error")
+        await msg.reply_text("⚠️ Terjadi gangguan. Coba lagi ya.")
+    finally:
+        await ack
+
+
+async def cmd_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/antrean: daftar antrean aktif milik chat ini + tombol batal."""
+    snap = chat_content(update)
+    if snap.booking is None:
+        await update.message.reply_text("Antrean loket belum dibuka.")
+        return
+    BOOKINGS.prune(datetime.now(WIB).strftime("%Y%m%d"))
+    mine = BOOKINGS.mine(update.effective_chat.id)
+    new = [InlineKeyboardButton("📅 Ambil Antrean Baru", callback_data="bk")]
+    if not mine:
+        await send_reply(update.message, make_reply("Anda belum punya antrean loket.", _nav(new)))
+        return
+    lines = "\n\n".join(booking_lines(snap, b) for b in mine)
+    cancel = [[InlineKeyboardButton(f"❌ Batalkan {b.code}", callback_data=f"bk:x:{b.code}")] for b in mine]
+    await send_reply(update.message, make_reply(f"📅 *Antrean Anda*\n\n{lines}", _nav(*cancel, new)))
+
+
+# =========================================================
+# WIZARD CEK KELENGKAPAN BERKAS
+# =========================================================
+class WizardSession:
+    """Sesi wizard satu chat: semua pilihan disimpan sebagai int kecil/bitmask.
+
+    step 0 = pilih keperluan, 1..N = pertanyaan ke-N, N+1 = daftar berkas.
+    """
+
+    __slots__ = ("version", "step", "cases", "answers", "ticks", "touched")
+
+    def __init__(self, version: str, now: float) -> None:
+        self.version = version  # konten berubah = sesi tidak berlaku
+        self.step = 0
+        self.cases = 0  # bitmask indeks keperluan
+        self.answers: Tuple[int, ...] = ()  # indeks opsi per pertanyaan
+        self.ticks = 0  # bitmask indeks berkas yang sudah siap
+        self.touched = now
+
+    def docs(self, cfg: ChecklistConfig) -> int:
+        """Gabungan berkas semua keperluan & jawaban (OR bitmask = tanpa duplikat)."""
+        mask = 0
+        for i, (_, docs) in enumerate(cfg.cases):
+            if self.cases >> i & 1:
+                mask |= docs
+        for (_, opts), answer in zip(cfg.questions, self.answers):
+            mask |= opts[answer][1]
+        return mask
+
+
+class WizardSessions:
+    """Sesi per chat, urut terakhir dipakai; yang idle > idle_sec atau di luar
+    max_size dibuang dari depan setiap kali ada akses (amortized O(1))."""
+
+    def __init__(self, idle_sec: float, max_size: int) -> None:
+        self.idle_sec = idle_sec
+        self.max_size = max_size
+        self._data: "OrderedDict[int, WizardSession]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evict(self, now: float) -> None:
+        data = self._data
+        while data and (len(data) > self.max_size or next(iter(data.values())).touched < now - self.idle_sec):
+            data.popitem(last=False)
+            METRICS.inc("dukcapil_wizard_total", step="kedaluwarsa")
+
+    def get(self, chat_id: int, version: str, now: float) -> Optional[WizardSession]:
+        self._evict(now)
+        session = self._data.get(chat_id)
+        if session is None or session.version != version:
+            return None
+        session.touched = now
+        self._data.move_to_end(chat_id)
+        return session
+
+    def start(self, chat_id: int, version: str, now: float) -> WizardSession:
+        session = self._data[chat_id] = WizardSession(version, now)
+        self._data.move_to_end(chat_id)
+        self._evict(now)
+        return session
+
+
+WIZARD = WizardSessions(WIZARD_IDLE_SEC, WIZARD_MAX_SESSIONS)
+METRICS.gauge("dukcapil_wizard_sessions", lambda: len(WIZARD), "Sesi wizard cek berkas yang terbuka")
+
+
+def _home_row(snap: ContentSnapshot) -> List[InlineKeyboardButton]:
+    return [snap.buttons["home"]]
+
+
+def wizard_screen(snap: ContentSnapshot, session: WizardSession) -> Reply:
+    cfg = snap.checklist
+    if session.step == 0:
+        rows = [
+            [InlineKeyboardButton(f"{'☑️' if session.cases >> i & 1 else '⬜'} {label}", callback_data=f"ck:c:{i}")]
+            for i, (label, _) in enumerate(cfg.cases)
+        ]
+        rows.append([InlineKeyboardButton("➡️ Lanjut", callback_data="ck:n")])
+        rows.append(_home_row(snap))
+        return make_reply(
+            "🗂️ *Cek Kelengkapan Berkas*\n\nPilih semua keperluan Anda (boleh lebih dari satu), lalu ketuk *Lanjut*.",
+            InlineKeyboardMarkup(rows),
+        )
+    if session.step <= len(cfg.questions):
+        qi = session.step - 1
+        text, opts = cfg.questions[qi]
+        rows = [[InlineKeyboardButton(label, callback_data=f"ck:q:{qi}:{oi}")] for oi, (label, _) in enumerate(opts)]
+        rows.append([InlineKeyboardButton("🔁 Mulai Lagi", callback_data="ck:r"), *_home_row(snap)])
+        return make_reply(f"🗂️ *Cek Kelengkapan Berkas* ({session.step}/{len(cfg.questions)})\n\n{text}", InlineKeyboardMarkup(rows))
+
+    mask = session.docs(cfg)
+    wanted = [j for j in range(len(cfg.docs)) if mask >> j & 1]
+    ready = sum(1 for j in wanted if session.ticks >> j & 1)
+    purposes = ", ".join(label for i, (label, _) in enumerate(cfg.cases) if session.cases >> i & 1)
+    rows = [
+        [InlineKeyboardButton(f"{'✅' if session.ticks >> j & 1 else '⬜'} {cfg.docs[j]}", callback_data=f"ck:d:{j}")]
+        for j in wanted
+    ]
+    rows.append([InlineKeyboardButton("🔁 Mulai Lagi", callback_data="ck:r"), *_home_row(snap)])
+    status = "🎉 Semua berkas siap. Bawa asli & fotokopinya ke loket." if ready == len(wanted) else (
+        "Ketuk berkas yang sudah Anda siapkan."
+    )
+    return make_reply(
+        f"📋 *Daftar Berkas*\nUntuk: {purposes}\n\nSiap {ready} dari {len(wanted)}. {status}",
+        InlineKeyboardMarkup(rows),
+    )
+
+
+def wizard_step(cfg: ChecklistConfig, session: WizardSession, parts: List[str]) -> Optional[str]:
+    """Terapkan satu klik ke sesi; kembalikan teks notifikasi singkat bila perlu.
+
+    Tombol lama dari langkah lain diabaikan saja (layar ditampilkan ulang).
+    """
+    action, args = parts[1], parts[2:]
+    numbers = [int(a) for a in args if a.isdigit()]
+    if len(numbers) != len(args):
+        return None
+    if action == "c" and session.step == 0 and len(numbers) == 1 and numbers[0] < len(cfg.cases):
+        session.cases ^= 1 << numbers[0]
+    elif action == "n" and session.step == 0:
+        if not session.cases:
+            return "Pilih minimal satu keperluan."
+        session.step = 1
+    elif action == "q" and len(numbers) == 2 and numbers[0] == session.step - 1 < len(cfg.questions):
+        if numbers[1] < len(cfg.questions[numbers[0]][1]):
+            session.answers += (numbers[1],)
+            session.step += 1
+    elif action == "d" and session.step > len(cfg.questions) and len(numbers) == 1:
+        if session.docs(cfg) >> numbers[0] & 1:
+            session.ticks ^= 1 << numbers[0]
+    return None
+
+
+async def on_checklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tombol "ck..." (wizard cek berkas); satu pesan diedit di setiap langkah."""
+    q = update.callback_query
+    snap = chat_content(update)
+    cfg = snap.checklist
+    msg = q.message
+    if cfg is None or msg is None:
+        await _ack(q, "Fitur cek berkas belum tersedia.")
+        return
+    parts = q.data.split(":")
+    now = time.monotonic()
+    notice = None
+    if len(parts) == 1 or parts[1] == "r":
+        session = WIZARD.start(msg.chat_id, snap.version, now)
+        METRICS.inc("dukcapil_wizard_total", step="mulai")
+    else:
+        session = WIZARD.get(msg.chat_id, snap.version, now)
+        if session is not None:
+            before = session.step
+            notice = wizard_step(cfg, session, parts)
+            if session.step != before and session.step > len(cfg.questions):
+                METRICS.inc("dukcapil_wizard_total", step="daftar")
+    trace(key=":".join(parts[:2]))
+    ack = asyncio.create_task(_ack(q, notice))
+    try:
+        if session is None:
+            restart = InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Mulai Lagi", callback_data="ck")], _home_row(snap)])
+            await edit_or_send(q, make_reply("⌛ Sesi cek berkas sudah berakhir. Silakan mulai lagi.", restart))
+        elif notice is None:
+            await edit_or_send(q, wizard_screen(snap, session))
+    except Exception as e:
+        log.exception("Callback cek berkas error: %s", e)
+        trace(outcome="error")
+        await msg.reply_text("⚠️ Terjadi gangguan. Coba lagi ya.")
+    finally:
+        await ack
+
+
+async def cmd_checklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/berkas: mulai wizard cek kelengkapan berkas."""
+    snap = chat_content(update)
+    if snap.checklist is None:
+        await update.message.reply_text("Fitur cek berkas belum tersedia.")
+        return
+    session = WIZARD.start(update.effective_chat.id, snap.version, time.monotonic())
+    METRICS.inc("dukcapil_wizard_total", step="mulai")
+    await send_reply(update.message, wizard_screen(snap, session))
+
+
+# =========================================================
+# KONKURENSI: PARALEL LINTAS CHAT, URUT PER CHAT
+# =========================================================
+class DedupApplication(Application):
+    """Application yang membuang update duplikat (update_id persis) sebelum
+    update itu sempat antre, lalu menandainya selesai di STATE."""
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            await self._dispatch(update)
+            return
+        if not STATE.accept(update.update_id):
+            METRICS.inc("dukcapil_updates_total", result="duplikat")
+            return
+        METRICS.inc("dukcapil_updates_total", result="diterima")
+        try:
+            await self._dispatch(update)
+        finally:
+            STATE.done(update.update_id)
+
+    async def _dispatch(self, update: object) -> None:
+        await super().process_update(update)
+
+
+class ChatOrderedApplication(DedupApplication):
+    """Application yang memproses update beberapa chat sekaligus.
+
+    Maksimal UPDATE_CONCURRENCY handler berjalan bersamaan; update dari chat
+    yang sama menunggu giliran (asyncio.Lock bersifat FIFO) sehingga edit menu
+    tidak saling balapan. Bila antrean satu chat melebihi CHAT_QUEUE_DEPTH,
+    update berikutnya dari chat itu dilewati.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._inflight = asyncio.BoundedSemaphore(max(UPDATE_CONCURRENCY, 1))
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_pending: Dict[int, int] = {}
+
+    async def _dispatch(self, update: object) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._inflight:
+                await super()._dispatch(update)
+            return
+
+        cid = chat.id
+        pending = self._chat_pending.get(cid, 0)
+        if pending >= CHAT_QUEUE_DEPTH:
+            log.warning("Antrean chat %s penuh (%d), update %s dilewati", cid, pending, update.update_id)
+            METRICS.inc("dukcapil_updates_total", result="antrean_penuh")
+            return
+        self._chat_pending[cid] = pending + 1
+        lock = self._chat_locks.setdefault(cid, asyncio.Lock())
+        try:
+            async with lock, self._inflight:
+                await super()._dispatch(update)
+        finally:
+            left = self._chat_pending[cid] - 1
+            if left:
+                self._chat_pending[cid] = left
+            else:
+                # tidak ada yang menunggu lagi -> bebaskan memori chat ini
+                del self._chat_pending[cid]
+                del self._chat_locks[cid]
+
+
+# =========================================================
+# SERVER HTTP (WEBHOOK & HEALTHZ)
+# =========================================================
+HttpResponse = Tuple[int, str, bytes]  # (status, content-type, body)
+HttpRoute = Callable[[Dict[str, str], bytes], Awaitable[HttpResponse]]
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+HTTP_MAX_BODY = 1 << 20  # update Telegram jauh di bawah 1 MB
+
+
+class HttpServer:
+    """Server HTTP/1.1 minimal di atas asyncio, tanpa dependensi tambahan.
+
+    Rute dicari lewat (method, path); handler menerima header (lowercase)
+    dan body, lalu mengembalikan HttpResponse. Koneksi keep-alive didukung.
+    """
+
+    def __init__(self, routes: Dict[Tuple[str, str], HttpRoute]) -> None:
+        self.routes = routes
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        log.info("HTTP server mendengarkan di %s:%s", host, port)
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers: Dict[str, str] = {}
+                while True:
+                    raw = await reader.readline()
+                    if raw in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = raw.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > HTTP_MAX_BODY:
+                    await self._send(writer, (413, "text/plain", b"too large"), keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                route = self.routes.get((method, target.split("?", 1)[0]))
+                resp = await route(headers, body) if route else (404, "text/plain", b"not found")
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._send(writer, resp, keep_alive)
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass  # request rusak / klien putus
+        except Exception:
+            log.exception("HTTP handler error")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, resp: HttpResponse, keep_alive: bool) -> None:
+        status, ctype, body = resp
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+def secret_ok(headers: Dict[str, str]) -> bool:
+    """Cocokkan header X-Telegram-Bot-Api-Secret-Token dengan WEBHOOK_SECRET."""
+    token = headers.get("x-telegram-bot-api-secret-token", "")
+    return not WEBHOOK_SECRET or hmac.compare_digest(token, WEBHOOK_SECRET)
+
+
+def webhook_routes(app: Application) -> Dict[Tuple[str, str], HttpRoute]:
+    """Rute webhook Telegram + /healthz untuk Application yang diberikan."""
+
+    async def on_update(headers: Dict[str, str], body: bytes) -> HttpResponse:
+        if not secret_ok(headers):
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = Update.de_json(json.loads(body), app.bot)
+        except Exception:
+            update = None
+        if update is None:
+            return 400, "text/plain", b"bad update"
+        # antrekan saja; Application yang memproses, Telegram langsung dapat 200
+        app.update_queue.put_nowait(update)
+        return 200, "text/plain", b"ok"
+
+    async def healthz(headers: Dict[str, str], body: bytes) -> HttpResponse:
+        if app.running:
+            return 200, "text/plain", b"ok"
+        return 503, "text/plain", b"starting"
+
+    return {
+        ("POST", WEBHOOK_PATH): on_update,
+        ("GET", "/healthz"): healthz,
+        **metrics_routes(),
+    }
+
+
+def metrics_routes() -> Dict[Tuple[str, str], HttpRoute]:
+    async def metrics(headers: Dict[str, str], body: bytes) -> HttpResponse:
+        return 200, "text/plain; version=0.0.4", METRICS.render().encode()
+
+    return {("GET", "/metrics"): metrics}
+
+
+async def run_webhook(app: Application) -> None:
+    """Jalankan bot dalam mode webhook sampai SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    # Port dibuka paling awal: update yang membangunkan bot (scale-to-zero)
+    # langsung diantrekan selagi initialize() berjalan.
+    server = HttpServer(webhook_routes(app))
+    await server.start(HTTP_HOST, HTTP_PORT)
+    STARTUP.mark("HTTP terbuka")
+    try:
+        async with app:  # initialize() ... shutdown()
+            if app.post_init:  # run_polling memanggilnya sendiri, di sini manual
+                await app.post_init(app)
+            await app.start()
+            STARTUP.mark("siap")
+            if WEBHOOK_URL:
+                ensure = asyncio.create_task(ensure_webhook(app.bot))
+            else:
+                log.warning("WEBHOOK_URL kosong: setWebhook dilewati (mode uji lokal)")
+            await stop.wait()
+            if WEBHOOK_URL:
+                ensure.cancel()
+            await server.stop()
+            await app.stop()
+    finally:
+        await server.stop()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+async def ensure_webhook(bot: Bot) -> None:
+    """setWebhook hanya bila URL berbeda (deploy baru), di luar jalur start.
+
+    Saat bangun dari scale-to-zero webhook sudah terpasang; memanggil ulang
+    dengan drop_pending_updates bisa membuang update yang membangunkan bot.
+    """
+    url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    try:
+        info = await bot.get_webhook_info()
+        if info.url == url:
+            return
+        await bot.set_webhook(
+            url,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=not STATE_DB,
+        )
+        log.info("Webhook dipasang ke %s", url)
+    except TelegramError as e:
+        log.error("Gagal memasang webhook: %s", e)
+
+
+# =========================================================
+# SUPERVISOR MULTI-PROSES (SHARDING PER CHAT)
+# =========================================================
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def chat_key(data: Mapping[str, object]) -> int:
+    """Chat id dari update mentah (dict), tanpa membangun objek Update.
+
+    Update tanpa chat (inline query, dsb.) memakai id pengirim, yang sama
+    dengan id chat pribadinya.
+    """
+    for field in _CHAT_FIELDS:
+        obj = data.get(field)
+        if isinstance(obj, dict) and "chat" in obj:
+            return obj["chat"]["id"]
+    query = data.get("callback_query")
+    if isinstance(query, dict) and isinstance(query.get("message"), dict):
+        return query["message"]["chat"]["id"]
+    for obj in data.values():
+        if isinstance(obj, dict) and isinstance(obj.get("from"), dict):
+            return obj["from"]["id"]
+    return 0
+
+
+def is_broadcast(data: Mapping[str, object]) -> bool:
+    msg = data.get("message")
+    return isinstance(msg, dict) and str(msg.get("text", "")).startswith("/broadcast")
+
+
+WORKER_INDEX: Optional[int] = None  # diisi di proses worker
+
+
+def worker_main(
+    index: int, inbox: "mp.Queue", heartbeat: "mp.sharedctypes.Synchronized", done: "mp.sharedctypes.Synchronized"
+) -> None:
+    """Proses worker: Application biasa, tapi update datang dari supervisor.
+
+    Worker di-fork oleh fork-server multiprocessing yang sudah mengimpor modul
+    ini (konten terkompilasi dibagi copy-on-write, read-only) dan tidak pernah
+    menjalankan event loop. State memakai STATE_DB bersama; worker hanya
+    memuat chat miliknya karena sebuah chat selalu jatuh ke worker yang sama.
+    `done` = offset StateStore worker ini (semua update miliknya <= done sudah
+    selesai), dibaca supervisor untuk konfirmasi getUpdates.
+    """
+    global STATE, METRICS_PORT, WORKER_INDEX
+    WORKER_INDEX = index
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # berhenti diatur supervisor
+    if STATE_DB:
+        STATE = StateStore(STATE_DB, index, WORKERS)
+    if METRICS_PORT:
+        METRICS_PORT += 1 + index
+    LOG_PIPE.after_fork()
+    try:
+        asyncio.run(_worker_loop(index, inbox, heartbeat, done))
+    finally:
+        LOG_PIPE.stop()  # proses anak keluar lewat os._exit: atexit tidak jalan
+
+
+async def _worker_loop(
+    index: int, inbox: "mp.Queue", heartbeat: "mp.sharedctypes.Synchronized", done: "mp.sharedctypes.Synchronized"
+) -> None:
+    async def beat() -> None:
+        while True:
+            heartbeat.value = time.time()
+            done.value = STATE.offset
+            await asyncio.sleep(0.1)
+
+    app = build_app()
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        beat_task = asyncio.create_task(beat())
+        log.info("Worker %d siap (pid %d)", index, os.getpid())
+        while True:
+            raw = await loop.run_in_executor(None, inbox.get)
+            if raw is None:  # sentinel dari supervisor
+                break
+            update = Update.de_json(json.loads(raw), app.bot)
+            if update is not None:
+                await app.update_queue.put(update)
+        beat_task.cancel()
+        await app.stop()
+    await app.post_shutdown(app)
+
+
+class Supervisor:
+    """Jalankan N worker, bagi update per chat, dan hidupkan ulang yang mati.
+
+    Tiap update yang dikirim ke worker disimpan sampai worker melaporkan
+    offset-nya melewati update itu. Worker yang mati bisa meninggalkan kunci
+    baca antreannya terkunci, jadi worker baru mendapat antrean baru dan
+    update yang belum selesai dikirim ulang ke sana (yang sempat selesai
+    tapi belum dilaporkan bisa diproses dua kali). acked() = update_id
+    tertinggi yang boleh dikonfirmasi ke Telegram.
+    """
+
+    def __init__(self, n: int) -> None:
+        import multiprocessing as mp
+
+        # fork-server: worker (termasuk yang dijalankan ulang monitor()) di-fork
+        # dari proses bersih yang sudah mengimpor modul ini, bukan dari
+        # supervisor yang sedang menjalankan event loop & thread
+        methods = mp.get_all_start_methods()
+        self.ctx = mp.get_context("forkserver" if "forkserver" in methods else methods[0])
+        if self.ctx.get_start_method() == "forkserver":
+            self.ctx.set_forkserver_preload([__name__])
+        self.n = n
+        self.inboxes: List[Any] = [None] * n
+        self.beats = [self.ctx.Value("d", time.time(), lock=False) for _ in range(n)]
+        self.done = [self.ctx.Value("q", 0, lock=False) for _ in range(n)]
+        self.pending: List["OrderedDict[int, bytes]"] = [OrderedDict() for _ in range(n)]
+        self.routed_max = 0  # update_id tertinggi yang sudah diteruskan ke worker
+        self.procs: List[Optional[mp.Process]] = [None] * n
+        self.restarts = 0
+        self.dropped = 0
+        METRICS.gauge("dukcapil_workers_unhealthy", lambda: len(self.unhealthy()), "Worker mati/macet")
+        METRICS.gauge("dukcapil_worker_restarts_total", lambda: self.restarts, "Worker dijalankan ulang", "counter")
+        METRICS.gauge("dukcapil_worker_dropped_total", lambda: self.dropped, "Update dibuang supervisor", "counter")
+
+    def spawn(self, i: int) -> None:
+        old = self.inboxes[i]
+        if old is not None:  # isinya tidak dibuang: yang belum selesai dikirim ulang di bawah
+            old.cancel_join_thread()  # tidak ada pembaca lagi, jangan tunggu feeder
+            old.close()
+        self.inboxes[i] = self.ctx.Queue(WORKER_QUEUE_MAX)
+        self.beats[i].value = time.time()
+        proc = self.ctx.Process(
+            target=worker_main,
+            args=(i, self.inboxes[i], self.beats[i], self.done[i]),
+            name=f"dukcapil-worker-{i}",
+            daemon=True,
+        )
+        proc.start()
+        self.procs[i] = proc
+        self._prune(i)
+        if self.pending[i]:
+            log.warning("Worker %d: %d update belum selesai dikirim ulang", i, len(self.pending[i]))
+            for payload in self.pending[i].values():
+                self.inboxes[i].put(payload)
+
+    def start(self) -> None:
+        for i in range(self.n):
+            self.spawn(i)
+        log.info("Supervisor: %d worker berjalan", self.n)
+
+    def route(self, data: Mapping[str, object], raw: Optional[bytes] = None) -> None:
+        payload = raw if raw is not None else json.dumps(data).encode()
+        # /broadcast hanya ke worker 0: satu job untuk pelanggan semua worker
+        i = 0 if is_broadcast(data) else chat_key(data) % self.n
+        update_id = data.get("update_id")
+        try:
+            self.inboxes[i].put_nowait(payload)
+        except queue.Full:
+            self.dropped += 1
+            log.warning("Antrean worker %d penuh, update %s dibuang", i, update_id)
+            return
+        if isinstance(update_id, int):
+            self._prune(i)  # mode webhook tidak memanggil acked()
+            self.pending[i][update_id] = payload
+            self.routed_max = max(self.routed_max, update_id)
+
+    def _prune(self, i: int) -> None:
+        pending, done = self.pending[i], self.done[i].value
+        while pending and next(iter(pending)) <= done:
+            pending.popitem(last=False)
+
+    def acked(self) -> int:
+        """update_id tertinggi yang semua update sebelumnya sudah selesai di worker."""
+        low = self.routed_max
+        for i in range(self.n):
+            self._prune(i)
+            if self.pending[i]:
+                low = min(low, next(iter(self.pending[i])) - 1)
+        return low
+
+    def unhealthy(self) -> List[int]:
+        now = time.time()
+        return [
+            i for i, proc in enumerate(self.procs)
+            if proc is None or not proc.is_alive() or now - self.beats[i].value > WORKER_HEARTBEAT_TIMEOUT
+        ]
+
+    async def monitor(self) -> None:
+        while True:
+            await asyncio.sleep(2)
+            for i in self.unhealthy():
+                proc = self.procs[i]
+                log.error("Worker %d mati/macet (exit=%s), dijalankan ulang", i, proc.exitcode if proc else None)
+                if proc is not None and proc.is_alive():
+                    proc.kill()
+                    proc.join(5)
+                self.restarts += 1
+                self.spawn(i)
+
+    def signal_workers(self, sig: int) -> None:
+        for proc in self.procs:
+            if proc is not None and proc.is_alive():
+                os.kill(proc.pid, sig)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        for q in self.inboxes:
+            q.put(None)
+        deadline = time.time() + timeout
+        for proc in self.procs:
+            if proc is not None:
+                proc.join(max(0.1, deadline - time.time()))
+                if proc.is_alive():
+                    proc.terminate()
+
+
+def supervisor_routes(sup: Supervisor, webhook: bool) -> Dict[Tuple[str, str], HttpRoute]:
+    async def on_update(headers: Dict[str, str], body: bytes) -> HttpResponse:
+        if not secret_ok(headers):
+            return 403, "text/plain", b"forbidden"
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, "text/plain", b"bad update"
+        if not isinstance(data, dict):
+            return 400, "text/plain", b"bad update"
+        sup.route(data, body)
+        return 200, "text/plain", b"ok"
+
+    async def healthz(headers: Dict[str, str], body: bytes) -> HttpResponse:
+        bad = sup.unhealthy()
+        status = 503 if bad else 200
+        return status, "application/json", json.dumps(
+            {
+                "workers": sup.n,
+                "unhealthy": bad,
+                "restarts": sup.restarts,
+                "dropped": sup.dropped,
+                "pending": sum(len(p) for p in sup.pending),
+            }
+        ).encode()
+
+    routes = {("GET", "/healthz"): healthz, **metrics_routes()}
+    if webhook:
+        routes[("POST", WEBHOOK_PATH)] = on_update
+    return routes
+
+
+async def poll_into(sup: Supervisor, bot: Bot) -> None:
+    """Satu pembaca getUpdates untuk semua worker.
+
+    Offset hanya dimajukan sampai sup.acked(): update yang masih di antrean
+    worker belum dikonfirmasi, jadi bila supervisor mati Telegram mengirimnya
+    lagi (worker menyaring duplikat). Update yang sudah diteruskan tapi
+    terkirim ulang tidak diteruskan lagi. Karena getUpdates maksimal 100
+    update, worker yang lambat menahan pengambilan update baru.
+    """
+    await bot.delete_webhook(drop_pending_updates=not STATE_DB)
+    offset: Optional[int] = None
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=25, read_timeout=35, allowed_updates=Update.ALL_TYPES
+            )
+        except RetryAfter as e:
+            await asyncio.sleep(float(e.retry_after))
+            continue
+        except TelegramError as e:
+            log.warning("getUpdates gagal: %s", e)
+            await asyncio.sleep(2)
+            continue
+        fresh = [u for u in updates if u.update_id > sup.routed_max]
+        for update in fresh:
+            sup.route(update.to_dict())
+        acked = sup.acked()
+        if acked:
+            offset = acked + 1
+        if updates and not fresh:  # semua masih diproses worker: jangan putar getUpdates tanpa jeda
+            await asyncio.sleep(0.1)
+
+
+async def run_supervisor(sup: Supervisor) -> None:
+    """Mode multi-proses sampai SIGINT/SIGTERM; SIGHUP diteruskan ke worker.
+
+    Worker pertama sudah dijalankan (sup.start()) sebelum event loop ini.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, sup.signal_workers, signal.SIGHUP)
+
+    tasks = [asyncio.create_task(sup.monitor())]
+    server = HttpServer(supervisor_routes(sup, WEBHOOK_MODE))
+    send, updates = bot_requests()
+    bot = Bot(TOKEN, request=send, get_updates_request=updates)
+    if WEBHOOK_MODE:
+        await server.start(HTTP_HOST, HTTP_PORT)  # port dulu, baru setWebhook (seperti proses tunggal)
+        await bot.initialize()
+        if WEBHOOK_URL:
+            tasks.append(asyncio.create_task(ensure_webhook(bot)))
+        else:
+            log.warning("WEBHOOK_URL kosong: setWebhook dilewati (mode uji lokal)")
+    else:
+        if METRICS_PORT:  # /healthz & /metrics supervisor saat polling
+            await server.start(HTTP_HOST, METRICS_PORT)
+        await bot.initialize()
+        tasks.append(asyncio.create_task(poll_into(sup, bot)))
+
+    await stop.wait()
+    for task in tasks:
+        task.cancel()
+    await server.stop()
+    await bot.shutdown()
+    await asyncio.to_thread(sup.stop)
+
+
+# =========================================================
+# KLIEN BOT API (POOL KONEKSI HTTP)
+# =========================================================
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """Transport httpx yang memisahkan waktu antre slot pool dan waktu di kabel.
+
+    httpcore memanggil hook `trace` begitu request memegang koneksi (TCP baru
+    atau kirim header di koneksi lama); selisih dari awal = antre pool.
+    """
+
+    _ACQUIRED = ("connection.connect_tcp.started", "http11.send_request_headers.started",
+                 "http2.send_request_headers.started")
+
+    def __init__(self, pool: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        t0 = time.perf_counter()
+        acquired: List[float] = []
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            if not acquired and event in self._ACQUIRED:
+                acquired.append(time.perf_counter())
+            if event == "connection.connect_tcp.started":
+                METRICS.inc("dukcapil_http_connections_total", pool=self.pool)
+
+        request.extensions["trace"] = trace
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            METRICS.inc("dukcapil_http_pool_timeouts_total", pool=self.pool)
+            raise
+        finally:
+            t1 = acquired[0] if acquired else time.perf_counter()
+            METRICS.observe("dukcapil_http_pool_wait_seconds", t1 - t0, pool=self.pool)
+            if acquired:
+                METRICS.observe("dukcapil_http_wire_seconds", time.perf_counter() - t1, pool=self.pool)
+
+
+class TunedRequest(HTTPXRequest):
+    """HTTPXRequest dengan keep-alive panjang, HTTP/2 opsional, dan metrik pool.
+
+    PTB 20.3 belum punya hook resmi untuk memasang transport sendiri, jadi
+    `_build_client` ditimpa dan membaca `_client_kwargs`. Isinya dicek persis:
+    bila versi PTB lain menambah atau mengganti kunci, bot gagal saat start
+    alih-alih diam-diam membuang pengaturan (mis. proxy).
+    """
+
+    CLIENT_KWARGS = frozenset({"timeout", "proxies", "limits", "http1", "http2"})
+
+    def __init__(self, pool: str, pool_size: int, read_timeout: float = 5.0, proxy_url: Optional[str] = None) -> None:
+        http2 = HTTP2 == "1" or (HTTP2 == "auto" and importlib.util.find_spec("h2") is not None)
+        self.pool = pool
+        super().__init__(
+            connection_pool_size=pool_size,
+            proxy_url=proxy_url,
+            read_timeout=read_timeout,
+            pool_timeout=HTTP_POOL_TIMEOUT,
+            http_version="2" if http2 else "1.1",
+        )
+
+    def _build_client(self) -> httpx.AsyncClient:
+        kwargs = dict(self._client_kwargs)
+        if kwargs.keys() != self.CLIENT_KWARGS:
+            raise RuntimeError(
+                f"HTTPXRequest._client_kwargs berisi {sorted(kwargs)}, TunedRequest mengharapkan "
+                f"{sorted(self.CLIENT_KWARGS)}; sesuaikan TunedRequest dengan versi PTB ini"
+            )
+        pool_size = kwargs.pop("limits").max_connections
+        proxy = kwargs.pop("proxies")
+        transport = InstrumentedTransport(
+            self.pool,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=HTTP_KEEPALIVE_SEC,
+            ),
+            http1=kwargs.pop("http1"),
+            http2=kwargs.pop("http2"),
+            proxy=httpx.Proxy(proxy) if proxy else None,  # proxy lewat transport ini agar tetap terukur
+        )
+        return httpx.AsyncClient(transport=transport, **kwargs)
+
+
+def bot_requests() -> Tuple[TunedRequest, TunedRequest]:
+    """(request kirim, request getUpdates): getUpdates long-poll tidak boleh
+    memakan slot pool kiriman balasan."""
+    size = HTTP_POOL_SIZE or max(UPDATE_CONCURRENCY, 8)
+    proxy = HTTP_PROXY_URL or None
+    return TunedRequest("send", size, proxy_url=proxy), TunedRequest("updates", 1, proxy_url=proxy)
 
 
 # =========================================================
 # MAIN
 # =========================================================
-def build_app() -> Application:
-    app: Application = (
+def request_reload(app: Application) -> None:
+    """Handler SIGHUP: jadwalkan reload konten, kecuali yang sebelumnya belum selesai."""
+    task = app.bot_data.get("content_reload")
+    if task is None or task.done():
+        app.bot_data["content_reload"] = asyncio.create_task(reload_content())
+
+
+async def on_startup(app: Application) -> None:
+    """post_init: muat state, reload konten (SIGHUP & pantau berkas), /metrics saat polling."""
+    STARTUP.mark("initialize (getMe)")
+    await STATE.start()
+    await BOOKINGS.start()
+    MISSED.load(STATE)
+    if STATE.path and MISSED_FLUSH_SEC > 0:
+        app.bot_data["missed_flush"] = asyncio.create_task(MISSED.flush_loop(STATE))
+    caster = app.bot_data["broadcaster"] = Broadcaster(STATE, BROADCAST_RATE, BROADCAST_BATCH)
+    if not WORKER_INDEX:  # proses tunggal atau worker 0 (penerima /broadcast)
+        caster.resume(app.bot)
+    if hasattr(signal, "SIGHUP"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, request_reload, app)
+        except (NotImplementedError, RuntimeError):  # bukan main thread / Windows
+            pass
+    if CONTENT_POLL_SEC > 0:
+        app.bot_data["content_watcher"] = asyncio.create_task(watch_content())
+    if METRICS_PORT and (not WEBHOOK_MODE or WORKER_INDEX is not None):  # webhook tunggal: di port webhook
+        server = HttpServer(metrics_routes())
+        await server.start(HTTP_HOST, METRICS_PORT)
+        app.bot_data["metrics_server"] = server
+    if not WEBHOOK_MODE:
+        STARTUP.mark("siap")  # run_polling mulai getUpdates tepat sesudah ini
+
+
+async def on_shutdown(app: Application) -> None:
+    for name in ("content_watcher", "content_reload"):
+        task = app.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    server = app.bot_data.pop("metrics_server", None)
+    if server:
+        await server.stop()
+    caster = app.bot_data.pop("broadcaster", None)
+    if caster:
+        await caster.stop()  # checkpoint terakhir ikut ditulis STATE.close()
+    flusher = app.bot_data.pop("missed_flush", None)
+    if flusher:
+        flusher.cancel()
+    MISSED.save(STATE)
+    await STATE.close()
+    await BOOKINGS.close()
+
+
+def build_app(request: Optional[BaseRequest] = None) -> Application:
+    """Rakit Application; `request` opsional untuk mengganti lapisan HTTP (mis. stub lokal)."""
+    limiter = OutboundLimiter(per_chat=UPDATE_CONCURRENCY > 0)
+    builder = (
         ApplicationBuilder()
         .token(TOKEN)
-        .concurrent_updates(False)  # lebih stabil di plan gratis
-        .build()
+        .rate_limiter(limiter)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if request is None:
+        send, updates = bot_requests()
+        builder = builder.request(send).get_updates_request(updates)
+    else:
+        builder = builder.request(request).get_updates_request(request)
+    if UPDATE_CONCURRENCY > 0:
+        builder = (
+            builder.application_class(ChatOrderedApplication)
+            # slot PTB menampung update yang sedang antre di kunci chat
+            .concurrent_updates(UPDATE_CONCURRENCY * CHAT_QUEUE_DEPTH)
+        )
+    else:
+        # satu per satu: lebih stabil di plan gratis
+        builder = builder.application_class(DedupApplication).concurrent_updates(False)
+    app: Application = builder.build()
+
+    # Gauge dibaca saat scrape
+    METRICS.gauge("dukcapil_pending_updates", app.update_queue.qsize, "Update yang menunggu diproses")
+    METRICS.gauge("dukcapil_outbound_queued", lambda: limiter.queued, "Kiriman yang sedang antre")
+    METRICS.gauge("dukcapil_outbound_retries_total", lambda: limiter.retries, "Ulang kirim karena 429", "counter")
+
+    # Atur laju antrean lama, sebelum handler lain (duplikat sudah disaring DedupApplication)
+    app.add_handler(TypeHandler(Update, state_gate), group=-10)
+    # Anti-spam per user, sebelum matcher & balasan
+    app.add_handler(TypeHandler(Update, inbound_guard), group=-9)
 
     # Commands
-    app.add_handler(CommandHandler("start", cmd_start))
-    app.add_handler(CommandHandler("menu", cmd_menu))
-    app.add_handler(CommandHandler("help", cmd_help))
-    app.add_handler(CommandHandler("about", cmd_about))
-    app.add_handler(CommandHandler("sidnok", cmd_sidnok))
-    app.add_handler(CommandHandler("info", cmd_info))
+    app.add_handler(command_handler("start", cmd_start))
+    app.add_handler(command_handler("menu", cmd_menu))
+    app.add_handler(command_handler("help", cmd_help))
+    app.add_handler(command_handler("about", cmd_about))
+    app.add_handler(command_handler("sidnok", cmd_sidnok))
+    app.add_handler(command_handler("info", cmd_info))
+    app.add_handler(command_handler("langganan", cmd_subscribe))
+    app.add_handler(command_handler("berhenti", cmd_unsubscribe))
+    app.add_handler(command_handler("broadcast", cmd_broadcast))
+    app.add_handler(command_handler("antrean", cmd_booking))
+    app.add_handler(command_handler("bahasa", cmd_language))
+    app.add_handler(command_handler("terlewat", cmd_missed))
+    app.add_handler(command_handler("berkas", cmd_checklist))
+
+    # Callback (tombol); antrean, bahasa & cek berkas lebih dulu karena datanya dinamis
+    app.add_handler(CallbackQueryHandler(timed("on_booking", on_booking), pattern=r"^bk(:|$)"))
+    app.add_handler(CallbackQueryHandler(timed("on_language", on_language), pattern=r"^lang:"))
+    app.add_handler(CallbackQueryHandler(timed("on_checklist", on_checklist), pattern=r"^ck(:|$)"))
+    app.add_handler(CallbackQueryHandler(timed("on_callback", on_callback)))
 
-    # Callback (tombol)
-    app.add_handler(CallbackQueryHandler(on_callback))
+    # Inline query; block=False: round trip answerInlineQuery tidak menahan update lain
+    app.add_handler(InlineQueryHandler(timed("on_inline", on_inline), block=False))
 
     # Text bebas
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed("on_text", on_text)))
 
     # Error global
     app.add_error_handler(error_handler)
@@ -632,10 +4149,31 @@ def build_app() -> Application:
 
 
 def main():
+    global STARTUP_REPORT
+    if "--missed-report" in sys.argv[1:]:
+        # laporan frasa yang belum dikenali, gabungan semua worker di STATE_DB
+        rest = sys.argv[sys.argv.index("--missed-report") + 1:]
+        print(missed_report_cli(int(rest[0]) if rest and rest[0].isdigit() else 30))
+        return
+    if "--startup-report" in sys.argv[1:]:
+        STARTUP_REPORT = True
+    if WORKERS > 1:
+        if STATE_DB:
+            prepare_state_db(STATE_DB)  # sekali, sebelum worker mana pun membuka DB bersama
+        sup = Supervisor(WORKERS)
+        sup.start()  # sebelum event loop berjalan
+        log.info("Bot berjalan (supervisor, %d worker)…", WORKERS)
+        asyncio.run(run_supervisor(sup))
+        return
     app = build_app()
+    STARTUP.mark("build_app")
     log.info("Bot berjalan…")
-    # drop_pending_updates=True biar saat restart tidak banjir update lama
-    app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    if WEBHOOK_MODE:
+        asyncio.run(run_webhook(app))
+        return
+    # Dengan STATE_DB, update yang masuk saat bot mati tetap diproses (duplikat
+    # disaring DedupApplication, laju dibatasi BACKLOG_RATE); tanpa itu dibuang seperti dulu.
+    app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=not STATE_DB)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Uji antrean loket (SlotIndex + BookingStore): tidak ada slot dobel walau
+konfirmasi bersamaan, slot kembali saat dibatalkan, dan indeks dibangun ulang
+dari SQLite saat start."""
+
+import asyncio
+import dataclasses
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+DAY = (datetime.now(main.WIB) + timedelta(days=1)).strftime("%Y%m%d")
+SLOT = 9 * 60
+CFG = dataclasses.replace(main.CONTENT.booking, capacity=2, service_daily_cap=3)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "booking.db")
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def active_rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT chat_id, slot FROM booking WHERE status = 'aktif' ORDER BY chat_id").fetchall()
+
+
+def test_concurrent_confirms_never_overbook(db_path):
+    async def scenario():
+        store = main.BookingStore(db_path)
+        await store.start()
+        try:
+            return await asyncio.gather(
+                *(store.reserve(CFG, chat, "ktp_baru", DAY, SLOT) for chat in range(10))
+            )
+        finally:
+            await store.close()
+
+    results = run(scenario)
+    booked = [b for b, reason in results if b]
+    assert len(booked) == CFG.capacity
+    assert {reason for b, reason in results if not b} == {"penuh"}
+    assert len(active_rows(db_path)) == CFG.capacity
+
+
+def test_two_workers_share_capacity_through_sqlite(db_path):
+    # tiap worker punya SlotIndex sendiri; batas tetap dijaga transaksi di DB
+    async def scenario():
+        stores = [main.BookingStore(db_path), main.BookingStore(db_path)]
+        for store in stores:
+            await store.start()
+        try:
+            return await asyncio.gather(
+                *(stores[chat % 2].reserve(CFG, chat, "kk_hilang", DAY, SLOT) for chat in range(8))
+            )
+        finally:
+            for store in stores:
+                await store.close()
+
+    results = run(scenario)
+    assert sum(1 for b, _ in results if b) == CFG.capacity
+    assert len(active_rows(db_path)) == CFG.capacity
+
+
+def test_same_chat_confirming_twice_gets_one_booking(db_path):
+    async def scenario():
+        store = main.BookingStore(db_path)
+        await store.start()
+        try:
+            return await asyncio.gather(
+                store.reserve(CFG, 7, "ktp_baru", DAY, SLOT),
+                store.reserve(CFG, 7, "kk_hilang", DAY, SLOT + 30),
+            )
+        finally:
+            await store.close()
+
+    (first, _), (second, reason) = run(scenario)
+    assert first is not None and second is None and reason == "dobel"
+    assert active_rows(db_path) == [(7, SLOT)]
+
+
+def test_service_daily_cap_counts_across_slots():
+    async def scenario():
+        store = main.BookingStore("")
+        return [
+            (await store.reserve(CFG, chat, "akta_lahir_umum", DAY, SLOT + 30 * (chat // 2)))[1]
+            for chat in range(5)
+        ]
+
+    assert run(scenario) == ["", "", "", "kuota", "kuota"]
+
+
+def test_cancel_releases_slot(db_path):
+    async def scenario():
+        store = main.BookingStore(db_path)
+        await store.start()
+        try:
+            first, _ = await store.reserve(CFG, 1, "ktp_baru", DAY, SLOT)
+            await store.reserve(CFG, 2, "ktp_baru", DAY, SLOT)
+            assert (await store.reserve(CFG, 3, "ktp_baru", DAY, SLOT))[1] == "penuh"
+            assert await store.cancel(2, first.code) is None  # bukan milik chat 2
+            assert await store.cancel(1, first.code) == first
+            assert await store.cancel(1, first.code) is None  # klik ganda
+            assert store.index.taken(DAY, SLOT) == 1
+            assert store.mine(1) == []
+            third, reason = await store.reserve(CFG, 3, "ktp_baru", DAY, SLOT)
+            assert third is not None, reason
+            # chat 1 boleh memesan lagi di hari yang sama setelah membatalkan
+            assert (await store.reserve(CFG, 1, "ktp_baru", DAY, SLOT + 30))[0] is not None
+        finally:
+            await store.close()
+
+    run(scenario)
+    assert active_rows(db_path) == [(1, SLOT + 30), (2, SLOT), (3, SLOT)]
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM booking WHERE status = 'batal'").fetchone()[0] == 1
+
+
+def test_index_rebuilt_from_sqlite(db_path):
+    async def first_run():
+        store = main.BookingStore(db_path)
+        await store.start()
+        try:
+            kept, _ = await store.reserve(CFG, 1, "ktp_baru", DAY, SLOT)
+            await store.reserve(CFG, 2, "kk_hilang", DAY, SLOT)
+            gone, _ = await store.reserve(CFG, 3, "kk_hilang", DAY, SLOT + 30)
+            await store.cancel(3, gone.code)
+            return kept
+        finally:
+            await store.close()
+
+    kept = run(first_run)
+    with sqlite3.connect(db_path) as db:  # antrean yang sudah lewat tidak dimuat
+        db.execute(
+            "INSERT INTO booking (code, chat_id, service, day, slot, created) VALUES ('LAMA01', 9, 'ktp_baru', '20000103', 540, 0)"
+        )
+
+    async def restart():
+        store = main.BookingStore(db_path)
+        await store.start()
+        try:
+            assert len(store.by_code) == 2 and "LAMA01" not in store.by_code
+            assert store.by_code[kept.code] == kept
+            assert store.index.taken(DAY, SLOT) == 2
+            assert store.index.taken(DAY, SLOT + 30) == 0
+            assert store.index.service_taken(DAY, "kk_hilang") == 1
+            assert store.mine(1) == [kept]
+            # indeks hasil muat ulang langsung menolak tanpa menyentuh DB
+            assert store.index.try_reserve(CFG, main.Booking("X", 4, "ktp_baru", DAY, SLOT)) == "penuh"
+            assert (await store.reserve(CFG, 3, "kk_hilang", DAY, SLOT + 30))[0] is not None
+        finally:
+            await store.close()
+
+    run(restart)
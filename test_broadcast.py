@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Uji pengumuman (Broadcaster): semua pelanggan tercapai, termasuk grup."""
+
+import asyncio
+import sqlite3
+from typing import List, Tuple
+
+from telegram.error import Forbidden
+
+import main
+
+SUBSCRIBERS = [-1001234567890, -55, 42, 77]  # supergrup, grup, dua chat pribadi
+ADMIN = 42
+
+
+class FakeBot:
+    """Cukup send_message untuk Broadcaster; mencatat tujuan tiap pesan."""
+
+    def __init__(self, blocked: frozenset = frozenset()) -> None:
+        self.blocked = blocked
+        self.sent: List[Tuple[int, str]] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append((chat_id, text))
+
+
+def _store() -> main.StateStore:
+    store = main.StateStore("")
+    for cid in SUBSCRIBERS:
+        store.set(cid, subscribed=1)
+    store.set(99, subscribed=0)
+    return store
+
+
+def test_broadcast_reaches_groups_and_private_chats():
+    async def go():
+        store, bot = _store(), FakeBot()
+        caster = main.Broadcaster(store, rate=1e9, batch=3)
+        job = await caster.start(bot, "Kantor tutup besok", ADMIN)
+        await caster._task
+        return job, bot
+
+    job, bot = asyncio.run(go())
+    assert job.total == len(SUBSCRIBERS)
+    assert (job.sent, job.done, job.cursor) == (len(SUBSCRIBERS), True, 77)
+    assert [cid for cid, text in bot.sent if text == "Kantor tutup besok"] == sorted(SUBSCRIBERS)
+    assert bot.sent[-1] == (ADMIN, job.summary())
+
+
+def test_broadcast_resumes_after_checkpointed_cursor():
+    async def go():
+        store, bot = _store(), FakeBot()
+        caster = main.Broadcaster(store, rate=1e9, batch=2)
+        caster.job = main.BroadcastJob(
+            id=1, text="Lanjutan", admin=ADMIN, total=4, started=0.0, cursor=-55, sent=2
+        )
+        caster.resume(bot)
+        await caster._task
+        return caster.job, bot
+
+    job, bot = asyncio.run(go())
+    assert [cid for cid, text in bot.sent if text == "Lanjutan"] == [42, 77]
+    assert (job.sent, job.done) == (4, True)
+
+
+def test_worker_zero_broadcasts_to_every_shard(tmp_path):
+    path = str(tmp_path / "state.db")
+    main.prepare_state_db(path)
+
+    async def go():
+        shards = [main.StateStore(path, i, 2) for i in range(2)]
+        for store in shards:
+            await store.start()
+        for cid in SUBSCRIBERS:
+            shards[cid % 2].set(cid, subscribed=1)
+        shards[1].set(77, lang="en")
+        for store in shards:
+            await store.flush()
+        bot = FakeBot(blocked=frozenset({77}))
+        caster = main.Broadcaster(shards[0], rate=1e9, batch=10)
+        job = await caster.start(bot, "Kantor tutup besok", ADMIN)
+        await caster._task
+        for store in shards:
+            await store.close()
+        return job, bot
+
+    job, bot = asyncio.run(go())
+    assert (job.total, job.sent, job.blocked) == (4, 3, 1)
+    assert [cid for cid, text in bot.sent if text == "Kantor tutup besok"] == [-1001234567890, -55, 42]
+    db = sqlite3.connect(path)
+    # chat milik worker 1 hanya berhenti berlangganan, isinya yang lain utuh
+    assert db.execute("SELECT lang, subscribed FROM chat_state WHERE chat_id = 77").fetchone() == ("en", 0)
+    db.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Uji properti pemotong pesan (iter_chunks / chunk_message).
+
+Tanpa dependensi tambahan: korpus Markdown acak dengan seed tetap, jadi
+kegagalan selalu bisa diulang. Sifat yang dicek untuk setiap bagian:
+panjang <= limit dalam unit UTF-16, entitas seimbang (dicek ulang dengan
+pemeriksa terpisah, bukan logika pemotong), tidak ada bagian kosong, dan
+isi teks tidak hilang maupun bertambah.
+"""
+
+import random
+
+import pytest
+
+import main
+
+SEED = 20261017
+CASES = 200
+
+WORDS = ["ktp", "hilang", "kk", "akta", "kelahiran", "Dispendukcapil", "Semarang", "🙂", "👨‍👩‍👧", "ñandú", "x" * 40]
+
+
+def _word(rng: random.Random) -> str:
+    return rng.choice(WORDS)
+
+
+def _phrase(rng: random.Random, lo: int, hi: int) -> str:
+    return " ".join(_word(rng) for _ in range(rng.randint(lo, hi)))
+
+
+def _token(rng: random.Random, limit: int) -> str:
+    kind = rng.random()
+    if kind < 0.40:
+        return _word(rng)
+    if kind < 0.50:
+        return rng.choice(["\n", "\n\n", "\n• "])
+    if kind < 0.60:
+        return f"*{_phrase(rng, 1, 60)}*"  # bisa lebih panjang dari limit: potong paksa
+    if kind < 0.68:
+        return f"_{_phrase(rng, 1, 8)}_"
+    if kind < 0.74:
+        return f"`{_phrase(rng, 1, 4)}`"
+    if kind < 0.80:
+        return f"```\n{_phrase(rng, 1, 30)}\n```"
+    if kind < 0.86:
+        # tautan tidak bisa ditutup paksa, jadi selalu muat dalam satu bagian
+        label = _phrase(rng, 1, 3)[: max(1, limit // 4)]
+        return f"[{label}](https://s.id/{rng.randint(0, 999)})"
+    if kind < 0.92:
+        return rng.choice(["\\*", "\\_", "\\`", "\\["])
+    return "y" * rng.randint(1, limit * 2)  # kata tanpa spasi lebih panjang dari limit
+
+
+def _corpus(rng: random.Random, limit: int) -> str:
+    tokens = [_word(rng)] + [_token(rng, limit) for _ in range(rng.randint(0, 120))]
+    rng.shuffle(tokens)
+    return " ".join(tokens)
+
+
+def _balanced(chunk: str) -> bool:
+    """Pemeriksa Markdown (legacy) terpisah: True bila tidak ada entitas terbuka."""
+    entity = None
+    i, n = 0, len(chunk)
+    while i < n:
+        if entity is None:
+            if chunk[i] == "\\":
+                i += 2
+                continue
+            if chunk.startswith("```", i):
+                entity, i = "```", i + 3
+                continue
+            if chunk[i] in "*_`":
+                entity = chunk[i]
+            elif chunk[i] == "[":
+                close = chunk.find("](", i)
+                end = chunk.find(")", close + 2) if close != -1 else -1
+                if end == -1:
+                    return False
+                i = end
+        elif entity == "```":
+            if chunk.startswith("```", i):
+                entity, i = None, i + 3
+                continue
+        elif chunk[i] == entity:
+            entity = None
+        i += 1
+    return entity is None
+
+
+def _content(text: str) -> str:
+    return "".join(text.translate(str.maketrans("", "", "*_`")).split())
+
+
+@pytest.mark.parametrize("limit", [40, 64, 97, 256, main.MAX_TG])
+def test_iter_chunks_properties(limit):
+    rng = random.Random(SEED + limit)
+    for case in range(CASES):
+        text = _corpus(rng, limit)
+        if limit == main.MAX_TG:
+            text *= rng.randint(1, 3)
+        chunks = main.chunk_message(text, limit)
+        ctx = f"seed={SEED + limit} kasus={case}"
+        for chunk in chunks:
+            assert main.utf16_len(chunk) <= limit, ctx
+            assert chunk.strip(), ctx
+            assert _balanced(chunk), f"{ctx}: {chunk!r}"
+        assert _content("".join(chunks)) == _content(text), ctx
+
+
+def test_chunk_message_short_text_untouched():
+    text = "📄 *KTP Baru*\n• Fotokopi KK  \n"
+    assert main.chunk_message(text, 64) == [text]
+    assert main.chunk_message("🙂" * 32, 64) == ["🙂" * 32]
+
+
+def test_utf16_len_counts_astral_as_two():
+    assert main.utf16_len("ktp") == 3
+    assert main.utf16_len("🙂") == 2
+    assert main.utf16_len("ñ👨‍👩‍👧") == 1 + 2 + 1 + 2 + 1 + 2
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""FuzzyIndex: salah ketik tetap dikenali, kata yang beda tidak ikut terbawa."""
+
+import pytest
+
+import main
+
+KEYWORDS = {
+    "ktp_hilang": ("ktp hilang", "kehilangan ktp", "ktp ilang"),
+    "ktp_perpanjang": ("perpanjang ktp", "masa berlaku ktp", "ktp expired"),
+    "kk_status": ("status kk", "ubah status kk"),
+    "kk_goldar": ("golongan darah kk", "goldar kk"),
+    "akta_lahir_umum": ("akta kelahiran", "akta lahir"),
+    "alamat": ("alamat", "lokasi kantor"),
+}
+
+INDEX = main.FuzzyIndex(KEYWORDS, 0.65)
+
+
+@pytest.mark.parametrize(
+    "text, intent",
+    [
+        ("ktp hilng", "ktp_hilang"),
+        ("perpanjng ktp", "ktp_perpanjang"),
+        ("kk status", "kk_status"),  # urutan kata bebas
+        ("kk golongan drah", "kk_goldar"),
+        ("akta kelahrian", "akta_lahir_umum"),  # dua huruf tertukar
+        ("tolong, ktp hlang ya", "ktp_hilang"),
+    ],
+)
+def test_typo_matches_intent(text, intent):
+    assert INDEX.match(text) == intent
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "perpanjang sim",  # satu kata panjang sama, kata lain beda total
+        "perpanjang stnk",
+        "ktb hilang",  # kata pendek harus persis
+        "sim hilang",
+        "selamat pagi",
+        "status pernikahan",
+    ],
+)
+def test_other_words_do_not_match(text):
+    assert INDEX.match(text) is None
+
+
+def test_closest_still_reports_near_miss():
+    # laporan analitik tetap menyebut intent terdekat walau `match` menolak
+    assert INDEX.closest("perpanjang sim", 0.3)[0] == "ktp_perpanjang"
+
+
+@pytest.mark.parametrize(
+    "a, b, limit, expected",
+    [
+        ("hilng", "hilang", 1, True),
+        ("hlang", "hilang", 1, True),
+        ("kelahrian", "kelahiran", 1, True),
+        ("kelhran", "kelahiran", 1, False),
+        ("kelhran", "kelahiran", 2, True),
+        ("sim", "ktp", 0, False),
+        ("ktp", "ktp", 0, True),
+    ],
+)
+def test_within_edit_distance(a, b, limit, expected):
+    assert main.FuzzyIndex.within(a, b, limit) is expected
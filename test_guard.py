@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Uji InboundGuard dengan jam palsu: hitungan jendela geser per slot, masa
+bisu, dan anggaran tombol/inline yang terpisah dari pesan teks."""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+from telegram import CallbackQuery, Chat, InlineQuery, Message, Update, User
+from telegram.ext import ApplicationHandlerStop
+
+import main
+
+ALLOW, WARN, DROP = main.InboundGuard.ALLOW, main.InboundGuard.WARN, main.InboundGuard.DROP
+
+
+def checks(guard, user_id, now, n):
+    return [guard.check(user_id, now) for _ in range(n)]
+
+
+def test_limit_then_warn_once_then_drop_until_mute_ends():
+    guard = main.InboundGuard(3, 10.0, 30.0, 64)
+    assert checks(guard, 5, 100.0, 3) == [ALLOW] * 3
+    assert checks(guard, 5, 100.0, 3) == [WARN, DROP, DROP]
+    assert guard.check(5, 129.9) == DROP
+    # masa bisu selesai; dua jendela sudah lewat jadi hitungan lama hangus
+    assert checks(guard, 5, 130.0, 3) == [ALLOW] * 3
+
+
+def test_sliding_window_weights_previous_window():
+    guard = main.InboundGuard(10, 10.0, 5.0, 64)
+    assert checks(guard, 5, 5.0, 10) == [ALLOW] * 10
+    # 20% ke jendela berikutnya: 10 x 0.8 = 8 masih terhitung, sisa 2
+    assert checks(guard, 5, 12.0, 3) == [ALLOW, ALLOW, WARN]
+    # bisu sampai 17.0; di 70% jendela: 10 x 0.3 = 3 + 3 sudah tercatat
+    assert checks(guard, 5, 17.0, 5) == [ALLOW] * 4 + [WARN]
+
+
+def test_users_are_counted_separately():
+    guard = main.InboundGuard(2, 10.0, 30.0, 64)
+    assert checks(guard, 1, 0.0, 3) == [ALLOW, ALLOW, WARN]
+    assert checks(guard, 2, 0.0, 2) == [ALLOW, ALLOW]
+
+
+def test_slot_collision_never_mutes_the_new_user():
+    guard = main.InboundGuard(2, 10.0, 30.0, 1)  # satu slot: semua user berbagi
+    assert checks(guard, 1, 0.0, 3) == [ALLOW, ALLOW, WARN]
+    assert checks(guard, 2, 0.0, 2) == [ALLOW, ALLOW]
+    # user 1 tergeser dari slot: mulai lagi dari nol (bisunya ikut hilang)
+    assert guard.check(1, 1.0) == ALLOW
+
+
+def test_counter_saturates_instead_of_wrapping():
+    guard = main.InboundGuard(0x10000, 10.0, 0.0, 4)
+    for _ in range(0x10005):
+        guard.check(9, 0.0)
+    assert guard.check(9, 0.0) == ALLOW  # 0xFFFF tidak pernah kembali ke 0
+
+
+# --- inbound_guard: pesan teks vs tombol & inline query ---
+class FakeClock:
+    """Pengganti modul `time` di main: monotonic() bisa diatur."""
+
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+USER = User(5, "Warga", False)
+CHAT = Chat(5, "private")
+DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def text_update(uid, user=USER):
+    return Update(uid, message=Message(uid, DATE, CHAT, from_user=user, text="ktp hilang"))
+
+
+def tap_update(uid):
+    return Update(uid, callback_query=CallbackQuery(str(uid), USER, "x", data="home"))
+
+
+def inline_update(uid):
+    return Update(uid, inline_query=InlineQuery(str(uid), USER, "ktp", ""))
+
+
+@pytest.fixture
+def guarded(monkeypatch):
+    clock = FakeClock(1000.0)
+    sent, acked = [], []
+
+    async def send_reply(message, reply):
+        sent.append(reply)
+
+    async def ack(q, text=None):
+        acked.append(q.id)
+
+    monkeypatch.setattr(main, "time", clock)
+    monkeypatch.setattr(main, "GUARD", main.InboundGuard(3, 60.0, 120.0, 64))
+    monkeypatch.setattr(main, "TAP_GUARD", main.InboundGuard(5, 60.0, 0.0, 64))
+    monkeypatch.setattr(main, "GUARD_LIMIT", 3)
+    monkeypatch.setattr(main, "GUARD_TAP_LIMIT", 5)
+    monkeypatch.setattr(main, "send_reply", send_reply)
+    monkeypatch.setattr(main, "_ack", ack)
+    return clock, sent, acked
+
+
+def passes(update):
+    async def run():
+        try:
+            await main.inbound_guard(update, None)
+        except ApplicationHandlerStop:
+            return False
+        return True
+
+    return asyncio.run(run())
+
+
+def test_taps_and_inline_have_their_own_budget(guarded):
+    clock, sent, acked = guarded
+    assert [passes(text_update(i)) for i in range(4)] == [True, True, True, False]
+    assert len(sent) == 1  # satu peringatan saat batas pertama kali lewat
+    assert not passes(text_update(4))
+    assert len(sent) == 1  # selama bisu dibuang diam-diam
+
+    # pesan teks dibisukan, tapi tombol & inline tetap punya anggaran sendiri
+    assert [passes(tap_update(10 + i)) for i in range(3)] == [True] * 3
+    assert [passes(inline_update(20 + i)) for i in range(2)] == [True] * 2
+    assert not passes(tap_update(30))
+    assert not passes(inline_update(31))
+    assert acked == ["30"]  # tombol yang dibuang tetap dijawab agar spinner berhenti
+    assert len(sent) == 1  # kelebihan tombol tidak pernah memberi peringatan/bisu
+
+    clock.now += 120.0  # jendela tombol bergeser habis, masa bisu teks selesai
+    assert passes(tap_update(40))
+    assert passes(text_update(41))
+
+
+def test_tap_flood_does_not_mute_text(guarded):
+    clock, sent, _ = guarded
+    assert not all(passes(tap_update(i)) for i in range(10))
+    assert passes(text_update(100))
+    assert sent == []
+
+
+def test_admin_is_exempt(guarded, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_IDS", frozenset({USER.id}))
+    assert all(passes(text_update(i)) for i in range(10))
+    assert all(passes(tap_update(100 + i)) for i in range(10))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Uji kesetaraan pencocok intent (IntentMatcher) dengan rantai if lama
+`answer_free_text` yang digantikannya.
+
+Rantai lama dibekukan di bawah apa adanya (KW + urutan cek), hanya nilai
+kembaliannya diganti nama intent. Kasus uji: contoh di FAQ_TEXT lama dan
+kombinasi acak frasa keyword dengan seed tetap.
+"""
+
+import random
+from typing import List, Optional
+
+import pytest
+
+import main
+
+SEED = 20261017
+
+# =========================================================
+# SALINAN BEKU RANTAI IF LAMA
+# =========================================================
+KW = {
+    "ktp_hilang": ["ktp hilang", "kehilangan ktp", "ktp ilang"],
+    "ktp_baru": ["ktp baru", "buat ktp", "daftar ktp", "pembuatan ktp"],
+    "ktp_ubah": ["ubah ktp", "koreksi ktp", "ganti data ktp", "perubahan ktp"],
+    "ktp_perpanjang": ["perpanjang ktp", "masa berlaku ktp", "ktp expired", "ktp mati"],
+    "kk_hilang": ["kk hilang", "kehilangan kk", "kk ilang"],
+    "kk_alamat": ["ubah alamat kk", "pindah alamat kk", "alamat kk"],
+    "kk_pekerjaan": ["pekerjaan kk", "ubah pekerjaan kk", "ganti pekerjaan kk"],
+    "kk_status": ["status kk", "ubah status kk", "nikah kk", "cerai kk"],
+    "kk_goldar": ["golongan darah kk", "goldar kk", "gologan darah kk", "g.darah kk"],
+    "kk_gabung": ["gabung kk", "penggabungan kk", "join kk"],
+    "kk_pisah": ["pisah kk", "pemisahan kk"],
+    "akta_lahir_umum": ["akta kelahiran", "buat akta lahir"],
+    "akta_lahir_hilang": ["akta kelahiran hilang", "kehilangan akta kelahiran"],
+    "akta_mati_umum": ["akta kematian", "buat akta kematian"],
+    "akta_mati_hilang": ["akta kematian hilang", "kehilangan akta kematian"],
+    "kia": ["kia", "kartu identitas anak"],
+    "pindah_keluar": ["pindah domisili", "surat pindah", "pindah keluar"],
+    "pendatang_masuk": ["pendatang", "kedatangan", "masuk domisili", "datang"],
+    "jam": ["jam", "buka", "operasional"],
+    "alamat": ["alamat", "lokasi", "kantor dimana", "dimana"],
+    "sidnok": ["sidnok", "online dukcapil", "layanan online", "online ktp", "online kk", "online akta"],
+    "faq": ["menu", "faq", "help", "bantuan", "panduan"],
+}
+
+FAQ_TEXT = (
+    "🧭 *Menu Bantuan / FAQ*\n"
+    "Contoh yang bisa diketik:\n"
+    "• `ktp hilang`, `ktp baru`, `ubah data ktp`, `masa berlaku ktp`\n"
+    "• `kk hilang`, `kk ubah alamat`, `kk ubah pekerjaan`, `kk status`, `kk golongan darah`, `gabung kk`, `pisah kk`\n"
+    "• `akta kelahiran`, `akta kelahiran hilang`\n"
+    "• `akta kematian`, `akta kematian hilang`\n"
+    "• `kia`, `pindah domisili`, `pendatang masuk`\n"
+    "• `jam`, `alamat`, `sidnok`"
+)
+
+
+def normalize(s: str) -> str:
+    return (s or "").lower().strip()
+
+
+def any_in(text: str, keywords: List[str]) -> bool:
+    t = normalize(text)
+    return any(k in t for k in keywords)
+
+
+def old_intent(user_text: str) -> Optional[str]:
+    t = normalize(user_text)
+
+    # KTP
+    if any_in(t, KW["ktp_hilang"]):
+        return "ktp_hilang"
+    if any_in(t, KW["ktp_baru"]) or ("ktp" in t and any_in(t, ["baru", "buat", "daftar", "pembuatan"])):
+        return "ktp_baru"
+    if any_in(t, KW["ktp_perpanjang"]):
+        return "ktp_perpanjang"
+    if "ktp" in t and any_in(t, ["ubah", "koreksi", "ganti", "perubahan"]):
+        return "ktp_ubah"
+
+    # KK
+    for key in ("kk_hilang", "kk_alamat", "kk_pekerjaan", "kk_status", "kk_goldar", "kk_gabung", "kk_pisah"):
+        if any_in(t, KW[key]):
+            return key
+
+    # Akta
+    for key in ("akta_lahir_hilang", "akta_lahir_umum", "akta_mati_hilang", "akta_mati_umum"):
+        if any_in(t, KW[key]):
+            return key
+
+    # KIA, Pindah / Datang, Sidnok / Info, FAQ
+    for key in ("kia", "pindah_keluar", "pendatang_masuk", "sidnok", "jam", "alamat", "faq"):
+        if any_in(t, KW[key]):
+            return key
+    return None
+
+
+# =========================================================
+# KASUS UJI
+# =========================================================
+def new_intent(text: str) -> Optional[str]:
+    return main.CONTENT.matcher.match(main.canonical(text))
+
+
+def faq_examples() -> List[str]:
+    lines = [ln for ln in FAQ_TEXT.splitlines() if ln.startswith("•")]
+    return [ex for ln in lines for ex in ln.split("`")[1::2]]
+
+
+EXTRA = ["ktp", "kk", "akta", "baru", "buat", "daftar", "ubah", "ganti", "koreksi", "perubahan",
+         "data", "hilang", "lahir", "mau", "tanya", "gimana", "caranya", "tolong", "saya", "anak"]
+
+
+def keyword_combos(n: int) -> List[str]:
+    rng = random.Random(SEED)
+    phrases = [p for alts in KW.values() for p in alts if p.replace(" ", "").isalnum()]
+    pool = phrases + EXTRA
+    out = []
+    for _ in range(n):
+        words = [rng.choice(pool) for _ in range(rng.randint(1, 4))]
+        if rng.random() < 0.3:
+            words = [w.upper() if rng.random() < 0.5 else w for w in words]
+        out.append(" ".join(words))
+    return out
+
+
+@pytest.mark.parametrize("text", faq_examples())
+def test_faq_examples_match_old_chain(text):
+    expected = old_intent(text)
+    assert new_intent(text) == expected
+    # contoh yang tak dikenali rantai lama (mis. `kk status`) kini ditangkap fuzzy
+    intent = main.lookup(text)[0]
+    assert intent == expected if expected is not None else intent is not None
+
+
+def test_keyword_combinations_match_old_chain():
+    for text in keyword_combos(5000):
+        assert new_intent(text) == old_intent(text), text
+
+
+def test_unknown_text_has_no_intent():
+    assert old_intent("selamat pagi") is None
+    assert new_intent("selamat pagi") is None
+
+
+@pytest.mark.parametrize(
+    "text, metric, labels",
+    [
+        ("ktp hilng", "dukcapil_fuzzy_hits_total", (("intent", "ktp_hilang"),)),
+        ("xyzzy qwerty", "dukcapil_retrieval_total", (("result", "none"),)),
+    ],
+)
+def test_cached_lookup_still_counts_metrics(monkeypatch, text, metric, labels):
+    monkeypatch.setattr(main, "METRICS", main.Metrics())
+    monkeypatch.setattr(main, "REPLY_CACHE", main.ReplyCache(16))
+    first = main.lookup(text)
+    assert main.lookup(text) == first
+    assert main.REPLY_CACHE.hits == 1
+    assert main.METRICS.values(metric) == {labels: 2.0}
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Uji OutboundLimiter: batas per chat hanya untuk pesan baru, dan bisa dimatikan."""
+
+import asyncio
+import time
+
+import pytest
+
+import main
+
+
+async def _ok(*args, **kwargs):
+    return True
+
+
+def _elapsed(limiter: main.OutboundLimiter, endpoint: str, n: int, chat_id: int = 1) -> float:
+    async def go():
+        start = time.perf_counter()
+        for _ in range(n):
+            await limiter.process_request(_ok, (), {}, endpoint, {"chat_id": chat_id}, None)
+        return time.perf_counter() - start
+
+    return asyncio.run(go())
+
+
+@pytest.fixture(autouse=True)
+def fast_chat_rate(monkeypatch):
+    # 20 pesan/detik per chat, burst 3: pesan ke-4 menunggu ~50 ms
+    monkeypatch.setattr(main, "RATE_CHAT_PER_SEC", 20.0)
+    monkeypatch.setattr(main, "RATE_CHAT_BURST", 3.0)
+    monkeypatch.setattr(main, "RATE_GLOBAL_PER_SEC", 1000.0)
+
+
+def test_send_message_waits_for_chat_budget():
+    assert _elapsed(main.OutboundLimiter(per_chat=True), "sendMessage", 5) >= 0.09
+
+
+def test_edits_do_not_use_chat_budget():
+    assert _elapsed(main.OutboundLimiter(per_chat=True), "editMessageText", 8) < 0.04
+
+
+def test_chat_budget_off_in_sequential_mode():
+    assert _elapsed(main.OutboundLimiter(per_chat=False), "sendMessage", 8) < 0.04
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Uji reload konten: kompilasi di luar event loop, snapshot & cache diganti
+bersamaan, dan berkas rusak tidak menggeser snapshot yang aktif."""
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def content_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CONTENT", main.CONTENT)  # dipulihkan sesudah tes
+    with open(main.CONTENT_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+    path = tmp_path / "konten.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    yield path, data
+    main.REPLY_CACHE.clear()  # jangan wariskan jawaban konten uji ke tes lain
+
+
+def test_reload_compiles_off_loop_and_clears_cache(content_file, monkeypatch):
+    path, data = content_file
+    data["vars"]["catatan"] = "Catatan versi baru."
+    path.write_text(json.dumps(data), encoding="utf-8")
+    threads = []
+    compile_content = main.compile_content
+
+    def spy(*args):
+        threads.append(threading.get_ident())
+        return compile_content(*args)
+
+    monkeypatch.setattr(main, "compile_content", spy)
+
+    async def scenario():
+        main.lookup("ktp hilang")
+        assert len(main.REPLY_CACHE)
+        old = main.CONTENT
+        assert await main.reload_content(str(path))
+        return old
+
+    old = asyncio.run(scenario())
+    assert threads and threads[0] != threading.get_ident()
+    assert main.CONTENT is not old and main.CONTENT.version != old.version
+    assert not len(main.REPLY_CACHE)
+    assert "Catatan versi baru." in main.lookup("ktp hilang")[1].parts[0]
+
+
+def test_broken_file_keeps_current_snapshot(content_file):
+    path, _ = content_file
+    path.write_text("{rusak", encoding="utf-8")
+    old = main.CONTENT
+    assert asyncio.run(main.reload_content(str(path))) is False
+    assert main.CONTENT is old
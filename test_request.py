@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Uji TunedRequest: transport terukur dipasang, proxy tetap dipakai, dan
+perubahan `_client_kwargs` PTB membuat start gagal keras."""
+
+import asyncio
+
+import httpcore
+import pytest
+
+import main
+
+
+def close(request):
+    asyncio.run(request.shutdown())
+
+
+def test_client_uses_instrumented_transport_with_long_keepalive():
+    request = main.TunedRequest("send", 7)
+    try:
+        transport = request._client._transport
+        assert isinstance(transport, main.InstrumentedTransport) and transport.pool == "send"
+        pool = transport._pool
+        assert isinstance(pool, httpcore.AsyncConnectionPool)
+        assert pool._max_connections == pool._max_keepalive_connections == 7
+        assert pool._keepalive_expiry == main.HTTP_KEEPALIVE_SEC
+        assert request._client.timeout.pool == main.HTTP_POOL_TIMEOUT
+    finally:
+        close(request)
+
+
+@pytest.mark.parametrize(
+    "url, pool_type, needs",
+    [
+        ("http://proxy.local:3128", httpcore.AsyncHTTPProxy, None),
+        ("socks5://proxy.local:1080", httpcore.AsyncSOCKSProxy, "socksio"),
+    ],
+)
+def test_proxy_is_kept(url, pool_type, needs):
+    if needs:
+        pytest.importorskip(needs)
+    request = main.TunedRequest("send", 2, proxy_url=url)
+    try:
+        transport = request._client._transport
+        assert isinstance(transport, main.InstrumentedTransport)
+        assert isinstance(transport._pool, pool_type)
+    finally:
+        close(request)
+
+
+@pytest.mark.parametrize("change", ["missing", "extra"])
+def test_unexpected_client_kwargs_fail_loudly(change):
+    request = main.TunedRequest("send", 2)
+    try:
+        kwargs = dict(request._client_kwargs)
+        if change == "missing":
+            del kwargs["proxies"]
+        else:
+            kwargs["socket_options"] = ()
+        request._client_kwargs = kwargs
+        with pytest.raises(RuntimeError, match="_client_kwargs"):
+            request._build_client()
+    finally:
+        close(request)
+
+
+def test_bot_requests_pass_proxy_setting(monkeypatch):
+    monkeypatch.setattr(main, "HTTP_PROXY_URL", "http://proxy.local:3128")
+    for request in main.bot_requests():
+        try:
+            assert request._client_kwargs["proxies"] == "http://proxy.local:3128"
+            assert isinstance(request._client._transport._pool, httpcore.AsyncHTTPProxy)
+        finally:
+            close(request)
+
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Uji properti SpaceSaving pada aliran miring (Zipf): frasa teratas
+ditemukan, dan tiap hitungan berada dalam batas galat yang dijanjikan."""
+
+import itertools
+import random
+from collections import Counter
+
+import pytest
+
+import main
+
+SEED = 20261017
+ITEMS = 2000
+LENGTH = 50_000
+
+
+def zipf_stream(rng, s):
+    weights = [1 / (rank ** s) for rank in range(1, ITEMS + 1)]
+    cum = list(itertools.accumulate(weights))
+    return [f"frasa {i}" for i in rng.choices(range(ITEMS), cum_weights=cum, k=LENGTH)]
+
+
+@pytest.mark.parametrize("capacity, s", [(50, 1.2), (100, 1.0), (20, 1.5)])
+def test_skewed_stream_guarantees(capacity, s):
+    rng = random.Random(SEED + capacity)
+    stream = zipf_stream(rng, s)
+    sketch = main.SpaceSaving(capacity)
+    for item in stream:
+        sketch.add(item)
+    truth = Counter(stream)
+
+    assert len(sketch) == capacity
+    assert sketch.total == LENGTH
+    # hitungan yang tergeser diwariskan, jadi jumlahnya tetap sama dengan total
+    assert sum(c for c, _ in sketch.counts.values()) == LENGTH
+    floor = min(c for c, _ in sketch.counts.values())
+    assert floor <= LENGTH // capacity
+    for item, (count, error) in sketch.counts.items():
+        # hitungan sebenarnya selalu di [count - error, count]
+        assert count - error <= truth[item] <= count
+        assert error <= floor
+    # frasa yang muncul lebih dari N/K kali pasti masih dihitung
+    for item, n in truth.items():
+        if n > LENGTH / capacity:
+            assert item in sketch.counts
+    # top-K: urutan pasti benar selama selisihnya melebihi galat
+    top = sketch.top(5)
+    assert [item for item, _, _ in top] == [item for item, _ in truth.most_common(5)]
+    assert [c for _, c, _ in top] == sorted((c for _, c, _ in top), reverse=True)
+
+
+def test_weighted_add_and_eviction_inherit_count():
+    sketch = main.SpaceSaving(2)
+    sketch.add("a", 5)
+    sketch.add("b", 2)
+    sketch.add("c")  # menggantikan b (terkecil) dan mewarisi 2
+    assert sketch.counts == {"a": [5, 0], "c": [3, 2]}
+    assert sketch.top(1) == [("a", 5, 0)]
+
+
+def test_dump_load_roundtrip_keeps_bounds():
+    rng = random.Random(SEED)
+    sketch = main.SpaceSaving(30)
+    for item in zipf_stream(rng, 1.2)[:5000]:
+        sketch.add(item)
+    copy = main.SpaceSaving(30)
+    copy.load(sketch.dump())
+    assert copy.counts == sketch.counts and copy.total == sketch.total
+    # heap dibangun ulang: penggusuran berikutnya tetap memilih yang terkecil
+    floor = min(c for c, _ in sketch.counts.values())
+    copy.add("frasa baru")
+    assert copy.counts["frasa baru"] == [floor + 1, floor]
+
+    smaller = main.SpaceSaving(10)  # kapasitas turun: yang tersering disimpan
+    smaller.load(sketch.dump())
+    assert [k for k, _, _ in smaller.top(10)] == [k for k, _, _ in sketch.top(10)]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Uji StateStore: offset hanya maju melewati update yang sudah selesai
+(walau selesai tidak berurutan), duplikat dikenali dari update_id persis,
+dan setelah restart update yang belum selesai diterima lagi."""
+
+import asyncio
+import random
+
+import pytest
+
+import main
+
+SEED = 20261017
+
+
+def test_offset_waits_for_lowest_unfinished_update():
+    store = main.StateStore("")
+    for uid in (101, 102, 103, 104):
+        assert store.accept(uid)
+    store.done(102)
+    store.done(104)
+    assert store.offset == 100  # 101 belum selesai
+    store.done(101)
+    assert store.offset == 102  # 103 masih menahan
+    store.done(103)
+    assert store.offset == 104
+
+
+def test_accept_rejects_exact_duplicates_only():
+    store = main.StateStore("")
+    assert store.accept(10) and store.accept(12)
+    assert not store.accept(10) and not store.accept(12)
+    assert store.accept(11)  # lebih kecil dari id terbesar tapi belum pernah diterima
+    for uid in (10, 11, 12):
+        store.done(uid)
+    assert store.offset == 12
+
+
+def test_dedup_window_moves_floor(monkeypatch):
+    monkeypatch.setattr(main, "DEDUP_WINDOW", 3)
+    store = main.StateStore("")
+    for uid in range(1, 6):
+        assert store.accept(uid)
+        store.done(uid)
+    # id 1 & 2 keluar dari jendela: tetap dianggap duplikat lewat floor
+    assert not any(store.accept(uid) for uid in range(1, 6))
+    assert store.accept(6)
+
+
+def test_offset_is_longest_finished_prefix_in_random_order():
+    rng = random.Random(SEED)
+    for _ in range(200):
+        store = main.StateStore("")
+        ids = sorted(rng.sample(range(1, 400), rng.randint(1, 40)))
+        for uid in ids:
+            store.accept(uid)
+        finished = set()
+        for uid in rng.sample(ids, len(ids)):
+            store.done(uid)
+            finished.add(uid)
+            pending = [i for i in ids if i not in finished]
+            # semua id <= offset selesai; id di bawah yang pertama tidak pernah ada
+            expected = min(pending[0] - 1, max(finished)) if pending else ids[-1]
+            assert store.offset == expected
+
+
+def test_resume_after_restart(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def first_run():
+        store = main.StateStore(path)
+        await store.start()
+        for uid in range(1, 6):
+            store.accept(uid)
+        for uid in (1, 2, 4, 5):  # 3 belum selesai saat proses berhenti
+            store.done(uid)
+        store.set(42, lang="en", subscribed=1)
+        store.set_meta("broadcast", "x")
+        await store.close()  # flush terakhir
+
+    async def second_run():
+        store = main.StateStore(path)
+        await store.start()
+        try:
+            assert store.offset == 2
+            assert store.chats[42].lang == "en" and store.chats[42].subscribed == 1
+            assert store.meta == {"broadcast": "x"}
+            # Telegram mengirim ulang semua id > offset yang tersimpan
+            assert not store.accept(2)
+            assert store.accept(3) and store.accept(4) and store.accept(5)
+            for uid in (5, 3, 4):
+                store.done(uid)
+            assert store.offset == 5
+            await store.flush()
+        finally:
+            await store.close()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+
+    reopened = main.StateStore(path)
+    reopened.open()
+    try:
+        assert reopened.offset == 5
+    finally:
+        reopened._db.close()
+
+
+def test_flush_writes_only_when_something_changed(monkeypatch):
+    store = main.StateStore(":memory:")
+    store.open()
+    writes = []
+    write = store._write
+    monkeypatch.setattr(store, "_write", lambda *a: (writes.append(a), write(*a))[1])
+
+    async def scenario():
+        await store.flush()
+        assert writes == []
+        store.accept(7)
+        store.done(7)
+        await store.flush()
+        await store.flush()
+        assert len(writes) == 1
+
+    try:
+        asyncio.run(scenario())
+        assert writes[0][1] == [("update_offset", "7")]
+        assert store._db.execute("SELECT value FROM meta WHERE key = 'update_offset'").fetchone() == ("7",)
+    finally:
+        store._db.close()
+
+
+@pytest.mark.parametrize("shard", [0, 1])
+def test_shard_loads_own_chats_and_offset(tmp_path, shard):
+    path = str(tmp_path / "state.db")
+    main.prepare_state_db(path)
+    stores = [main.StateStore(path, i, 2) for i in range(2)]
+    for i, store in enumerate(stores):
+        store.open()
+        store.set(10 + i, lang="id")  # 10 milik worker 0, 11 milik worker 1
+        store.accept(100 + i)
+        store.done(100 + i)
+        asyncio.run(store.flush())
+        store._db.close()
+
+    again = main.StateStore(path, shard, 2)
+    again.open()
+    try:
+        assert set(again.chats) == {10 + shard}
+        assert again.offset == 100 + shard
+    finally:
+        again._db.close()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Uji Supervisor tanpa proses sungguhan: pembagian update, konfirmasi offset
+ke Telegram hanya sampai update yang sudah selesai, dan kirim ulang ke
+worker yang dijalankan ulang."""
+
+import json
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+class FakeQueue(queue.Queue):
+    def cancel_join_thread(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeProcess:
+    def __init__(self, target, args, name, daemon):
+        self.pid = 0
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+
+@pytest.fixture
+def sup():
+    s = main.Supervisor(2)
+    s.ctx = SimpleNamespace(Queue=FakeQueue, Process=FakeProcess)
+    s.start()
+    return s
+
+
+def _msg(update_id: int, chat_id: int, text: str = "ktp hilang") -> dict:
+    chat = {"id": chat_id, "type": "private"}
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "chat": chat, "text": text}}
+
+
+def _drain(q: queue.Queue) -> list:
+    out = []
+    while not q.empty():
+        out.append(json.loads(q.get_nowait())["update_id"])
+    return out
+
+
+def test_ack_waits_for_slowest_worker(sup):
+    for uid in range(1, 7):
+        sup.route(_msg(uid, chat_id=uid % 2))  # genap -> worker 0, ganjil -> worker 1
+    assert sup.acked() == 0
+    sup.done[0].value = 6  # worker 0 selesai 2, 4, 6
+    sup.done[1].value = 1  # worker 1 baru selesai 1; 3 & 5 masih diproses
+    assert sup.acked() == 2
+    sup.done[1].value = 5
+    assert sup.acked() == 6
+    assert sup.pending == [{}, {}]
+
+
+def test_restarted_worker_gets_unfinished_updates(sup):
+    for uid in (10, 11, 12, 13):
+        sup.route(_msg(uid, chat_id=1))
+    assert _drain(sup.inboxes[1]) == [10, 11, 12, 13]
+    sup.done[1].value = 11
+    sup.spawn(1)  # worker 1 mati: antrean lama hilang
+    assert _drain(sup.inboxes[1]) == [12, 13]
+    assert sup.acked() == 11
+
+
+def test_broadcast_goes_to_one_worker(sup):
+    sup.route(_msg(1, chat_id=7, text="/broadcast Kantor tutup"))
+    assert (_drain(sup.inboxes[0]), _drain(sup.inboxes[1])) == ([1], [])